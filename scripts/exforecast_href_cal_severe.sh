@@ -24,7 +24,8 @@ do
 done
 
 # COLDSTART check
-# Remove existing grib2 and pickle files for current cycle if YES
+# Remove existing grib2 files for current cycle if YES
+# (launch_href_cal_severe.py then recomputes the UH probabilities with --coldstart)
 if [ ${COLDSTART} == "YES" ]; then
     for grib_file in ${grib_files[@]}
     do
@@ -33,15 +34,6 @@ if [ ${COLDSTART} == "YES" ]; then
             rm $COMOUTspc_post/severe/${grib_file}
         fi
     done
-    if [ $cyc -eq 00 -o $cyc -eq 06 ]; then
-        pickle_file="${COMOUTspc_post}/spc_pickle/uhProbs_${PDY}00f${fhour_pad}.pickle"
-    else
-        pickle_file="${COMOUTspc_post}/spc_pickle/uhProbs_${PDY}12f${fhour_pad}.pickle"
-    fi
-        if [ -f ${pickle_file} ]; then
-            echo "COLDSTART - removing ${pickle_file}"
-            rm ${pickle_file}
-        fi
 fi
 
 # start forecast
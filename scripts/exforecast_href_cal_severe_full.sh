@@ -11,10 +11,10 @@ set -x
 
 # get output file names
 grib_files=()
-if [ $cyc == '00' ]; then fhour=036; cyc_tmp=$cyc; fi
-if [ $cyc == '06' ]; then fhour=033; cyc_tmp=03; fi
-if [ $cyc == '12' ]; then fhour=024; cyc_tmp=$cyc; fi
-if [ $cyc == '18' ]; then fhour=021; cyc_tmp=15; fi
+if [ $cyc == '00' ]; then fhour=036; cyc_tmp=$cyc; sref_run=${PDYm1}21; fi
+if [ $cyc == '06' ]; then fhour=033; cyc_tmp=03; sref_run=${PDY}03; fi
+if [ $cyc == '12' ]; then fhour=024; cyc_tmp=$cyc; sref_run=${PDY}09; fi
+if [ $cyc == '18' ]; then fhour=021; cyc_tmp=15; sref_run=${PDY}15; fi
 for domain in hail wind tor
 do
     grib_file="href_cal_${domain}.t${cyc_tmp}z.24hr.f${fhour}.grib2"
@@ -22,7 +22,7 @@ do
 done
 
 # COLDSTART check
-# Remove existing grib2 and pickcle files for current cycle if YES
+# Remove existing grib2, calibrated 4hr files and SREF cache for current cycle if YES
 if [ ${COLDSTART} == "YES" ]; then
     for grib_file in ${grib_files[@]}
     do
@@ -31,11 +31,12 @@ if [ ${COLDSTART} == "YES" ]; then
             rm $COMOUTspc_post/severe/${grib_file}
         fi
     done
-    pickle_file="${COMOUTspc_post}/spc_pickle/uhProbs_${PDY}${cyc_tmp}.pickle"
-    if [ -f ${pickle_file} ]; then
-        echo "COLDSTART - removing ${pickle_file}"
-        rm ${pickle_file}
-    fi
+    cal4_files="${COMOUTspc_post}/spc_pickle/cal4/cal4_${PDY}${cyc_tmp}_f*.npz"
+    echo "COLDSTART - removing ${cal4_files}"
+    rm -f ${cal4_files}
+    sref_cache="${COMOUTspc_post}/spc_pickle/sref_env_${sref_run}.npz"
+    echo "COLDSTART - removing ${sref_cache}"
+    rm -f ${sref_cache}
 fi
 
 
@@ -16,7 +16,7 @@ hiresw_directory="${COMINhiresw}/hiresw.${PDY}/"
 spc_post_severe="${COMOUTspc_post}/spc_pickle/"
 
 # COLDSTART check
-# Remove all existing grib2 and pickle files for current cycle if YES
+# Remove all existing grib2 files and UH probabilities for current cycle if YES
 if [ ${COLDSTART} == "YES" ]; then
     if [ $cyc -eq 00 -o $cyc -eq 12 ]; then cyc_tmp=$cyc; fi
     if [ $cyc -eq 06 ]; then cyc_tmp=03; fi
@@ -24,11 +24,11 @@ if [ ${COLDSTART} == "YES" ]; then
     echo "COLDSTART - removing ${COMOUTspc_post}/severe/href_cal_*.t${cyc_tmp}z.*.grib2"
     rm ${COMOUTspc_post}/severe/href_cal_*.t${cyc_tmp}z.*.grib2
     if [ $cyc_tmp -eq 00 -o $cyc_tmp -eq 03 ]; then
-        echo "COLDSTART - removing ${spc_post_severe}uhProbs_${PDY}00f*.pickle"
-        rm ${spc_post_severe}uhProbs_${PDY}00*.pickle
+        echo "COLDSTART - removing ${spc_post_severe}uhProbs_${PDY}00.dat/.idx"
+        rm ${spc_post_severe}uhProbs_${PDY}00.*
     else
-        echo "COLDSTART - removing ${spc_post_severe}uhProbs_${PDY}12f*.pickle"
-        rm ${spc_post_severe}uhProbs_${PDY}12*.pickle
+        echo "COLDSTART - removing ${spc_post_severe}uhProbs_${PDY}12.dat/.idx"
+        rm ${spc_post_severe}uhProbs_${PDY}12.*
     fi
 fi
 
@@ -68,6 +68,12 @@ elif [ $cyc -eq 18 ]; then
    num_jobs=17
 fi
 
+# COLDSTART - also remove the SREF environment cache of the cycle
+if [ ${COLDSTART} == "YES" ]; then
+    echo "COLDSTART - removing ${spc_post_severe}sref_env_${sref_date}${sref_run}.npz"
+    rm -f ${spc_post_severe}sref_env_${sref_date}${sref_run}.npz
+fi
+
 declare -a severe_released=( $(for i in `seq 1 $num_jobs`; do echo 0; done) )
 
 sref_directory="${COMINspcsref}/spcsref.${sref_date}/gempak/"
@@ -175,17 +181,13 @@ do
                 echo " Waiting for f${forecast_hour_padded} file to arrive for ${sref_run}Z SREF."
             fi
         done
-        # Check for 4hr pickle file dependencies
-        for hour in `seq ${start_4hr} ${end_4hr}` 
-        do
-            fhour=`printf %03d ${hour}`
-            spc_4hr_pickle_file=${spc_post_severe}uhProbs_${PDY}${ahour}f${fhour}.pickle
-            if [ -f $spc_4hr_pickle_file ]; then
-                echo "Found ${spc_4hr_pickle_file}"
-                ((num_files++))
-            fi
-        done  
-        echo "${num_files} of ${num_files_required} pickle files found!" 
+        # Check for 4hr UH probability dependencies
+        # (one byte per forecast hour in the validity index of the UH probability store)
+        spc_4hr_uh_index=${spc_post_severe}uhProbs_${PDY}${ahour}.idx
+        if [ -f $spc_4hr_uh_index ]; then
+            num_files=`od -An -tu1 -v -j ${start_4hr} -N ${num_files_required} $spc_4hr_uh_index | tr -s ' ' '\n' | grep -c '^1$'`
+        fi
+        echo "${num_files} of ${num_files_required} 4hr UH probability hours found in ${spc_4hr_uh_index}!" 
         echo "${sref_fp_files_available} of ${sref_fp_files_required} sref files found!"
         if [ $num_files -eq $num_files_required ] && [ $sref_fp_files_available -eq $sref_fp_files_required ]; then
             echo "All files are available for ${PDY} ${cyc}Z HREF/SREF Calibrated Severe Full Period! Releasing..."
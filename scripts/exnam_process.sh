@@ -15,6 +15,8 @@
 #       nam.tHHz.conusnest.camfldFF.tm00.grib2
 #   Output Files (subset of needed variables with 1-hr precip):
 #       nam.tHHz.conusnest.camfldFF.tm00.grib2
+#   NAM_PROCESS=python (default) subsets and de-accumulates in one pass per file
+#   with ush/href_calib_thunder/process_nam.py; NAM_PROCESS=wgrib2 uses wgrib2.
 #
 
 set -x
@@ -29,8 +31,17 @@ data_directory="${COMINnam}/nam.${yyyymmdd}/"
 #preprocess_directory="${COMOUT}/spc_nam.${yyyymmdd}/"
 preprocess_directory="${COMOUTspc_nam}/"
 
-# set processing directories
 forecasthour_pad=`printf %02d ${forecasthour}`
+
+if [ "${NAM_PROCESS:-python}" != "wgrib2" ]; then
+    coldstart=""
+    if [ "${COLDSTART}" == "YES" ]; then coldstart="-c"; fi
+    python ${USHspc_post}/href_calib_thunder/process_nam.py -i ${data_directory} -o ${preprocess_directory} \
+        -d ${yyyymmdd}${run} -f ${forecasthour} ${coldstart}
+    exit $?
+fi
+
+# set processing directories
 tmp_directory="${DATA}/href_calib_thunder/f${forecasthour_pad}/"
 all_directory="${tmp_directory}nam_all/"
 group_directory="${tmp_directory}nam_group/"
@@ -0,0 +1,415 @@
+# Program Name: SPC POST multi-cycle backfill
+# Affiliation: NOAA/NWS/Storm Prediction Center
+# Abstract: Reruns HREF Calibrated Thunder and HREF/SREF Calibrated Severe over a
+#           range of archived cycles (after a calibration update, or to rebuild an
+#           archive). Every job of every cycle is scheduled on one process pool
+#           in place of the per-job driver scripts: nothing waits for files to
+#           arrive, the fix data and grid maps are read once per worker process,
+#           and full period jobs start as soon as the jobs they need are done.
+#           Throughput is reported in cycles per hour.
+#
+# Usage:
+#   python backfill.py -s YYYYMMDDHH -e YYYYMMDDHH -c COM [-o OUT] [-p nam thunder severe]
+#                      [-n NPROCS] [-w WORK] [-r REPORT]
+#
+#   COM holds the archived inputs under the operational COM roots
+#   (hiresw/, hrrr/, nam/, spcsref/). Products are written to
+#   OUT/spc_post.YYYYMMDD/{thunder,severe,spc_pickle}. Thunder reads the
+#   processed NAM nest from OUT/spc_post.YYYYMMDD/spc_nam, so include the nam
+#   product unless it is already there. Thunder hours already in OUT are
+#   skipped like a rerun, so write reforecasts to a fresh OUT.
+
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import datetime
+import traceback
+import contextlib
+from multiprocessing import Pool
+
+USH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THUNDER = os.path.join(USH, 'href_calib_thunder')
+SEVERE = os.path.join(USH, 'href_calib_severe')
+sys.path.insert(0, os.path.join(USH, 'replay'))
+sys.path.insert(0, SEVERE)
+sys.path.insert(0, THUNDER)
+from replay_cycle import SEVERE_RUNS, THUNDER_FULL
+from calib_severe.engine import CYCLE_HOURS
+
+PRODUCTS = ['nam', 'thunder', 'severe']
+
+# Last forecast hour of the NAM nest chunks processed for thunder
+NAM_HOURS = 60
+
+# Thunder variables (same as forecast_href_cal_thunder.py)
+THUNDER_PARAMS = ['Reflectivity', 'Precipitation', 'Lifted Index']
+
+# Severe update runs and the run whose UH probabilities they reuse
+SEVERE_UPDATES = {
+    '03': '00',
+    '15': '12'
+}
+
+
+def get_options():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--start', type=str, metavar='YYYYMMDDHH', required=True,
+                        help='First HREF cycle (YYYYMMDDHH)')
+    parser.add_argument('-e', '--end', type=str, metavar='YYYYMMDDHH', required=True,
+                        help='Last HREF cycle (YYYYMMDDHH)')
+    parser.add_argument('-c', '--com', type=str, metavar='COM', required=True,
+                        help='Root of the archived inputs (hiresw, hrrr, nam, spcsref)')
+    parser.add_argument('-o', '--out', type=str, metavar='', default=None,
+                        help='Root of the spc_post.YYYYMMDD output trees (default: COM/spc_post)')
+    parser.add_argument('-p', '--products', nargs='+', metavar='', default=['thunder', 'severe'],
+                        choices=PRODUCTS, help='Products to run (default: thunder severe)')
+    parser.add_argument('--cycles', nargs='+', metavar='', default=['00', '12'], choices=['00', '12'],
+                        help='HREF cycles of each day to run (default: 00 12)')
+    parser.add_argument('-f', '--fix_dir', type=str, metavar='',
+                        default=os.environ.get('FIXspc_post', os.path.join(os.path.dirname(USH), 'fix')),
+                        help='Location of the fix directory (default: $FIXspc_post or ../fix)')
+    parser.add_argument('--hrw', type=str, metavar='', default=os.environ.get('COMINhrw_string', 'fv3'),
+                        choices=['fv3', 'nmmb'], help='HIRESW members (default: $COMINhrw_string or fv3)')
+    parser.add_argument('-n', '--nprocs', type=int, metavar='', default=os.cpu_count(),
+                        help='Worker processes (default: number of CPUs)')
+    parser.add_argument('-w', '--work', type=str, metavar='', default='backfill_work',
+                        help='Scratch space and job logs (default: ./backfill_work)')
+    parser.add_argument('-r', '--report', type=str, metavar='', default=None,
+                        help='Throughput report (default: WORK/backfill_report.json)')
+    return parser.parse_args()
+
+
+def get_cycles(start, end, hours):
+    """HREF cycles of a date range
+
+    :param start: First cycle (YYYYMMDDHH)
+    :param end: Last cycle (YYYYMMDDHH)
+    :param hours: List of cycle hours to keep ('00', '12')
+    :return: List of datetime objects
+    """
+
+    cycle = datetime.datetime.strptime(start[:8], '%Y%m%d')
+    start = datetime.datetime.strptime(start, '%Y%m%d%H')
+    end = datetime.datetime.strptime(end, '%Y%m%d%H')
+    cycles = []
+    while cycle <= end:
+        if cycle >= start and cycle.strftime('%H') in hours:
+            cycles.append(cycle)
+        cycle += datetime.timedelta(hours=12)
+    return cycles
+
+
+def cycle_dirs(args, cycle):
+    """Locations used by the jobs of a cycle
+
+    :param args: Parsed command line arguments
+    :param cycle: Datetime object with the HREF cycle
+    :return: Dictionary of directories
+    """
+
+    out = os.path.join(args.out, f'spc_post.{cycle.strftime("%Y%m%d")}')
+    return {
+        'hiresw': os.path.join(args.com, 'hiresw'),
+        'hrrr': os.path.join(args.com, 'hrrr'),
+        'nam': os.path.join(args.com, 'nam'),
+        'sref': os.path.join(args.com, 'spcsref'),
+        'spc_post': os.path.join(args.out, ''),
+        'spc_nam': os.path.join(out, 'spc_nam'),
+        'thunder': os.path.join(out, 'thunder', ''),
+        'severe': os.path.join(out, 'severe', ''),
+        'pickle': os.path.join(out, 'spc_pickle'),
+        'fix': args.fix_dir,
+        'work': os.path.join(args.work, cycle.strftime('%Y%m%d%H'))
+    }
+
+
+def nam_task(cycle, dirs):
+    """Preprocess the NAM nest of a cycle for thunder
+
+    :param cycle: Datetime object with the cycle
+    :param dirs: Dictionary from cycle_dirs()
+    """
+
+    from calib_thunder.io import nam_io
+
+    in_dir = os.path.join(dirs['nam'], f'nam.{cycle.strftime("%Y%m%d")}')
+    missing = []
+    for fhour in range(3, NAM_HOURS + 1, 3):
+        nam_io.process_chunk(in_dir, dirs['spc_nam'], cycle, fhour)
+        missing += [hour for hour in nam_io.chunk_hours(fhour)
+                    if not nam_io.is_processed(dirs['spc_nam'], cycle, hour)]
+    if missing:
+        raise RuntimeError(f'Unable to process NAM forecast hours {missing}')
+    return
+
+
+def thunder_task(cycle, dirs, job):
+    """One thunder job of a cycle (see gen_thunder_grids.py)
+
+    :param cycle: Datetime object with the cycle
+    :param dirs: Dictionary from cycle_dirs()
+    :param job: Job number (1 - 48 for 1hr/4hr, 49+ for the full period)
+    """
+
+    import gen_thunder_grids
+    from calib_thunder.io import lightning_io
+    from calib_thunder.io import exceed_cache
+    from calib_thunder.data.lightning import Lightning
+
+    gen_thunder_grids.fix_dir = os.path.join(dirs['fix'], 'href_calib_thunder', '')
+    lats, lons = lightning_io.get_grid(os.path.join(THUNDER, lightning_io.GRID_LOC))
+    ltg_object = Lightning(cycle, lats, lons)
+    os.makedirs(dirs['thunder'], exist_ok=True)
+    cache_dir = os.path.join(dirs['pickle'], 'thunder_exceed', '')
+    grid_args = (ltg_object, cycle)
+    dir_args = (dirs['hiresw'], dirs['spc_post'], dirs['hrrr'], dirs['thunder'], THUNDER_PARAMS,
+                os.path.join(THUNDER, ''))
+    if job <= 48:
+        # Archived files won't arrive later, so use what is there right away
+        gen_thunder_grids.gen_hour_forecast(*grid_args, [job], *dir_args, False, deadline=0,
+                                            min_members=1, wait=0, cache_dir=cache_dir)
+    else:
+        start = ([0] + list(THUNDER_FULL[cycle.strftime('%H')].values()))[job - 49]
+        fhours = list(range(start, THUNDER_FULL[cycle.strftime('%H')][job] + 1))
+        gen_thunder_grids.gen_full_forecast(*grid_args, fhours, *dir_args, False,
+                                            cache_dir=cache_dir)
+    exceed_cache.prune(cache_dir, exceed_cache.BUDGET * 2**20)
+    return
+
+
+def severe_task(cycle, dirs, run, fhour):
+    """One severe job of a cycle (see forecast_href_cal_severe.py)
+
+    :param cycle: Datetime object with the HREF cycle
+    :param dirs: Dictionary from cycle_dirs()
+    :param run: Cycle used for calibration ('00', '03', '12' or '15')
+    :param fhour: Forecast hour (e.g. '016') or 'full'
+    """
+
+    from calib_severe.engine import SevereEngine
+
+    engine_dirs = {
+        'tmp': os.path.join(dirs['work'], f'severe_{run}z_f{fhour}', ''),
+        'grib': dirs['severe'],
+        'nam': dirs['nam'],
+        'sref': dirs['sref'],
+        'hrrr': dirs['hrrr'],
+        'hiresw': dirs['hiresw'],
+        'fix': os.path.join(dirs['fix'], 'href_calib_severe', ''),
+        'pickle': dirs['pickle'],
+        'uhcache': os.path.join(dirs['pickle'], 'uh_masks', ''),
+        'cal4': os.path.join(dirs['pickle'], 'cal4', '')
+    }
+    for d in ['tmp', 'grib', 'pickle']:
+        os.makedirs(engine_dirs[d], exist_ok=True)
+
+    # The pool already fills the node, so each job extracts its members serially
+    engine = SevereEngine(run, cycle.strftime('%Y%m%d'), fhour, engine_dirs, cap=True, nprocs=1,
+                          fv3=os.environ['COMINhrw_string'] == 'fv3', deadline=0, min_members=1, wait=0)
+    engine.forecast()
+    return
+
+
+TASKS = {
+    'nam': nam_task,
+    'thunder': thunder_task,
+    'severe': severe_task
+}
+
+
+def cycle_tasks(args, cycle):
+    """Jobs of one cycle in the order they are released
+
+    :param args: Parsed command line arguments
+    :param cycle: Datetime object with the HREF cycle
+    :return: List of task dictionaries with a name, product, function
+        arguments and the names of the tasks it depends on
+    """
+
+    dirs = cycle_dirs(args, cycle)
+    tag = cycle.strftime('%Y%m%d%H')
+    tasks = []
+    if 'nam' in args.products:
+        tasks.append({'name': f'{tag}_nam', 'product': 'nam', 'args': (cycle, dirs), 'deps': []})
+
+    if 'thunder' in args.products:
+        deps = []
+        if 'nam' in args.products:
+            # the time-lagged NAM member is the previous cycle's run
+            deps = [f'{tag}_nam', f'{(cycle - datetime.timedelta(hours=12)).strftime("%Y%m%d%H")}_nam']
+        for job in range(1, 49):
+            tasks.append({'name': f'{tag}_thunder_f{str(job).zfill(2)}', 'product': 'thunder',
+                          'args': (cycle, dirs, job), 'deps': deps})
+        for job, end in THUNDER_FULL[cycle.strftime('%H')].items():
+            tasks.append({'name': f'{tag}_thunder_full{job}', 'product': 'thunder', 'args': (cycle, dirs, job),
+                          'deps': [f'{tag}_thunder_f{str(j).zfill(2)}' for j in range(1, end + 1)]})
+
+    if 'severe' in args.products:
+        for run in SEVERE_RUNS[cycle.strftime('%H')]:
+            names = []
+            for fhour in range(CYCLE_HOURS[run][0], CYCLE_HOURS[run][1]+1):
+                name = f'{tag}_severe_{run}z_f{str(fhour).zfill(3)}'
+                names.append(name)
+                # the 03Z/15Z job loads the UH probabilities the 00Z/12Z job of the
+                # same forecast hour writes for the same HREF lead, as in operations
+                deps = []
+                if run in SEVERE_UPDATES:
+                    deps = [f'{tag}_severe_{SEVERE_UPDATES[run]}z_f{str(fhour).zfill(3)}']
+                tasks.append({'name': name, 'product': 'severe',
+                              'args': (cycle, dirs, run, str(fhour).zfill(3)), 'deps': deps})
+            tasks.append({'name': f'{tag}_severe_{run}z_full', 'product': 'severe',
+                          'args': (cycle, dirs, run, 'full'), 'deps': names})
+    return tasks
+
+
+def run_task(task, log_dir):
+    """Run one task in a worker, logging its output to a file
+
+    :param task: Task dictionary from cycle_tasks()
+    :param log_dir: Where to write the log
+    :return: Dictionary with the task name, product, status, message and timing
+    """
+
+    os.makedirs(log_dir, exist_ok=True)
+    result = {'name': task['name'], 'product': task['product'], 'status': 'ok', 'message': '',
+              'start': time.time()}
+    with open(os.path.join(log_dir, f'{task["name"]}.log'), 'w') as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                TASKS[task['product']](*task['args'])
+            except SystemExit as e:
+                # gen_thunder_grids exits when there are no members at all
+                result.update(status='failed', message=f'exit {e.code}')
+            except Exception as e:
+                traceback.print_exc()
+                result.update(status='failed', message=str(e))
+    result['end'] = time.time()
+    result['seconds'] = result['end'] - result['start']
+    return result
+
+
+def backfill(tasks, nprocs, log_dir):
+    """Run tasks on a process pool, releasing each one once its dependencies are done
+
+    A task whose dependencies failed still runs, like the operational
+    managers, and makes what it can from the outputs that exist.
+
+    :param tasks: List of task dictionaries, in the order they should start
+    :param nprocs: Number of worker processes
+    :param log_dir: Where to write the task logs
+    :return: List of result dictionaries from run_task()
+    """
+
+    names = set(task['name'] for task in tasks)
+    pending = list(tasks)
+    done = set()
+    results = []
+    finished = queue.Queue()
+    with Pool(nprocs) as pool:
+        running = 0
+        while pending or running:
+            # dependencies outside the backfill (e.g. the cycle before the range) are already there
+            ready = [task for task in pending if all(dep in done or dep not in names for dep in task['deps'])]
+            for task in ready:
+                pending.remove(task)
+                pool.apply_async(run_task, (task, log_dir), callback=finished.put,
+                                 error_callback=lambda e, name=task['name'], product=task['product']:
+                                 finished.put({'name': name, 'product': product, 'status': 'failed',
+                                               'message': str(e), 'seconds': 0.}))
+                running += 1
+            result = finished.get()
+            running -= 1
+            done.add(result['name'])
+            results.append(result)
+            if result['status'] != 'ok':
+                print(f'WARNING: {result["name"]} failed ({result["message"]}), see {log_dir}/{result["name"]}.log')
+            if len(results) % 50 == 0 or not (pending or running):
+                print(f'{len(results)} of {len(tasks)} jobs done')
+    return results
+
+
+def summarize(results, cycles, elapsed, nprocs):
+    """Throughput of the backfill
+
+    :param results: List of dictionaries from run_task()
+    :param cycles: List of datetime objects with the cycles run
+    :param elapsed: Wall time of the backfill (seconds)
+    :param nprocs: Number of worker processes
+    :return: Dictionary for the report
+    """
+
+    hours = max(elapsed, 1e-9) / 3600.
+    summary = {
+        'cycles': len(cycles),
+        'first_cycle': cycles[0].strftime('%Y%m%d%H'),
+        'last_cycle': cycles[-1].strftime('%Y%m%d%H'),
+        'nprocs': nprocs,
+        'elapsed_seconds': elapsed,
+        'cycles_per_hour': len(cycles) / hours,
+        'jobs': len(results),
+        'failed': sorted(r['name'] for r in results if r['status'] != 'ok'),
+        'products': {}
+    }
+    for product in PRODUCTS:
+        times = [r['seconds'] for r in results if r['product'] == product]
+        if not times:
+            continue
+        summary['products'][product] = {
+            'jobs': len(times),
+            'job_seconds': sum(times),
+            'max_job_seconds': max(times),
+            'job_seconds_per_cycle': sum(times) / len(cycles)
+        }
+    return summary
+
+
+def main():
+    args = get_options()
+    args.com = os.path.abspath(args.com)
+    args.out = os.path.abspath(args.out if args.out is not None else os.path.join(args.com, 'spc_post'))
+    args.fix_dir = os.path.abspath(args.fix_dir)
+    args.work = os.path.abspath(args.work)
+    report = args.report if args.report is not None else os.path.join(args.work, 'backfill_report.json')
+    log_dir = os.path.join(args.work, 'logs')
+
+    cycles = get_cycles(args.start, args.end, args.cycles)
+    if not cycles:
+        print(f'FATAL ERROR: No {"/".join(args.cycles)}Z cycles between {args.start} and {args.end}')
+        sys.exit(1)
+
+    # the workers inherit the environment the drivers would read
+    os.environ['COMINhrw_string'] = args.hrw
+
+    tasks = []
+    for cycle in cycles:
+        tasks.extend(cycle_tasks(args, cycle))
+    print(f'Backfilling {len(cycles)} cycles ({cycles[0].strftime("%Y%m%d %H")}z - '
+          f'{cycles[-1].strftime("%Y%m%d %H")}z): {len(tasks)} {" ".join(args.products)} jobs '
+          f'on {args.nprocs} processes')
+
+    start = time.time()
+    results = backfill(tasks, args.nprocs, log_dir)
+    summary = summarize(results, cycles, time.time() - start, args.nprocs)
+
+    os.makedirs(os.path.dirname(os.path.abspath(report)), exist_ok=True)
+    with open(report, 'w') as f:
+        json.dump({'summary': summary, 'jobs': results}, f, indent=2)
+
+    print(f'\n{summary["cycles"]} cycles in {summary["elapsed_seconds"] / 3600.:.2f} hours '
+          f'({summary["cycles_per_hour"]:.2f} cycles/hour)')
+    for product, stats in summary['products'].items():
+        print(f'  {product}: {stats["jobs"]} jobs, {stats["job_seconds_per_cycle"]:.0f} job-seconds per cycle, '
+              f'slowest job {stats["max_job_seconds"]:.0f} s')
+    if summary['failed']:
+        print(f'WARNING: {len(summary["failed"])} jobs failed, see {log_dir}')
+    print(f'Wrote {report}')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# Program Name: HREF/SREF Calibrated Severe benchmarks
+# Affiliation: NOAA/NWS/Storm Prediction Center
+# Abstract: Times each stage of the severe pipeline (UH exceedance, neighborhood
+#           probabilities, binning, 4-hour and full period calibration, gdlist
+#           parsing, GEMPAK grid reading and GRIB2 output) on synthetic inputs,
+#           and checks every stage against the original implementations in
+#           calib_severe/benchmark/reference.py (GEMPAK grids against gdlist
+#           text of the same grids). No operational data is needed.
+#
+# Usage:
+#   python benchmark_severe.py [-s SCALE] [-r REPEATS] [-t STAGE ...] [-o OUTPUT] [-c OLD_OUTPUT]
+#   --scale 1 runs on the full 3 km grid; the default is a quick quarter resolution run.
+#   Exits with status 1 if any stage doesn't match its reference.
+
+import sys
+import shutil
+import argparse
+import datetime
+import tempfile
+import numpy as np
+from calib_severe.benchmark import synthetic
+from calib_severe.benchmark import reference
+from calib_severe.benchmark import measure
+from calib_severe.calibration import calibrate
+from calib_severe.io import gdlist
+from calib_severe.io import gempak
+
+STAGES = ['uh_grid', 'neighborhood_probs', 'binhaz', 'calibrate_4hr', 'calibrate_4hr_fused',
+          'calibrate_full', 'read_gdlist', 'read_gempak', 'save_grib']
+
+# SREF variables by hazard (same as the engine)
+HAZARDS = {
+    'tor': ['sigtp1'],
+    'hail': ['hicapep1000', 'eshrp20'],
+    'wind': ['hicapep250', 'eshrp20']
+}
+
+# SREF hours of the benchmarked 4-hour window and the hours of a full period
+SREF_HOURS = ['018', '021']
+FULL_HOURS = 21
+
+
+def get_options():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--stages', type=str, nargs='+', metavar='', default=STAGES,
+                        choices=STAGES, help='Stages to run (default: all)')
+    parser.add_argument('-s', '--scale', type=float, metavar='', default=0.25,
+                        help='Resolution of the HREF grid as a fraction of 3 km (default: 0.25)')
+    parser.add_argument('-m', '--members', type=int, metavar='', default=10,
+                        help='Number of ensemble members (default: 10)')
+    parser.add_argument('-r', '--repeats', type=int, metavar='', default=3,
+                        help='Timed runs of each stage (default: 3)')
+    parser.add_argument('-S', '--seed', type=int, metavar='', default=0,
+                        help='Random seed of the synthetic inputs (default: 0)')
+    parser.add_argument('-o', '--output', type=str, metavar='', default='severe_benchmark.json',
+                        help='Results file (default: severe_benchmark.json)')
+    parser.add_argument('-c', '--compare', type=str, metavar='', default=None,
+                        help='Results file of an earlier run to compare with')
+    return parser.parse_args()
+
+
+def predictors(env):
+    """SREF predictors of every hazard over the window (missing values are 0)
+
+    :param env: SREF environment from synthetic.sref_env()
+    :return: 3D array (hazard, ny, nx)
+    """
+
+    preds = []
+    for haz in HAZARDS:
+        fields = [np.maximum(*[np.ma.filled(env[fh][v], 0.) for fh in SREF_HOURS]) for v in HAZARDS[haz]]
+        preds.append(fields[0] if len(fields) == 1 else fields[0] * fields[1] / 100)
+    return np.stack(preds)
+
+
+def main():
+    args = get_options()
+    run = '00'
+    date = '20260501'
+    now = datetime.datetime(2026, 5, 1, 0)
+    sref_run = '2026043021'
+    roi = 40. / 3.0
+    rng = np.random.RandomState(args.seed)
+    tmp_dir = tempfile.mkdtemp(prefix='severe_bench_')
+
+    print(f'Building synthetic inputs (scale {args.scale}, {args.members} members)...')
+    lats, lons = synthetic.href_grid(args.scale)
+    sref_lats, sref_lons = synthetic.sref_grid()
+    uh_vals = synthetic.uh_field(lats.shape, rng, scale=args.scale)
+    uh = synthetic.member_exceedance(args.members, lats.shape, rng, scale=args.scale)
+    count = np.sum(uh, axis=0).astype(np.uint16)
+    env = synthetic.sref_env(SREF_HOURS, rng)
+    preds = predictors(env)
+
+    synthetic.write_cal_tables(tmp_dir, run, [19], rng)
+    tables = np.stack([calibrate.load_table(f'{tmp_dir}/cal_{haz}_tbl{run}_f19.npz', haz) for haz in HAZARDS])
+    tables_full = [calibrate.load_table(f'{tmp_dir}/cal_{haz}_24h_tbl{run}.npz', haz) for haz in HAZARDS]
+
+    # UH probabilities (%) with the shape of the real ones: mostly near 0, a few high
+    uh_prob = np.clip(rng.exponential(6., sref_lats.shape), 0, 100)
+    cal4 = [[calibrate.lookup(rng.randint(0, 6, sref_lats.shape), rng.randint(0, 11, sref_lats.shape),
+                              tables[h]) for i in range(FULL_HOURS)] for h in range(len(HAZARDS))]
+
+    gdlist_files = []
+    for fh in SREF_HOURS:
+        for v in synthetic.SREF_VARS:
+            fname = f'{tmp_dir}/sref_{sref_run}_{v}_{fh}.txt'
+            synthetic.write_gdlist(fname, env[fh][v], v, sref_run, fh)
+            gdlist_files.append(fname)
+
+    # GEMPAK grid files of every packing and byte order the reader handles, and
+    # gdlist text of the same grids. Values on a 0.25 step survive both the
+    # packing and gdlist's two decimals exactly.
+    sref_date = datetime.datetime.strptime(sref_run, '%Y%m%d%H')
+    gempak_env = {fh: {v: np.ma.round(env[fh][v] * 4) / 4 for v in synthetic.SREF_VARS} for fh in SREF_HOURS}
+    gempak_files = []
+    gempak_gdlist = []
+    for packing in (gempak.MDGNON, gempak.MDGGRB):
+        for order in ('<', '>'):
+            for fh in SREF_HOURS:
+                fname = f'{tmp_dir}/spcsref_{sref_run}f{fh}.{packing}{"le" if order == "<" else "be"}'
+                synthetic.write_gempak(fname, gempak_env[fh], sref_run, fh, packing=packing, order=order)
+                gempak_files.append((fname, fh))
+                for v in synthetic.SREF_VARS:
+                    txt = f'{tmp_dir}/gempak_{sref_run}_{v}_{fh}.txt'
+                    if txt not in gempak_gdlist:
+                        synthetic.write_gdlist(txt, gempak_env[fh][v], v, sref_run, fh)
+                    gempak_gdlist.append(txt)
+
+    results = measure.metadata()
+    results.update({
+        'scale': args.scale,
+        'members': args.members,
+        'seed': args.seed,
+        'href_shape': list(lats.shape),
+        'sref_shape': list(sref_lats.shape),
+        'stages': {}
+        })
+
+    failed = []
+    for name in args.stages:
+        print(f'Running {name}...')
+        try:
+            if name == 'uh_grid':
+                from calib_severe.util import uh_util
+                new = lambda: uh_util.uh_exceedance(uh_vals, 75, roi)
+                ref = lambda: reference.uh_exceedance(uh_vals, 75, roi, uh_util.STRUCT)
+                setup = None
+                points = uh_vals.size
+            elif name == 'neighborhood_probs':
+                from calib_severe.util import uh_util
+                new = lambda: uh_util.neighborhood_probs(count, lats, lons, roi, sref_lats, sref_lons,
+                                                         n_members=len(uh))
+                ref = lambda: reference.neighborhood_probs(uh, lats, lons, roi, sref_lats, sref_lons)
+                setup = None
+                points = lats.size * len(uh)
+            elif name == 'binhaz':
+                new = calibrate.binhaz
+                ref = reference.binhaz
+                setup = lambda: (uh_prob.copy(),)
+                points = uh_prob.size
+            elif name == 'calibrate_4hr':
+                new = lambda p, s: [calibrate.calibrate_4hr(p[h], s[h], tables[h]) for h in range(len(HAZARDS))]
+                ref = lambda p, s: [reference.calibrate_4hr(p[h], s[h], tables[h]) for h in range(len(HAZARDS))]
+                setup = lambda: ([uh_prob.copy() for haz in HAZARDS], preds.copy())
+                points = preds.size
+            elif name == 'calibrate_4hr_fused':
+                new = lambda p, s: calibrate.calibrate_4hr_fused(p[0], s, tables)
+                ref = lambda p, s: [reference.calibrate_4hr(p[h], s[h], tables[h]) for h in range(len(HAZARDS))]
+                setup = lambda: ([uh_prob.copy() for haz in HAZARDS], preds.copy())
+                points = preds.size
+            elif name == 'calibrate_full':
+                new = lambda: [calibrate.calibrate_full(cal4[h], tables_full[h]) for h in range(len(HAZARDS))]
+                ref = lambda: [reference.calibrate_full(cal4[h], tables_full[h]) for h in range(len(HAZARDS))]
+                setup = None
+                points = sref_lats.size * len(HAZARDS) * FULL_HOURS
+            elif name == 'read_gdlist':
+                new = lambda: [gdlist.read_gdlist(f) for f in gdlist_files]
+                ref = lambda: [reference.read_gdlist(f) for f in gdlist_files]
+                setup = None
+                points = sref_lats.size * len(gdlist_files)
+            elif name == 'read_gempak':
+                new = lambda: [gempak.GempakGrid(f).read(v, int(fh), sref_date)
+                               for f, fh in gempak_files for v in synthetic.SREF_VARS]
+                ref = lambda: [gdlist.read_gdlist(f) for f in gempak_gdlist]
+                setup = None
+                points = sref_lats.size * len(gempak_gdlist)
+            elif name == 'save_grib':
+                from calib_severe.io import severe_grib
+                out = f'{tmp_dir}/href_cal_tor.grib2'
+                ref_out = f'{tmp_dir}/href_cal_tor.ref.grib2'
+                e_time = now + datetime.timedelta(hours=20)
+                new = lambda: severe_grib.save_grib(cal4[0][0], e_time, now, 16, 'tor', '4', out, run, date) or out
+                ref = lambda: reference.save_grib(cal4[0][0], e_time, now, 16, 'tor', '4', ref_out, run, date) or ref_out
+                setup = None
+                points = sref_lats.size
+        except ImportError as e:
+            print(f'WARNING: Skipping {name}, {e}')
+            results['stages'][name] = {'skipped': str(e)}
+            continue
+
+        result = measure.measure(new, setup=setup, repeats=args.repeats, points=points)
+        args_new = setup() if setup is not None else ()
+        args_ref = setup() if setup is not None else ()
+        result.update(measure.equivalent(new(*args_new), ref(*args_ref)))
+        result['reference'] = measure.measure(ref, setup=setup, repeats=1, points=points)
+
+        results['stages'][name] = result
+        speedup = result['reference']['min'] / max(result['min'], 1e-9)
+        print(f'  {name}: min {result["min"]:.4f} s, {result["throughput"]:.3g} points/s, '
+              f'peak {result["peak_mb"]:.1f} MB, x{speedup:.1f} vs reference, '
+              f'{"equivalent" if result["equivalent"] else "DIFFERS"}')
+        if not result['equivalent']:
+            print(f'WARNING: {name} does not match the reference implementation '
+                  f'(max abs diff {result.get("max_abs_diff")})')
+            failed.append(name)
+
+    measure.save(args.output, results)
+    print(f'Wrote {args.output}')
+    if args.compare is not None:
+        measure.compare(args.compare, results)
+
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# Program Name: HREF/SREF Calibrated Severe table store
+# Affiliation: NOAA/NWS/Storm Prediction Center
+# Abstract: Builds the consolidated calibration store (cal_tables.npy) from the
+#           cal_{haz}_tbl{run}_f{fh}.npz and cal_{haz}_24h_tbl{run}.npz tables
+#
+# Usage:
+#   python build_cal_tables.py [-f FIX_DIR] [-o OUTPUT]
+#   The severe jobs build the store in $COMOUTspc_pickle on their own and
+#   rebuild it whenever a table in fix/href_calib_severe changes; this
+#   prebuilds it and reports the tables found.
+
+import os
+import argparse
+import numpy as np
+from calib_severe.io import cal_table_store
+
+
+def get_options():
+    """Parse command line arguments"""
+
+    default_fix = os.path.join(os.environ.get('FIXspc_post', ''), 'href_calib_severe')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--fix_dir', type=str, metavar='', default=default_fix,
+                        help='Location of the severe calibration tables (default: $FIXspc_post/href_calib_severe)')
+    parser.add_argument('-o', '--output', type=str, metavar='', default=None,
+                        help='Output store (default: $COMOUTspc_pickle/cal_tables.npy)')
+    return parser.parse_args()
+
+
+def main():
+    args = get_options()
+    out = args.output
+    if out is None:
+        out = cal_table_store.store_fname(os.environ.get('COMOUTspc_pickle', ''))
+
+    stamps = cal_table_store.sources(args.fix_dir)
+    tables = cal_table_store.build(args.fix_dir)
+    found = ~np.isnan(tables[0]).any(axis=(-2, -1))
+    for h, haz in enumerate(cal_table_store.HAZARDS):
+        for r, run in enumerate(cal_table_store.RUNS):
+            hours = np.flatnonzero(found[h, r, :cal_table_store.FULL])
+            full = 'yes' if found[h, r, cal_table_store.FULL] else 'no'
+            span = f'f{hours.min():02d}-f{hours.max():02d}' if hours.size else 'none'
+            print(f'{haz:>4} {run}Z: {hours.size} 4-hr tables ({span}), full period table: {full}')
+
+    cal_table_store.save(out, tables, stamps)
+    print(f'Wrote {out}')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules shared with the other ush packages live in ush/spc_common
+USH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if USH not in sys.path:
+    sys.path.append(USH)
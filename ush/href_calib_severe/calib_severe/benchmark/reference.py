@@ -0,0 +1,230 @@
+import datetime
+import numpy as np
+
+"""
+Reference implementations of the severe pipeline stages
+
+These are the stages as they were written in the original
+forecast_href_cal_severe.py (uhGrid, computeNeighborhoodProbs, binhaz,
+binhaz24, computeCal4, computeCalFull, read_gdlist and saveGRIB), with the
+script globals turned into arguments. The benchmarks check every optimized
+stage against them, so they must not be changed.
+"""
+
+
+def uh_exceedance(uh_vals, thresh, roi, struct):
+    """uhGrid() after the decode: threshold and dilate one member's UH
+
+    :param uh_vals: 2D array of UH values
+    :param thresh: UH threshold (m2/s2)
+    :param roi: Radius of influence in grid points
+    :param struct: Dictionary of structure elements keyed by rounded roi
+    :return: 2D float array of 0/1
+    """
+
+    from scipy.ndimage import binary_dilation
+
+    uhThresh = np.zeros(uh_vals.shape)
+    uhThresh[uh_vals >= thresh] = 1.
+    return binary_dilation(uhThresh, structure=struct[str(int(round(roi, 0)))]).astype(uhThresh.dtype)
+
+
+def neighborhood_probs(uh, lats, lons, roi, sref_lats, sref_lons):
+    """computeNeighborhoodProbs(): smoothed probabilities on the SREF grid
+
+    :param uh: List of 2D 0/1 arrays (one per member)
+    :param lats: 2D array of member latitudes
+    :param lons: 2D array of member longitudes
+    :param roi: Radius of influence in grid points
+    :param sref_lats: 2D array of SREF grid latitudes
+    :param sref_lons: 2D array of SREF grid longitudes
+    :return: 2D array of probabilities (%) on the SREF grid
+    """
+
+    from astropy.convolution import convolve, Gaussian2DKernel
+    from scipy.interpolate import NearestNDInterpolator
+
+    uhProbGrid = np.average(np.array(uh), axis=0) * 100
+    uhProbGrid[uhProbGrid < 0.] = np.nan
+    sigma = Gaussian2DKernel(x_stddev=roi)
+    uhProbGrid = convolve(uhProbGrid, sigma, preserve_nan=True)
+    wnan = np.isnan(uhProbGrid)
+    uhProbGrid[wnan] = 0.
+
+    srefX = sref_lons.flatten()
+    srefY = sref_lats.flatten()
+    g3km = np.vstack((lons.flatten(), lats.flatten())).T
+    interpolator = NearestNDInterpolator(g3km, uhProbGrid.flatten())
+    vals = []
+    for j in range(len(srefX)):
+        vals.append(interpolator(srefX[j], srefY[j]))
+    return np.array(vals).reshape(sref_lons.shape)
+
+
+def read_gdlist(f, mask=-9999):
+    """Line by line gdlist text parser
+
+    :param f: Location of the gdlist output file
+    :param mask: Value to mask (GEMPAK missing value), or None for no mask
+    :return: Array of shape (rows, columns) with row 1 (south) first
+    """
+
+    begin = False
+    lonsize = None; latsize = None
+    vals = []
+    scale_factor = 1
+    with open(f, "r") as IN:
+        for line in IN:
+            if not lonsize:
+                if 'GRID SIZE' not in line: continue
+                parts = line.split()
+                parts = [p.strip() for p in parts]
+                lonsize = int(parts[-2])
+                latsize = int(parts[-1])
+            if 'Scale factor' in line:
+                scale_factor = 10**(float(line.split()[-1]))
+            if 'ROW{:3d}'.format(latsize) in line or (begin and 'ROW' in line):
+                begin = True
+                val_tmp = line.split('ROW')[1].split()[1:]
+            elif begin:
+                val_tmp = line.split()
+            else:
+                continue
+            for val in val_tmp:
+                vals.append(scale_factor * float(val))
+        vals = np.array(vals)
+        if mask:
+            vals = np.ma.masked_where(vals == mask, vals)
+        vals = vals.reshape(latsize, -1)
+    return vals[::-1]
+
+
+def binhaz(arr):
+    """Sort 4-hour probabilities into 11 bins, in place"""
+
+    arr[arr<5] = 0
+    arr[np.logical_and(arr>=5, arr<15)] = 10
+    arr[np.logical_and(arr>=15, arr<25)] = 20
+    arr[np.logical_and(arr>=25, arr<35)] = 30
+    arr[np.logical_and(arr>=35, arr<45)] = 40
+    arr[np.logical_and(arr>=45, arr<55)] = 50
+    arr[np.logical_and(arr>=55, arr<65)] = 60
+    arr[np.logical_and(arr>=65, arr<75)] = 70
+    arr[np.logical_and(arr>=75, arr<85)] = 80
+    arr[np.logical_and(arr>=85, arr<95)] = 90
+    arr[arr>=95] = 100
+    return (arr / 10).astype(int)
+
+
+def binhaz24(arr):
+    """Sort full period probabilities into 11 bins, in place"""
+
+    arr[arr<2.5] = 0
+    arr[np.logical_and(arr>=2.5, arr<7.5)] = 5
+    arr[np.logical_and(arr>=7.5, arr<12.5)] = 10
+    arr[np.logical_and(arr>=12.5, arr<17.5)] = 15
+    arr[np.logical_and(arr>=17.5, arr<22.5)] = 20
+    arr[np.logical_and(arr>=22.5, arr<27.5)] = 25
+    arr[np.logical_and(arr>=27.5, arr<32.5)] = 30
+    arr[np.logical_and(arr>=32.5, arr<37.5)] = 35
+    arr[np.logical_and(arr>=37.5, arr<42.5)] = 40
+    arr[np.logical_and(arr>=42.5, arr<47.5)] = 45
+    arr[arr>=47.5] = 50
+    return (arr / 5).astype(int)
+
+
+def lookup(binned1, binned2, caltbl):
+    """Dictionary lookup of calibrated probabilities from computeCal4()/computeCalFull()"""
+
+    cal_lookup_tbl = {}
+    for j in range(caltbl.shape[0]):
+        for k in range(caltbl.shape[1]):
+            cal_lookup_tbl[(j,k)] = caltbl[j,k]
+
+    fcst = np.zeros(binned1.ravel().shape)
+    for i,c in enumerate(zip(binned1.ravel(), binned2.ravel())):
+        fcst[i] = (cal_lookup_tbl[c]) *100
+    return fcst.reshape(binned1.shape)
+
+
+def calibrate_4hr(uh_prob, max_sref, caltbl):
+    """computeCal4() for one hazard; both predictors are binned in place
+
+    :param uh_prob: 2D array of UH neighborhood probabilities (%)
+    :param max_sref: 2D array of the SREF environment predictor
+    :param caltbl: 2D calibration table
+    :return: 2D array of calibrated probabilities (%)
+    """
+
+    return lookup(binhaz(uh_prob), binhaz(max_sref), caltbl)
+
+
+def calibrate_full(cal4, caltbl):
+    """computeCalFull() for one hazard
+
+    :param cal4: List of hourly 4-hour calibrated probabilities (%)
+    :param caltbl: 2D full period calibration table
+    :return: 2D array of calibrated probabilities (%)
+    """
+
+    agg = np.sum(cal4[::4], axis=0)
+    fmax = np.maximum.reduce(cal4[::4])
+    fcsttemp = lookup(binhaz24(agg), binhaz24(fmax), caltbl)
+    return np.maximum.reduce([fcsttemp] + cal4)
+
+
+def save_grib(data, e_time, now, fhour, h_type, out_time, out_grib, run, date):
+    """saveGRIB() with the run and date passed in
+
+    :param data: 2D array (or list of 2D arrays) of probabilities (%)
+    :param e_time: Datetime object with the end of the period
+    :param now: Datetime object with the reference time
+    :param fhour: Forecast hour at the start of the period
+    :param h_type: Hazard (tor, hail or wind)
+    :param out_time: Length of the period in hours ('4', '20' or '24')
+    :param out_grib: Location of the output file
+    :param run: Cycle used for calibration (e.g. '00')
+    :param date: Date of the cycle (YYYYMMDD)
+    """
+
+    import ncepgrib2 as ng
+
+    if type(data) is not list:
+        data = [data]
+
+    if h_type == 'tor':
+        hTypeNum = 197
+    elif h_type == 'hail':
+        hTypeNum = 198
+    elif h_type == 'wind':
+        hTypeNum = 199
+
+    if out_time == '4':
+        sTime = e_time - datetime.timedelta(hours=4)
+    elif run == '15':
+        sTime = datetime.datetime(int(date[:4]),int(date[4:6]),int(date[6:8]),16)
+        e_time = datetime.datetime(int(date[:4]),int(date[4:6]),int(date[6:8]),12) + datetime.timedelta(days=1)
+    elif run == '21':
+        sTime = datetime.datetime(int(date[:4]),int(date[4:6]),int(date[6:8]),12) + datetime.timedelta(days=1)
+        e_time = sTime + datetime.timedelta(days=1)
+    else:
+        sTime = datetime.datetime(int(date[:4]),int(date[4:6]),int(date[6:8]),12)
+        e_time = sTime + datetime.timedelta(days=1)
+
+    idsect = np.array([7, 9, 1, 1, 1, now.year, now.month, now.day, now.hour, now.minute, now.second, 0, 1])
+    gdsinfo = np.array([0, len(data[0].flatten()), 0, 0, 30])
+    gdtmpl = np.array([6, 0, 0, 0, 0, 0, 0, 185, 129, 12190000, 226541000, 8, 25000000,
+                       265000000, 40635000, 40635000, 0, 64, 25000000, 25000000, 0, 0])
+    pdtmpl = np.array([19, hTypeNum, 5, 0, 0, 0, 0, 1, fhour, 1, 0, 0, 255, 0, 0, 0, 21, 1, 0,
+                       0, 0, 0, e_time.year, e_time.month, e_time.day, e_time.hour,
+                       0, 0, 1, 0, 1, 2, 1, int(out_time), 255, 0])
+    drtmpl = np.array([0, 0, 1, 10, 0, 0, 255])
+
+    encoder = ng.Grib2Encode(0, idsect)
+    encoder.addgrid(gdsinfo, gdtmpl)
+    for forecast in data:
+        encoder.addfield(9, pdtmpl, 40, drtmpl, forecast)
+    encoder.end()
+
+    with open(out_grib, 'wb') as f:
+        f.write(encoder.msg)
@@ -0,0 +1,298 @@
+import os
+import datetime
+import numpy as np
+from scipy.ndimage import gaussian_filter
+from calib_severe.io import cal_table_store
+from calib_severe.io import gempak
+
+"""
+Synthetic inputs for the severe benchmarks
+
+Nothing here reads operational data. Grids are built from the Lambert
+conformal definitions of the 3 km HREF grid and NCEP grid 212 (the SREF 40 km
+grid in fix/href_calib_severe/srefGrid.grib2), UH is random rotating storms,
+and the SREF environment, gdlist text, GEMPAK grid files and calibration
+tables have the layout the engine reads.
+"""
+
+EARTH_RADIUS = 6371229.
+
+# nx, ny, lat1, lon1, lov, latin, dx (m)
+HREF_GRID = (1799, 1059, 21.138, 237.28, 262.5, 38.5, 3000.)
+SREF_GRID = (185, 129, 12.19, 226.541, 265., 25., 40635.)
+
+SREF_VARS = ['sigtp1', 'hicapep1000', 'eshrp20', 'hicapep250']
+
+
+def lambert_grid(nx, ny, lat1, lon1, lov, latin, dx):
+    """Lats and lons of a tangent Lambert conformal grid on a sphere
+
+    :param nx: Number of points in x
+    :param ny: Number of points in y
+    :param lat1: Latitude of the first (lower left) point
+    :param lon1: Longitude of the first point (degrees east, 0 - 360)
+    :param lov: Orientation longitude (degrees east, 0 - 360)
+    :param latin: Tangent latitude
+    :param dx: Grid spacing (m)
+    :return: lat and lon arrays of shape (ny, nx), lons in 0 - 360
+    """
+
+    phi1 = np.radians(latin)
+    n = np.sin(phi1)
+    f = np.cos(phi1) * np.tan(np.pi / 4 + phi1 / 2) ** n / n
+    rho0 = EARTH_RADIUS * f / np.tan(np.pi / 4 + phi1 / 2) ** n
+
+    # Projected coordinates of the first point
+    rho = EARTH_RADIUS * f / np.tan(np.pi / 4 + np.radians(lat1) / 2) ** n
+    theta = n * np.radians(lon1 - lov)
+    x0 = rho * np.sin(theta)
+    y0 = rho0 - rho * np.cos(theta)
+
+    x, y = np.meshgrid(x0 + dx * np.arange(nx), y0 + dx * np.arange(ny))
+    rho = np.sign(n) * np.hypot(x, rho0 - y)
+    theta = np.arctan2(x, rho0 - y)
+    lats = np.degrees(2 * np.arctan((EARTH_RADIUS * f / rho) ** (1 / n)) - np.pi / 2)
+    lons = (lov + np.degrees(theta / n)) % 360
+    return lats, lons
+
+
+def href_grid(scale=1.):
+    """Lats and lons of the 3 km HREF grid
+
+    :param scale: Fraction of the full resolution in each direction (the grid
+        spacing is 3 km / scale, the domain is unchanged)
+    :return: lat and lon arrays
+    """
+
+    nx, ny, lat1, lon1, lov, latin, dx = HREF_GRID
+    nx = max(2, int(round(nx * scale)))
+    ny = max(2, int(round(ny * scale)))
+    dx = dx * (HREF_GRID[0] - 1) / (nx - 1)
+    return lambert_grid(nx, ny, lat1, lon1, lov, latin, dx)
+
+
+def sref_grid():
+    """Lats and lons of the SREF 40 km grid
+
+    :return: lat and lon arrays
+    """
+
+    return lambert_grid(*SREF_GRID)
+
+
+def uh_field(shape, rng, scale=1.):
+    """One hour of 2-5 km updraft helicity with isolated rotating storms
+
+    :param shape: Shape of the 3 km grid
+    :param rng: numpy RandomState
+    :param scale: Grid scale from href_grid()
+    :return: Array of UH (m2/s2)
+    """
+
+    # Storms cluster in a broad region; each has a small (~10 km) core
+    region = gaussian_filter(rng.normal(0, 1, shape), max(2., 80. * scale))
+    region = np.clip((region - region.mean()) / region.std() - 0.5, 0, None)
+    cores = np.zeros(shape)
+    seeds = rng.random_sample(shape) < 5e-5 / scale ** 2 * region
+    cores[seeds] = rng.exponential(1., seeds.sum())
+    uh = gaussian_filter(cores, max(0.7, 1.5 * scale)) * 2 * np.pi * max(0.7, 1.5 * scale) ** 2
+    return 150 * uh + np.abs(rng.normal(0, 2, shape))
+
+
+def member_exceedance(members, shape, rng, thresh=75, hours=4, scale=1.):
+    """4-hour maximum UH exceedance of each member
+
+    :param members: Number of members
+    :param shape: Shape of the 3 km grid
+    :param rng: numpy RandomState
+    :param thresh: UH threshold (m2/s2)
+    :param hours: Hours in the window
+    :param scale: Grid scale from href_grid()
+    :return: List of 2D 0/1 float arrays
+    """
+
+    uh = []
+    for member in range(members):
+        exceed = np.zeros(shape, dtype=bool)
+        for hour in range(hours):
+            exceed |= uh_field(shape, rng, scale=scale) >= thresh
+        uh.append(exceed.astype(float))
+    return uh
+
+
+def sref_env(hours, rng):
+    """SREF environment in the layout of SevereEngine.sref_data
+
+    Values are probabilities (%) with a few GEMPAK missing points.
+
+    :param hours: List of zero-padded SREF forecast hours
+    :param rng: numpy RandomState
+    :return: Dictionary of {forecast hour: {variable: masked array}}
+    """
+
+    shape = sref_grid()[0].shape
+    env = {}
+    for fh in hours:
+        env[fh] = {}
+        for v in SREF_VARS:
+            field = gaussian_filter(rng.normal(0, 1, shape), 4)
+            field = np.clip(50 + 60 * field / field.std(), 0, 100)
+            missing = rng.random_sample(shape) < 0.002
+            env[fh][v] = np.ma.masked_where(missing, np.where(missing, -9999., field))
+    return env
+
+
+def write_gdlist(fname, grid, param, sref_run, fh):
+    """Write a grid as GEMPAK gdlist text output
+
+    :param fname: Output filename
+    :param grid: 2D (masked) array with row 1 (south) first
+    :param param: GEMPAK parameter name
+    :param sref_run: SREF run (YYYYMMDDHH)
+    :param fh: Zero-padded forecast hour
+    """
+
+    ny, nx = grid.shape
+    vals = np.ma.filled(grid, -9999.)
+    txt = [f' Grid file: spcsref_{sref_run}f{fh}', '', ' GRID IDENTIFIER:',
+           '    TIME1             TIME2           LEVL1 LEVL2   VCORD PARM',
+           f' {sref_run[2:8]}/{sref_run[-2:]}00F{fh}                          0           NONE {param.upper()}',
+           f' AREA: grid                       GRID SIZE: {nx:4d} {ny:4d}',
+           f' COLUMNS:     1 {nx:4d}     ROWS:     1 {ny:4d}', '',
+           ' Scale factor: 10**  0', '', '', ' COLUMN:   1      2      3', '']
+    for row in range(ny, 0, -1):
+        line = vals[row - 1]
+        for i in range(0, nx, 8):
+            chunk = ''.join(f'{v:10.2f}' for v in line[i:i + 8])
+            txt.append((f' ROW{row:3d}' if i == 0 else '       ') + chunk)
+    with open(fname, 'w') as f:
+        f.write('\n'.join(txt) + '\n')
+    return
+
+
+def write_gempak(fname, grids, sref_run, fh, packing=gempak.MDGNON, order='<', scale=0.25):
+    """Write grids as a GEMPAK grid file (DM file with a single GRID part)
+
+    Only the parts of the DM layout that GempakGrid reads are filled in. With
+    MDGGRB packing values are stored as reference + n * scale, so grids on a
+    multiple of scale are packed exactly.
+
+    :param fname: Output filename
+    :param grids: Dictionary of 2D (masked) arrays with row 1 (south) first,
+        keyed by GEMPAK parameter name
+    :param sref_run: SREF run (YYYYMMDDHH)
+    :param fh: Zero-padded forecast hour
+    :param packing: gempak.MDGNON (32-bit floats) or gempak.MDGGRB
+    :param order: Byte order of the file ('<' or '>')
+    :param scale: Step of the packed values for MDGGRB
+    """
+
+    column_keys = ['GDT1', 'GTM1', 'GDT2', 'GTM2', 'GLV1', 'GLV2', 'GVCD', 'GPM1', 'GPM2', 'GPM3']
+    nav_length = 256
+    header_length = 2
+    ny, nx = next(iter(grids.values())).shape
+    words = bytearray()
+
+    def ints(*values):
+        words.extend(np.array(values, dtype=order + 'i4').tobytes())
+
+    def floats(*values):
+        words.extend(np.array(values, dtype=order + 'f4').tobytes())
+
+    def chars(text):
+        words.extend(text.encode('ascii').ljust(4 * ((len(text) + 3) // 4)))
+
+    def here():
+        return len(words) // 4 + 1
+
+    def patch(word, value):
+        words[4 * (word - 1):4 * word] = np.array([value], dtype=order + 'i4').tobytes()
+
+    # Label and file header (pointers are filled in once the sections are written)
+    chars(gempak.GEMPAK_HEADER.decode())
+    ints(1, 1, 0, 1, 1, 0, 0, len(grids), len(column_keys), 0, 0, 1, 0, 0, 0, 0, 3, 0, 0, -9999)
+    floats(gempak.RMISSD)
+
+    # File keys and the navigation block (KX and KY are words 5 and 6)
+    patch(10, here())
+    chars('NAVB')
+    ints(nav_length, 1)
+    ints(nav_length)
+    floats(2.)
+    chars('LCC')
+    floats(*([0.] * 2 + [nx, ny] + [0.] * (nav_length - 6)))
+
+    # Row keys and the single row header
+    patch(13, here())
+    chars('GRID')
+    patch(14, here())
+    ints(gempak.USED_FLAG, 0)
+
+    # Column keys and one column header per grid
+    patch(17, here())
+    chars(''.join(column_keys))
+    patch(18, here())
+    gdt1 = gempak.gempak_dattim(datetime.datetime.strptime(sref_run, '%Y%m%d%H'))
+    for param in grids:
+        ints(gempak.USED_FLAG, gdt1, 100000 + int(fh) * 100, 0, -1, 0, -1, 0)
+        chars(param.upper().ljust(12))
+
+    # GRID part: name, header length, type, parameters
+    patch(20, here())
+    chars('GRID')
+    ints(header_length, 5, 1)
+    chars('GRID')
+    ints(0, 0, 32)
+
+    # Data pointers (one per column), then the grids
+    patch(23, here())
+    pointers = here()
+    ints(*([0] * len(grids)))
+    for icol, grid in enumerate(grids.values()):
+        patch(pointers + icol, here())
+        vals = np.ma.filled(grid, gempak.RMISSD).astype(np.float64).ravel()
+        if packing == gempak.MDGNON:
+            ints(header_length + 1 + vals.size, 0, 0, packing)
+            floats(*vals)
+            continue
+
+        missing = vals == gempak.RMISSD
+        reference = vals[~missing].min() if (~missing).any() else 0.
+        idat = np.zeros(vals.size, dtype=np.int64)
+        idat[~missing] = np.round((vals[~missing] - reference) / scale)
+        nbits = int(idat.max() + 1).bit_length()
+        idat[missing] = 2 ** nbits - 1
+        bits = (idat[:, None] >> np.arange(nbits - 1, -1, -1)) & 1
+        packed = np.packbits(bits.astype(np.uint8).ravel())
+        packed = np.concatenate([packed, np.zeros(-packed.size % 4, dtype=np.uint8)]).view('>u4')
+        ints(header_length + 6 + packed.size, 0, 0, packing, nbits, int(missing.any()), vals.size)
+        floats(reference, scale)
+        words.extend(packed.astype(order + 'u4').tobytes())
+
+    with open(fname, 'wb') as f:
+        f.write(words)
+    return
+
+
+def write_cal_tables(fix_dir, run, hours, rng):
+    """Write fix-shaped calibration tables for one cycle
+
+    Tables increase with both predictors like the real ones.
+
+    :param fix_dir: Location of the fix directory
+    :param run: Cycle used for calibration (e.g. '00')
+    :param hours: List of SREF forecast hours of the 4-hour tables
+    :param rng: numpy RandomState
+    """
+
+    nbins = cal_table_store.NBINS
+    ramp = np.add.outer(np.arange(nbins), np.arange(nbins)) / (2. * (nbins - 1))
+    for haz in cal_table_store.HAZARDS:
+        for fh in list(hours) + [None]:
+            caltbl = np.clip(ramp ** 1.5 + rng.normal(0, 0.02, ramp.shape), 0, 1)
+            if fh is None:
+                fname = f'cal_{haz}_24h_tbl{run}.npz'
+            else:
+                fname = f'cal_{haz}_tbl{run}_f{str(fh).zfill(2)}.npz'
+            np.savez(os.path.join(fix_dir, fname), calib_table=caltbl)
+    return
@@ -0,0 +1,131 @@
+import numpy as np
+
+# Calibrated probabilities are limited to these values with --cap
+CAPS = {
+    'tor': 0.6,
+    'hail': 0.6,
+    'wind': 0.75
+}
+
+
+def binhaz(arr):
+    """Sort 4-hour probabilities into 11 bins (0, 10, ..., 100)
+
+    The array is binned in place.
+
+    :param arr: Array of probabilities (%) of a single variable
+    :return: Integer array of bin indices (0 - 10)
+    """
+
+    arr[arr<5] = 0
+    arr[np.logical_and(arr>=5, arr<15)] = 10
+    arr[np.logical_and(arr>=15, arr<25)] = 20
+    arr[np.logical_and(arr>=25, arr<35)] = 30
+    arr[np.logical_and(arr>=35, arr<45)] = 40
+    arr[np.logical_and(arr>=45, arr<55)] = 50
+    arr[np.logical_and(arr>=55, arr<65)] = 60
+    arr[np.logical_and(arr>=65, arr<75)] = 70
+    arr[np.logical_and(arr>=75, arr<85)] = 80
+    arr[np.logical_and(arr>=85, arr<95)] = 90
+    arr[arr>=95] = 100
+    return (arr / 10).astype(int)
+
+
+def binhaz24(arr):
+    """Sort full period probabilities into 11 bins (0, 5, ..., 50)
+
+    The array is binned in place.
+
+    :param arr: Array of probabilities (%)
+    :return: Integer array of bin indices (0 - 10)
+    """
+
+    arr[arr<2.5] = 0
+    arr[np.logical_and(arr>=2.5, arr<7.5)] = 5
+    arr[np.logical_and(arr>=7.5, arr<12.5)] = 10
+    arr[np.logical_and(arr>=12.5, arr<17.5)] = 15
+    arr[np.logical_and(arr>=17.5, arr<22.5)] = 20
+    arr[np.logical_and(arr>=22.5, arr<27.5)] = 25
+    arr[np.logical_and(arr>=27.5, arr<32.5)] = 30
+    arr[np.logical_and(arr>=32.5, arr<37.5)] = 35
+    arr[np.logical_and(arr>=37.5, arr<42.5)] = 40
+    arr[np.logical_and(arr>=42.5, arr<47.5)] = 45
+    arr[arr>=47.5] = 50
+    return (arr / 5).astype(int)
+
+
+def load_table(fname, haz, cap=False):
+    """Load a calibration table from the fix directory
+
+    :param fname: Location of the cal_*.npz file
+    :param haz: Hazard (tor, hail or wind)
+    :param cap: Limit the table to CAPS[haz]
+    :return: 2D array of calibrated probabilities (0 - 1)
+    """
+
+    caltbl = np.load(fname)['calib_table']
+    if cap:
+        caltbl[caltbl > CAPS[haz]] = CAPS[haz]
+    return caltbl
+
+
+def lookup(binned1, binned2, caltbl):
+    """Look up calibrated probabilities for a pair of binned predictors
+
+    :param binned1: Integer array of bin indices for the first table axis
+    :param binned2: Integer array of bin indices for the second table axis
+    :param caltbl: 2D calibration table
+    :return: Array of calibrated probabilities (%) with the shape of binned1
+    """
+
+    return caltbl[binned1, binned2] * 100
+
+
+def calibrate_4hr(uh_prob, max_sref, caltbl):
+    """Calibrated 4-hour probabilities for a single hazard
+
+    Both predictors are binned in place.
+
+    :param uh_prob: 2D array of UH neighborhood probabilities (%) on the SREF grid
+    :param max_sref: 2D array of the SREF environment predictor
+    :param caltbl: 2D calibration table for the hazard and forecast hour
+    :return: 2D array of calibrated probabilities (%)
+    """
+
+    return lookup(binhaz(uh_prob), binhaz(max_sref), caltbl)
+
+
+def calibrate_4hr_fused(uh_prob, predictors, caltbls):
+    """Calibrated 4-hour probabilities for several hazards in one pass
+
+    UH is binned once (in place) and the stacked SREF predictors are binned
+    together, then every hazard's table is evaluated with a single lookup.
+
+    :param uh_prob: 2D array of UH neighborhood probabilities (%) on the SREF grid
+    :param predictors: 3D array (hazard, ny, nx) of SREF environment predictors,
+        binned in place
+    :param caltbls: 3D array (hazard, bin, bin) of calibration tables
+    :return: 3D array (hazard, ny, nx) of calibrated probabilities (%)
+    """
+
+    uh_binned = binhaz(uh_prob)
+    sref_binned = binhaz(predictors)
+    haz = np.arange(caltbls.shape[0])[:, None, None]
+    return caltbls[haz, uh_binned[None], sref_binned] * 100
+
+
+def calibrate_full(cal4, caltbl):
+    """Calibrated full period probabilities for a single hazard
+
+    :param cal4: List of hourly 4-hour calibrated probabilities (%)
+    :param caltbl: 2D full period calibration table for the hazard
+    :return: 2D array of calibrated probabilities (%)
+    """
+
+    # Aggregate and maximum of the non-overlapping 4-hour periods
+    agg = np.sum(cal4[::4], axis=0)
+    fmax = np.maximum.reduce(cal4[::4])
+    fcst = lookup(binhaz24(agg), binhaz24(fmax), caltbl)
+
+    # If any grid point is lower than one of the used hours, replace it with that hour.
+    return np.maximum.reduce([fcst] + cal4)
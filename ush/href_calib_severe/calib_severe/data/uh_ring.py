@@ -0,0 +1,51 @@
+import numpy as np
+from calib_severe.util.mask_util import unpack_mask
+
+
+class UHRing:
+    """Ring buffer holding the last few hours of bit-packed UH exceedance masks
+    for one member"""
+
+    def __init__(self, size=4):
+        """Constructor for UHRing class
+
+        :param size: Number of hours kept (length of the max-UH window)
+        """
+
+        self.size = size
+        self.shape = None
+        self.bits = [None] * size
+        self.count = 0
+
+    def add(self, bits, shape):
+        """Add the next forecast hour, replacing the oldest one if full
+
+        :param bits: Bit-packed mask from mask_util.pack_mask()
+        :param shape: Shape of the unpacked grid
+        """
+
+        if self.shape is None:
+            self.shape = tuple(shape)
+        elif tuple(shape) != self.shape:
+            raise ValueError(f'UH mask shape {tuple(shape)} does not match the previous hours {self.shape}')
+        self.bits[self.count % self.size] = bits
+        self.count += 1
+        return
+
+    def full(self):
+        """True once the ring holds a complete window of hours"""
+
+        return self.count >= self.size
+
+    def window_max(self, dtype=np.uint8):
+        """Maximum exceedance over the hours in the ring
+
+        The OR-reduction is done on the packed words and only the result is
+        unpacked.
+
+        :param dtype: Data type of the returned grid
+        :return: 2D array of 0/1 values
+        """
+
+        packed = np.bitwise_or.reduce([b for b in self.bits if b is not None], axis=0)
+        return unpack_mask(packed, self.shape, dtype)
@@ -0,0 +1,923 @@
+import os
+import datetime
+import time
+from multiprocessing import Pool
+from subprocess import Popen, PIPE
+import ncepgrib2 as ng
+import numpy as np
+from calib_severe.io import uh_cache
+from calib_severe.io import sref_cache
+from calib_severe.io import gempak
+from calib_severe.io import cal4_store
+from calib_severe.io import uh_store
+from calib_severe.io import cal_table_store
+from spc_common import product_cube
+from calib_severe.io.gdlist import read_gdlist
+from calib_severe.io.severe_grib import save_grib
+from calib_severe.calibration import calibrate
+from calib_severe.data.uh_ring import UHRing
+from calib_severe.util.uh_util import uh_grid_task, neighborhood_probs
+from spc_common import region_util
+
+# SREF variables by hazard
+HAZARDS = {
+    'tor': ['sigtp1'],
+    'hail': ['hicapep1000', 'eshrp20'],
+    'wind': ['hicapep250', 'eshrp20']
+}
+
+# SREF hours extracted once per SREF run and shared by every job of the cycle
+SREF_CYCLE = {
+    '00': (19, 39),
+    '03': (13, 33),
+    '12': (7, 27),
+    '15': (5, 21)
+}
+
+# Forecast hours of the 4-hour jobs of each cycle
+CYCLE_HOURS = {
+    '00': (16, 36),
+    '03': (16, 36),
+    '12': (4, 24),
+    '15': (8, 24)
+}
+
+# Hours calibrated 4-hour grids are kept for the full period job
+CAL4_RETENTION = 24
+
+# Hours an SREF run's environment cache is kept after the run
+SREF_RETENTION = 24
+
+# Products of a run's product cube, in cube order
+CUBE_PRODUCTS = [f'{haz}_{period}' for period in ['4hr', '24hr'] for haz in HAZARDS]
+
+# SREF grid lats and lons already read by this process, by fix directory
+SREF_GRIDS = {}
+
+
+class SevereError(Exception):
+    """Raised when a forecast can't be produced (e.g. missing input data)"""
+    pass
+
+
+def run_table(run, fhour):
+    """HREF/SREF hours used by a job
+
+    :param run: Cycle used for calibration ('00', '03', '12' or '15')
+    :param fhour: Forecast hour (e.g. '016') or 'full'
+    :return: Dictionary with the period, HREF and SREF hours of the job
+    """
+
+    if fhour == 'full':
+        tables = {
+            '03': {'rStart': 13, 'rHours': 23, 'fStart': 16, 'hrefStart': 13, 'hrefEnd': 36, 'hrefRun': 0,
+                   'hrefStartTL': 25, 'hrefEndTL': 48, 'hrefRunTL': 12, 'srefStart': 13, 'srefEnd': 33},
+            '12': {'rStart': 13, 'rHours': 23, 'fStart': 16, 'hrefStart': 1, 'hrefEnd': 24, 'hrefRun': 12,
+                   'hrefStartTL': 13, 'hrefEndTL': 36, 'hrefRunTL': 0, 'srefStart': 7, 'srefEnd': 27},
+            '15': {'rStart': 17, 'rHours': 19, 'fStart': 20, 'hrefStart': 5, 'hrefEnd': 24, 'hrefRun': 12,
+                   'hrefStartTL': 17, 'hrefEndTL': 36, 'hrefRunTL': 0, 'srefStart': 5, 'srefEnd': 21},
+            '00': {'rStart': 13, 'rHours': 23, 'fStart': 16, 'hrefStart': 13, 'hrefEnd': 36, 'hrefRun': 0,
+                   'hrefStartTL': 25, 'hrefEndTL': 48, 'hrefRunTL': 12, 'srefStart': 19, 'srefEnd': 39}
+        }
+    else:
+        f = int(fhour)
+        tables = {
+            '03': {'rStart': f - 3, 'rHours': f - 3, 'fStart': f, 'hrefStart': f - 3, 'hrefEnd': f, 'hrefRun': 0,
+                   'hrefStartTL': f + 9, 'hrefEndTL': f + 12, 'hrefRunTL': 12, 'srefStart': f - 3, 'srefEnd': f - 3},
+            '12': {'rStart': f + 9, 'rHours': f + 9, 'fStart': f + 12, 'hrefStart': f - 3, 'hrefEnd': f, 'hrefRun': 12,
+                   'hrefStartTL': f + 9, 'hrefEndTL': f + 12, 'hrefRunTL': 0, 'srefStart': f + 3, 'srefEnd': f + 3},
+            '15': {'rStart': f + 9, 'rHours': f + 9, 'fStart': f + 12, 'hrefStart': f - 3, 'hrefEnd': f, 'hrefRun': 12,
+                   'hrefStartTL': f + 9, 'hrefEndTL': f + 12, 'hrefRunTL': 0, 'srefStart': f - 3, 'srefEnd': f - 3},
+            '00': {'rStart': f - 3, 'rHours': f - 3, 'fStart': f, 'hrefStart': f - 3, 'hrefEnd': f, 'hrefRun': 0,
+                   'hrefStartTL': f + 9, 'hrefEndTL': f + 12, 'hrefRunTL': 12, 'srefStart': f + 3, 'srefEnd': f + 3}
+        }
+    return tables[run]
+
+
+def member_table(tables, init, dirs, fv3=True):
+    """HREF member attributes (including the time-lagged members)
+
+    :param tables: Dictionary from run_table()
+    :param init: Datetime object with the HREF run
+    :param dirs: Dictionary of input locations with keys hiresw, hrrr and nam
+    :param fv3: Use FV3 (True) or NMMB (False) HIRESW members
+    :return: Dictionary of member attributes keyed by member number ('1' - '10')
+    """
+
+    href_run = init.strftime('%Y%m%d%H')
+    href_dir = dirs['hiresw'] + '/hiresw.' + init.strftime('%Y%m%d')
+    hrrr_dir = dirs['hrrr'] + '/hrrr.' + init.strftime('%Y%m%d') + '/conus'
+    nam_dir = dirs['nam'] + '/nam.' + init.strftime('%Y%m%d')
+
+    # HRRR is time-lagged by 6 hours, the other members by 12 hours
+    init_hrrr_tl = init - datetime.timedelta(hours=6)
+    hrrr_run_tl = init_hrrr_tl.strftime('%Y%m%d%H')
+    hrrr_dir_tl = dirs['hrrr'] + '/hrrr.' + init_hrrr_tl.strftime('%Y%m%d') + '/conus'
+    init_tl = init - datetime.timedelta(hours=12)
+    href_run_tl = init_tl.strftime('%Y%m%d%H')
+    href_dir_tl = dirs['hiresw'] + '/hiresw.' + init_tl.strftime('%Y%m%d')
+    nam_dir_tl = dirs['nam'] + '/nam.' + init_tl.strftime('%Y%m%d')
+
+    hours = np.arange(tables['hrefStart'], tables['hrefEnd']+1)
+    hours_tl = np.arange(tables['hrefStartTL'], tables['hrefEndTL']+1)
+    hiresw = 'fv3' if fv3 else 'nmmb'
+    hiresw_thresh = 200 if fv3 else 100
+
+    def member(path, name, run, fhours, thresh, pdt, dx):
+        return {'path': path, 'name': name, 'run': run, 'fHours': fhours, 'uhThresh': thresh,
+                'pdt': f'[7, 199, 2, 0, {pdt}, 0, 0, 1, 23, 103, 0, 5000, 103, 0, 2000]', 'dx': dx}
+
+    return {
+        '1': member(href_dir, ['arw', 'conusmem2.subset'], href_run, hours, 75, 116, 3.2),
+        '2': member(href_dir_tl, ['arw', 'conusmem2.subset'], href_run_tl, hours_tl, 75, 116, 3.2),
+        '3': member(href_dir, ['arw', 'conus.subset'], href_run, hours, 75, 116, 3.2),
+        '4': member(href_dir_tl, ['arw', 'conus.subset'], href_run_tl, hours_tl, 75, 116, 3.2),
+        '5': member(href_dir, [hiresw, 'conus.subset'], href_run, hours, hiresw_thresh, 112, 3.2),
+        '6': member(href_dir_tl, [hiresw, 'conus.subset'], href_run_tl, hours_tl, hiresw_thresh, 112, 3.2),
+        '7': member(hrrr_dir, ['hrrr', 'wrfsfc'], href_run, hours, 75, 83, 3.0),
+        '8': member(hrrr_dir_tl, ['hrrr', 'wrfsfc'], hrrr_run_tl,
+                    np.arange(tables['hrefStartTL']-6, tables['hrefEndTL']-5), 75, 83, 3.0),
+        '9': member(nam_dir, ['nam', 'conusnest.hires'], href_run, hours, 100, 84, 3.0),
+        '10': member(nam_dir_tl, ['nam', 'conusnest.hires'], href_run_tl, hours_tl, 100, 84, 3.0)
+    }
+
+
+def member_file(member, fhour):
+    """Get the grib2 filename for a member and forecast hour
+
+    :param member: Dictionary of member attributes from member_table()
+    :param fhour: Forecast hour
+    :return: String with the full path of the file
+    """
+
+    fhour = str(fhour).zfill(2)
+    cyc = member['run'][-2:]
+    if member['name'][0] == 'hrrr':
+        return member['path'] + '/hrrr.t' + cyc + 'z.wrfsfcf' + fhour + '.grib2'
+    elif member['name'][0] == 'nam':
+        return member['path'] + '/nam.t' + cyc + 'z.conusnest.camfld' + fhour + '.tm00.grib2'
+    else:
+        return member['path'] + '/hiresw.t' + cyc + 'z.' + member['name'][0] + '_3km.f' + fhour + '.' + member['name'][1] + '.grib2'
+
+
+def get_sref_hours(fcsth):
+    """Valid 3-hourly SREF forecast hours within the 4-hour period ending at fcsth
+
+    :param fcsth: SREF forecast hour at the end of the period
+    :return: Tuple of the first and last SREF hours
+    """
+
+    fh2 = int(fcsth / 3.) * 3
+    fh1 = fh2 - 3
+    if fh1 < (fcsth - 4):
+        fh1 = fh2
+    return fh1, fh2
+
+
+def sref_run(run, now):
+    """SREF run paired with a cycle
+
+    :param run: Cycle used for calibration ('00', '03', '12' or '15')
+    :param now: Datetime object with the cycle
+    :return: Tuple of the SREF day (datetime) and run (YYYYMMDDHH)
+    """
+
+    if run == '00':
+        day = now - datetime.timedelta(days=1)
+        return day, day.strftime('%Y%m%d') + '21'
+    elif run == '12':
+        return now, now.strftime('%Y%m%d') + '09'
+    return now, now.strftime('%Y%m%d') + run
+
+
+def sref_grid(fix_dir):
+    """Lats and lons of the SREF 40 km grid, read once per process
+
+    :param fix_dir: Location of the fix directory
+    :return: Tuple of 2D lat and lon arrays
+    """
+
+    if fix_dir not in SREF_GRIDS:
+        grbs = ng.Grib2Decode(fix_dir + '/srefGrid.grib2')
+        SREF_GRIDS[fix_dir] = grbs.latlons()
+    return SREF_GRIDS[fix_dir]
+
+
+class SevereEngine:
+    """HREF/SREF calibrated severe probabilities for one job of a cycle
+
+    The stages can be run one at a time (load_sref, extract, neighborhood,
+    calibrate, calibrate_full, write) or all at once with forecast().
+    """
+
+    def __init__(self, run, date, fhour, dirs, members=None, cap=False, nprocs=1, fv3=True,
+                 uhcache_retention=24, deadline=None, min_members=6, reissue=False, wait=120, tile=None,
+                 region=None, coldstart=False):
+        """Constructor for SevereEngine class
+
+        :param run: Cycle used for calibration ('00', '03', '12' or '15')
+        :param date: Date of the cycle (YYYYMMDD)
+        :param fhour: Forecast hour (e.g. '016') or 'full'
+        :param dirs: Dictionary of locations with keys tmp, grib, fix, pickle,
+            uhcache, cal4, sref, hiresw, hrrr and nam
+        :param members: (Optional) Member table, defaults to member_table()
+        :param cap: Limit calibrated probabilities (60% for tor/hail, 75% for wind)
+        :param nprocs: Number of processes used to extract HREF members
+        :param fv3: Use FV3 (True) or NMMB (False) HIRESW members
+        :param uhcache_retention: Hours UH masks are kept in dirs['uhcache']
+        :param deadline: (Optional) Minutes to wait for late HREF members before
+            making a 4-hour window from the members available. None waits for
+            every member.
+        :param min_members: Fewest members a window can be made from once the
+            deadline has passed
+        :param reissue: Keep waiting after a window was made without every
+            member and remake it if the late members arrive
+        :param wait: Minutes to wait for HREF members (and at most 60 for SREF
+            files) before giving up, 0 for archived data
+        :param tile: (Optional) Tile size for the 3 km dilation and smoothing,
+            with the tiles smoothed in nprocs processes
+        :param region: (Optional) Box (west, south, east, north) from
+            region_util.get_bbox(). Only the SREF cells inside the box are
+            forecast, from 3 km fields cropped around it, and the cells outside
+            are masked in the grib2 output. UH masks are not cached and the UH
+            probabilities and 4-hour grids are kept apart from the full domain.
+        :param coldstart: Recompute the UH probabilities of 4-hour jobs from the
+            HREF files even if they are in the store
+        """
+
+        self.run = run
+        self.date = date
+        self.fhour = fhour
+        self.dirs = dirs
+        self.cap = cap
+        self.nprocs = nprocs
+        self.uhcache_retention = uhcache_retention
+        self.deadline = deadline
+        self.min_members = max(1, min_members)
+        self.reissue = reissue
+        self.wait = wait
+        self.tile = tile
+        self.region = region
+        self.coldstart = coldstart
+        self.now = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:8]), int(run))
+
+        # construct time objects
+        self.tables = dict(run_table(run, fhour))
+        day = self.now
+        if self.tables['fStart'] > 23:
+            day = self.now + datetime.timedelta(days=1)
+            self.tables['fStart'] = self.tables['fStart'] - 24
+            self.tables['rHours'] = self.tables['rHours'] - 24
+        self.valid_start = datetime.datetime(day.year, day.month, day.day, self.tables['fStart'])
+        self.uh_time = self.valid_start
+        self.cal_time = self.valid_start
+        self.r_end = self.valid_start + datetime.timedelta(hours=self.tables['rHours'])
+        self.init = datetime.datetime(self.now.year, self.now.month, self.now.day, self.tables['hrefRun'])
+        self.members = members if members is not None else member_table(self.tables, self.init, dirs, fv3)
+
+        # SREF run and hours
+        self.sref_day, self.sref_run = sref_run(run, self.now)
+        self.sref_dir = dirs['sref'] + '/spcsref.' + self.sref_day.strftime('%Y%m%d') + '/gempak'
+        self.sref_vars = sorted(set(v for haz in HAZARDS for v in HAZARDS[haz]))
+        self.sref_hours = [str(i).zfill(3) for i in range(min(get_sref_hours(self.tables['srefStart'])),
+                                                          self.tables['srefEnd']+3, 3)]
+        cycle_hours = [str(i).zfill(3) for i in range(min(get_sref_hours(SREF_CYCLE[run][0])),
+                                                      SREF_CYCLE[run][1]+3, 3)]
+        self.sref_cache_hours = sorted(set(cycle_hours) | set(self.sref_hours))
+
+        # UH probabilities are shared by every job that uses the same HREF run
+        # (region runs keep their own stores and products, see region_util.region_dir())
+        self.store_dir = region_util.region_dir(dirs['pickle'], region)
+        self.cal4_dir = region_util.region_dir(dirs['cal4'], region)
+        self.grib_dir = region_util.region_dir(dirs['grib'], region)
+        if region is not None:
+            os.makedirs(self.store_dir, exist_ok=True)
+            os.makedirs(self.cal4_dir, exist_ok=True)
+            os.makedirs(self.grib_dir, exist_ok=True)
+        self.uh_store_file = uh_store.store_fname(self.store_dir, self.init.strftime('%Y%m%d%H'))
+
+        # read SREF grid map
+        self.sref_lats, self.sref_lons = sref_grid(dirs['fix'])
+        self.region_mask = None
+        if region is not None:
+            self.region_mask = region_util.in_bbox(self.sref_lats, self.sref_lons, region)
+            if not self.region_mask.any():
+                raise SevereError(f'FATAL ERROR: No SREF grid points in region {region}, exiting...')
+
+        # calibration tables for every hazard and hour, mapped once (the
+        # store is rebuilt in the pickle directory whenever a table changes)
+        self.cal_tables = cal_table_store.get(dirs['fix'], dirs['pickle'])
+        if self.cal_tables is None:
+            print('WARNING: Calibration store not available, loading tables from the individual .npz files')
+        # stored 4-hour grids made with other tables are not reused
+        self.cal_version = cal_table_store.version(cal_table_store.sources(dirs['fix']))
+
+        self.sref_data = None
+        self.uh_probs = {}
+        self.cal4 = {haz: [] for haz in HAZARDS}
+
+    def sref_file(self, fh):
+        """Get the SREF GEMPAK filename for a forecast hour
+
+        :param fh: Zero-padded SREF forecast hour
+        :return: String with the full path of the file
+        """
+
+        return self.sref_dir + '/spcsref_' + self.sref_run + 'f' + fh
+
+    def load_sref(self):
+        """Load the SREF environment for the job
+
+        Hours missing from the cycle's cache are extracted under a lock and
+        merged into it, together with any other hours of the cycle already on
+        disk, so later jobs mostly read the cache. Only the job's own hours
+        are waited for. Cached hours whose SREF file has changed since it was
+        read are extracted again.
+        """
+
+        cache_file = sref_cache.cache_fname(self.dirs['pickle'], self.sref_run)
+        stamps = {fh: sref_cache.source_stamp(self.sref_file(fh)) for fh in self.sref_cache_hours}
+        env = sref_cache.load(cache_file, self.sref_hours, self.sref_vars, stamps)
+        if env is None:
+            with sref_cache.locked(cache_file):
+                env = sref_cache.load_hours(cache_file, self.sref_vars, stamps)
+                if not all(fh in env for fh in self.sref_hours):
+                    print('Extracting SREF data')
+                    f_count = 0
+                    while True:
+                        missing = [self.sref_file(fh) for fh in self.sref_hours
+                                   if fh not in env and not os.path.exists(self.sref_file(fh))]
+                        if not missing:
+                            break
+                        print(missing[0])
+                        f_count += 1
+                        if f_count > min(60, self.wait): # change if need be (60 minutes currently)
+                            raise SevereError('FATAL ERROR: Not enough SREF data available, exiting...')
+                        else:
+                            print('WARNING: Not enough SREF data available, waiting one minute.')
+                            time.sleep(60)
+
+                    hours = [fh for fh in self.sref_cache_hours if fh not in env
+                             and (fh in self.sref_hours or os.path.exists(self.sref_file(fh)))]
+                    stamps.update({fh: sref_cache.source_stamp(self.sref_file(fh)) for fh in hours})
+                    print('Reading SREF data from GEMPAK grid files')
+                    new = self._gempak_env(hours)
+                    if new is None:
+                        print('WARNING: Falling back to gdlist for SREF data')
+                        new = self._gdlist_env(hours)
+                    env.update(new)
+                    sref_cache.save(cache_file, env, stamps)
+                    n_pruned = sref_cache.prune(self.dirs['pickle'], self.now, SREF_RETENTION)
+                    if n_pruned:
+                        print(f"Removed {n_pruned} SREF caches older than {SREF_RETENTION} hours from {self.dirs['pickle']}")
+        else:
+            print('Loading cached SREF data from ' + cache_file)
+
+        self.sref_data = {fh: {v: env[fh][v] for v in self.sref_vars} for fh in self.sref_hours}
+        return self.sref_data
+
+    def _gempak_env(self, hours):
+        """Read SREF env data straight from the GEMPAK grid files
+
+        :param hours: List of zero-padded SREF forecast hours
+        :return: Dictionary of arrays keyed by hour and variable, or None if
+            any grid is missing, truncated or uses a packing the reader can't
+            unpack
+        """
+
+        sref_init = datetime.datetime.strptime(self.sref_run, '%Y%m%d%H')
+        env = {}
+        for fh in hours:
+            sref_file = self.sref_file(fh)
+            print(sref_file)
+            env[fh] = {}
+            try:
+                grid = gempak.GempakGrid(sref_file)
+                for v in self.sref_vars:
+                    env[fh][v] = grid.read(v, int(fh), sref_init)
+                    if env[fh][v] is None:
+                        return None
+            except (OSError, ValueError, IndexError) as e:
+                print(f'WARNING: Unable to read {sref_file} ({e})')
+                return None
+        return env
+
+    def _gdlist_env(self, hours):
+        """Extract SREF env data with $GEMEXE/gdlist and parse the text output
+
+        :param hours: List of zero-padded SREF forecast hours
+        :return: Dictionary of arrays keyed by hour and variable
+        """
+
+        tmp_dir = self.dirs['tmp']
+        txt = ['#!/bin/csh','','$GEMEXE/gdlist <<EOF']
+        for fh in hours:
+            for v in self.sref_vars:
+                sref_file = self.sref_file(fh)
+                print(sref_file)
+                txt.append('')
+                txt.append('    GDFILE   = ' + sref_file)
+                txt.append('    GDATTIM  = ' + self.sref_run[2:8] + '/' + self.sref_run[-2:] + '00F' + fh)
+                txt.append('    GLEVEL   = 0')
+                txt.append('    GVCORD   = none')
+                txt.append('    GFUNC    = ' + v)
+                txt.append('    GAREA    = grid')
+                txt.append('    PROJ     =')
+                txt.append('    SCALE    = 0')
+                txt.append('    OUTPUT   = f/' + tmp_dir + '/sref_' + self.sref_run + '_' + v + '_' + fh + '.txt')
+                txt.append('')
+                txt.append('run')
+        txt.extend(['','exit','','EOF'])
+
+        # write gdlist commands to c-shell script and execute script
+        # this will create many text files containing SREF env data
+        with open(tmp_dir + '/gdlist.csh','w') as f:
+            f.write('\n'.join(txt))
+
+        os.chmod(tmp_dir + '/gdlist.csh', 0o755)
+
+        p = Popen(tmp_dir + '/gdlist.csh', shell=True, stdout=PIPE)
+        p.wait()
+
+        # read SREF env data to numpy arrays, parsing the text files concurrently
+        print('Formatting SREF data')
+        gdlist_files = []
+        for fh in hours:
+            for v in self.sref_vars:
+                gdlist_file = tmp_dir + '/sref_' + self.sref_run + '_' + v + '_' + fh + '.txt'
+                if not os.path.exists(gdlist_file):
+                    raise SevereError('FATAL ERROR: gdlist data file not available (' + gdlist_file + '), exiting.')
+                gdlist_files.append((fh, v, gdlist_file))
+        if self.nprocs > 1:
+            with Pool(min(self.nprocs, len(gdlist_files))) as pool:
+                grids = pool.map(read_gdlist, [f for _, _, f in gdlist_files])
+        else:
+            grids = [read_gdlist(f) for _, _, f in gdlist_files]
+        env = {fh: {} for fh in hours}
+        for (fh, v, gdlist_file), grid in zip(gdlist_files, grids):
+            env[fh][v] = grid
+        return env
+
+    def _extract_members(self, tasks, pool=None):
+        """Run uh_grid() for a list of (member, fhour) tasks, in parallel if a pool is given
+
+        Results are returned in task order so member order stays deterministic.
+
+        :param tasks: List of (member, fhour) tuples
+        :param pool: (Optional) multiprocessing Pool
+        :return: List of (bits, shape) tuples
+        """
+
+        uh_tasks = []
+        for member, fhour in tasks:
+            attrs = self.members[member]
+            mask_file = uh_cache.mask_fname(self.dirs['uhcache'], attrs['name'], attrs['run'], fhour, attrs['uhThresh'])
+            if self.region is not None:
+                mask_file = None  # cropped masks aren't shared with full domain jobs
+            grid_file = uh_cache.grid_fname(self.dirs['uhcache'], attrs['name'])
+            uh_tasks.append((member_file(attrs, fhour), attrs['uhThresh'], attrs['dx'], mask_file, grid_file,
+                             self.tile, self.region))
+
+        if pool is not None and len(uh_tasks) > 1:
+            results = pool.map(uh_grid_task, uh_tasks)
+        else:
+            results = [uh_grid_task(task) for task in uh_tasks]
+
+        grids = []
+        for (member, fhour), uh_task, result in zip(tasks, uh_tasks, results):
+            href_file, grid_file = uh_task[0], uh_task[4]
+            attrs = self.members[member]
+            if result is None:
+                raise SevereError(f'FATAL ERROR: Updraft Helicity index not found in {href_file}, exiting...')
+            bits, shape, lats, lons, roi = result
+            if lats is None:
+                print(f"Reusing cached UH mask for member {member} ({attrs['run']} f{str(fhour).zfill(2)})")
+            if lats is None and 'lats' not in attrs:
+                # cached mask, so the grid comes from the cache (or the file if missing)
+                lats, lons = uh_cache.load_grid(grid_file)
+                if lats is None:
+                    lats, lons = ng.Grib2Decode(href_file)[1].latlons()
+            if lats is not None:
+                attrs['lats'] = lats
+                attrs['lons'] = lons
+            attrs['roi'] = roi
+            grids.append((bits, shape))
+        return grids
+
+    def extract(self):
+        """Extract 4-hour max UH exceedance from the HREF members as they arrive
+
+        Only the last four hours of each member are kept, bit-packed, and
+        members may not run past the next window. A member's window max is
+        added to a running count as soon as its last hour arrives, so only the
+        smoothing is left once the final member lands.
+
+        Past the deadline a window is yielded with the members available (at
+        least min_members). With reissue, the same window is yielded again
+        once the late members arrive.
+
+        :return: Generator of (idx, count, used) with the window index, a 2D
+            count of members exceeding the UH threshold and the list of members
+            in the count
+        """
+
+        n_pruned = uh_cache.prune(self.dirs['uhcache'], self.now, self.uhcache_retention)
+        if n_pruned:
+            print(f"Removed {n_pruned} UH masks older than {self.uhcache_retention} hours from {self.dirs['uhcache']}")
+
+        rings = {member: UHRing(4) for member in self.members}
+        n_hours = len(self.members['1']['fHours'])
+        next_hour = 3  # end hour index of the next 4-hour window
+        counted = set()
+        count = None
+        f_count = 0
+        waited = 0    # minutes waited for the current window
+        issued = False  # the current window was made without every member
+        pool = Pool(min(self.nprocs, len(self.members) * n_hours)) if self.nprocs > 1 else None
+        try:
+            while next_hour < n_hours:
+                # queue every member-hour that has arrived but not been processed yet
+                tasks = []
+                for member in self.members:
+                    for fhour in self.members[member]['fHours'][rings[member].count:next_hour+1]:
+                        href_file = member_file(self.members[member], fhour)
+                        if not os.path.exists(href_file):
+                            print('Waiting one minute to find ' + href_file)
+                            break
+                        print(f'Loading {href_file}')
+                        tasks.append((member, fhour))
+                for (member, fhour), (bits, shape) in zip(tasks, self._extract_members(tasks, pool)):
+                    try:
+                        rings[member].add(bits, shape)
+                    except ValueError as e:
+                        raise SevereError(f'FATAL ERROR: HREF member {member} f{fhour}: {e}, exiting...')
+
+                # count members as soon as they complete the window
+                for member in self.members:
+                    if member not in counted and rings[member].count == next_hour+1:
+                        uh = rings[member].window_max()
+                        if count is None:
+                            count = np.zeros(uh.shape, dtype=np.uint16)
+                        count += uh
+                        counted.add(member)
+
+                # yield the window once all members have completed it
+                used = [member for member in self.members if member in counted]
+                if len(counted) == len(self.members):
+                    if issued:
+                        print('Late HREF members arrived, reissuing the window')
+                    yield next_hour-3, count, used
+                elif not tasks:
+                    if (not issued and self.deadline is not None and waited >= self.deadline
+                            and len(counted) >= min(self.min_members, len(self.members))):
+                        missing = [member for member in self.members if member not in counted]
+                        print(f'WARNING: HREF members {", ".join(missing)} not available after the {self.deadline} min '
+                              f'deadline, using {len(used)} of {len(self.members)} members')
+                        yield next_hour-3, count.copy(), used
+                        if self.reissue:
+                            issued = True
+                            print('Waiting for the late HREF members to reissue the window')
+                            continue
+                    else:
+                        f_count += 1
+                        if f_count <= self.wait: # change if need be, currently 2 hours of checking
+                            waited += 1
+                            time.sleep(60)
+                            continue
+                        if not issued:
+                            raise SevereError('FATAL ERROR: Not enough HREF members available to produce calibrated probabilities, exiting...')
+                        print('WARNING: Late HREF members did not arrive, keeping the window made without them')
+                else:
+                    continue
+
+                # move on to the next window
+                counted = set()
+                count = None
+                waited = 0
+                issued = False
+                next_hour += 1
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def neighborhood(self, count, used):
+        """Neighborhood probabilities for the next 4-hour window
+
+        :param count: 2D count of members exceeding the UH threshold from extract()
+        :param used: List of the members in count
+        :return: 2D array of probabilities (%) on the SREF grid
+        """
+
+        forecast_time = self.uh_time.strftime('%Y%m%d%H')
+        print('Computing Neighborhood Probabilities: ' + forecast_time)
+        print(f'Using {len(used)} of {len(self.members)} HREF members: '
+              + ', '.join(f"{self.members[m]['name'][0]}.{self.members[m]['name'][1]} {self.members[m]['run']}z"
+                          for m in used))
+        # the 3 km grid and smoothing are member 1's whichever members are used
+        # (the grid is only taken from another member if member 1 hasn't arrived)
+        lead = self.members['1'] if 'lats' in self.members['1'] else self.members[used[0]]
+        roi = 40. / self.members['1']['dx']
+        pool = Pool(self.nprocs) if self.tile is not None and self.nprocs > 1 else None
+        try:
+            self.uh_probs[forecast_time] = neighborhood_probs(count, lead['lats'], lead['lons'], roi,
+                                                              self.sref_lats, self.sref_lons,
+                                                              n_members=len(used), tile=self.tile, pool=pool,
+                                                              targets=self.region_mask)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self.uh_time += datetime.timedelta(hours=1)
+        return self.uh_probs[forecast_time]
+
+    def href_hour(self, fh):
+        """HREF forecast hour used in the output filenames
+
+        :param fh: Zero-padded SREF forecast hour
+        :return: Zero-padded HREF forecast hour
+        """
+
+        if self.run == '12' or self.run == '00':
+            return str(int(fh) - 3).zfill(3)
+        return str(fh).zfill(3)
+
+    def cal_table(self, haz, fh=None):
+        """Get a calibration table from the calibration store, or the
+        individual .npz file if it isn't in the store
+
+        :param haz: Hazard (tor, hail or wind)
+        :param fh: Zero-padded SREF forecast hour, or None for the full period table
+        :return: 2D calibration table
+        """
+
+        if self.cal_tables is not None:
+            caltbl = cal_table_store.table(self.cal_tables, haz, self.run, fh, self.cap)
+            if caltbl is not None:
+                return caltbl
+
+        if fh is None:
+            fname = self.dirs['fix'] + '/cal_' + haz + '_24h_tbl' + self.run + '.npz'
+        else:
+            fname = self.dirs['fix'] + '/cal_' + haz + '_tbl' + self.run + '_f' + fh[1:] + '.npz'
+        return calibrate.load_table(fname, haz, self.cap)
+
+    def sref_predictors(self, idx):
+        """SREF predictors of every hazard over the 4-hour window
+
+        The variables are stacked and maximized over the SREF hours of the
+        window together. Hazards with two variables (CAPE and shear) use their
+        product / 100. Missing SREF values are treated as 0.
+
+        :param idx: Window index (hours after srefStart)
+        :return: 3D array (hazard, ny, nx) in HAZARDS order
+        """
+
+        fh1, fh2 = [str(h).zfill(3) for h in get_sref_hours(self.tables['srefStart']+idx)]
+        hours = [fh1] if fh1 == fh2 else [fh1, fh2]
+        env = np.stack([[np.ma.filled(self.sref_data[fh][v], 0.) for v in self.sref_vars] for fh in hours])
+        env = env.max(axis=0)
+
+        predictors = []
+        for haz in HAZARDS:
+            iv = [self.sref_vars.index(v) for v in HAZARDS[haz]]
+            if len(iv) == 1:
+                predictors.append(env[iv[0]])
+            else:
+                predictors.append((env[iv[0]] * env[iv[1]]) / 100)
+        return np.stack(predictors)
+
+    def cal_tables_4hr(self, fh):
+        """Calibration tables of every hazard for a forecast hour
+
+        :param fh: Zero-padded SREF forecast hour
+        :return: 3D array (hazard, bin, bin) in HAZARDS order
+        """
+
+        return np.stack([self.cal_table(haz, fh) for haz in HAZARDS])
+
+    def cal4_file(self, fh):
+        """Get the store filename for the calibrated 4-hour grids of an hour
+
+        :param fh: Zero-padded SREF forecast hour
+        :return: String with the full path of the store file
+        """
+
+        return cal4_store.cal4_fname(self.cal4_dir, self.date + self.run, fh, self.cap)
+
+    def load_cal4(self, idx):
+        """Load the calibrated 4-hour grids of the next window from the store
+
+        :param idx: Window index (hours after srefStart)
+        :return: Dictionary of 2D arrays (%) keyed by hazard, or None if the
+            window is not in the store or was made with other calibration tables
+        """
+
+        fh = str(self.tables['srefStart']+idx).zfill(3)
+        fcsts = cal4_store.load(self.cal4_file(fh), list(HAZARDS), self.cal_version)
+        if fcsts is None:
+            return None
+        for haz in HAZARDS:
+            self.cal4[haz].append(fcsts[haz])
+        self.cal_time += datetime.timedelta(hours=1)
+        return fcsts
+
+    def calibrate(self, idx):
+        """Calibrated 4-hour probabilities for the next window
+
+        The 4-hour grib2 files are written unless this is a full period job,
+        and the grids are kept in the store for the full period job.
+
+        :param idx: Window index (hours after srefStart)
+        :return: Dictionary of 2D arrays (%) keyed by hazard
+        """
+
+        forecast_time = self.cal_time.strftime('%Y%m%d%H')
+        if forecast_time not in self.uh_probs:
+            raise SevereError(f'FATAL ERROR: 4-hr UH probabilities for {forecast_time} not found in {self.uh_store_file}, exiting...')
+        fh = str(self.tables['srefStart']+idx).zfill(3)
+
+        # all hazards are calibrated together into a (hazard, ny, nx) array
+        fcst = calibrate.calibrate_4hr_fused(self.uh_probs[forecast_time], self.sref_predictors(idx),
+                                             self.cal_tables_4hr(fh))
+        fcsts = dict(zip(HAZARDS, fcst))
+        for haz in HAZARDS:
+            if self.fhour != 'full':
+                href_hour = self.href_hour(fh)
+                self.write(fcsts[haz], haz, self.cal_time, int(href_hour) - 4, '4',
+                           self.grib_dir + '/href_cal_' + haz + '.t' + self.run + 'z.4hr.f' + href_hour + '.grib2')
+
+            # add to dictionary for use in full period probability
+            self.cal4[haz].append(fcsts[haz])
+
+        cal4_store.save(self.cal4_file(fh), fcsts, self.cal_version)
+        self.cal_time += datetime.timedelta(hours=1)
+        return fcsts
+
+    def calibrate_full(self):
+        """Calibrated full period probabilities, written to grib2
+
+        :return: Dictionary of 2D arrays (%) keyed by hazard
+        """
+
+        fh = str(self.tables['srefEnd']).zfill(3)
+        href_hour = self.href_hour(fh)
+        hours = '20' if self.run == '15' else '24'
+        fcsts = {}
+        for haz in self.cal4:
+            fcsts[haz] = calibrate.calibrate_full(self.cal4[haz], self.cal_table(haz))
+            self.write(fcsts[haz], haz, self.r_end, int(href_hour) - int(hours), hours,
+                       self.grib_dir + '/href_cal_' + haz + '.t' + self.run + 'z.24hr.f' + href_hour + '.grib2')
+        return fcsts
+
+    def write(self, fcst, haz, e_time, fhour, out_time, out_grib):
+        """Write calibrated probabilities to grib2
+
+        :param fcst: 2D array of probabilities (%)
+        :param haz: Hazard (tor, hail or wind)
+        :param e_time: Datetime object with the end of the period
+        :param fhour: Forecast hour at the start of the period
+        :param out_time: Length of the period in hours
+        :param out_grib: Location of the output file
+        """
+
+        if self.region_mask is not None:
+            fcst = np.ma.masked_where(~self.region_mask, fcst)
+        save_grib(fcst, e_time, self.now, fhour, haz, out_time, out_grib, self.run, self.date)
+        self.write_cube(fcst, haz, fhour + int(out_time), '4hr' if out_time == '4' else '24hr')
+        return
+
+    def cube_fname(self):
+        """Get the product cube filename of the run
+
+        :return: String with the full path of the cube next to the grib2 files
+        """
+
+        return self.grib_dir + '/href_cal.t' + self.run + 'z.severe_cube.dat'
+
+    def write_cube(self, fcst, haz, fhour, period):
+        """Add one grid to the run's product cube
+
+        The grib2 files are the product, so a cube that can't be written is
+        only a warning.
+
+        :param fcst: 2D array of probabilities (%)
+        :param haz: Hazard (tor, hail or wind)
+        :param fhour: HREF forecast hour in the grib2 filename
+        :param period: '4hr' or '24hr'
+        """
+
+        try:
+            product_cube.write(self.cube_fname(), f'{haz}_{period}', fhour, fcst, CUBE_PRODUCTS, self.now)
+        except OSError as e:
+            print(f'WARNING: Unable to write {haz}_{period} f{str(fhour).zfill(3)} to {self.cube_fname()}: {e}')
+        return
+
+    def href_lead(self, valid):
+        """Forecast hour of the HREF run valid at a time
+
+        :param valid: Datetime object at the end of a 4-hour window
+        :return: Integer forecast hour
+        """
+
+        return int((valid - self.init).total_seconds() // 3600)
+
+    def has_uh_probs(self):
+        """True if the UH probabilities of every window of the job are in the store"""
+
+        leads = [self.href_lead(self.valid_start + datetime.timedelta(hours=idx))
+                 for idx in range(self.tables['srefEnd'] - self.tables['srefStart'] + 1)]
+        return set(leads) <= set(uh_store.valid_hours(self.uh_store_file))
+
+    def load_uh_probs(self):
+        """Map the pre-computed 4-hour UH probabilities of the HREF run
+
+        The hours are views of the store, so nothing is read until it is used.
+        """
+
+        data, valid = uh_store.open_store(self.uh_store_file, self.sref_lats.shape)
+        if data is None:
+            raise SevereError('FATAL ERROR: 4-hr UH probabilities not available (' + self.uh_store_file + '), exiting...')
+        self.uh_probs = {}
+        for lead in valid:
+            valid_time = self.init + datetime.timedelta(hours=int(lead))
+            self.uh_probs[valid_time.strftime('%Y%m%d%H')] = data[lead]
+        return self.uh_probs
+
+    def save_uh_probs(self, valid):
+        """Write the UH probabilities of one window to the store for use in full
+        period forecasts and in 15Z, 03Z updates
+
+        :param valid: Datetime object at the end of the 4-hour window
+        """
+
+        uh_store.write(self.uh_store_file, self.href_lead(valid), self.uh_probs[valid.strftime('%Y%m%d%H')])
+        return
+
+    def forecast(self):
+        """Run every stage of the job
+
+        Raises SevereError if the forecast can't be produced.
+        """
+
+        n_windows = self.tables['srefEnd'] - self.tables['srefStart'] + 1
+        if self.fhour != 'full':
+            self.load_sref()
+        if self.fhour != 'full' and (self.coldstart or not self.has_uh_probs()):
+            # extract hourly max UH from HREF grib2 data while remapping max
+            # values to the SREF 40km grid (neighborhooding)
+            print('Extracting UH and regridding HREF data for 4hr forecasts')
+            last_idx = None
+            for idx, count, used in self.extract():
+                if idx == last_idx:
+                    # the window was made before every member arrived, so remake it
+                    self.uh_time -= datetime.timedelta(hours=1)
+                    self.cal_time -= datetime.timedelta(hours=1)
+                    for haz in self.cal4:
+                        self.cal4[haz].pop()
+                valid = self.uh_time
+                self.neighborhood(count, used)
+                self.calibrate(idx)
+                self.save_uh_probs(valid)
+                last_idx = idx
+        elif self.fhour != 'full':
+            print('Loading Pre-Computed 4-hr UH Probabilities')
+            self.load_uh_probs()
+            print('Computing 4-hour Calibrated HREF/SREF Probabilities')
+            for idx in range(n_windows):
+                self.calibrate(idx)
+        else:
+            # reuse the grids of the 4-hour jobs and only calibrate the missing hours
+            n_pruned = cal4_store.prune(self.cal4_dir, self.now, CAL4_RETENTION)
+            if n_pruned:
+                print(f"Removed {n_pruned} calibrated 4-hr grids older than {CAL4_RETENTION} hours from {self.cal4_dir}")
+            n_cached = 0
+            for idx in range(n_windows):
+                if self.load_cal4(idx) is not None:
+                    n_cached += 1
+                    continue
+                if self.sref_data is None:
+                    self.load_sref()
+                if not self.uh_probs:
+                    print('Loading Pre-Computed 4-hr UH Probabilities')
+                    self.load_uh_probs()
+                self.calibrate(idx)
+            print(f'Reused {n_cached} of {n_windows} calibrated 4-hr hours from {self.cal4_dir}')
+            print('Computing Day 1 Full Period Calibrated HREF/SREF Probabilities')
+            self.calibrate_full()
+        return
+
+
+def forecast_cycle(run, date, dirs, **kwargs):
+    """Produce every 4-hour and full period forecast of a cycle in one process
+
+    :param run: Cycle used for calibration ('00', '03', '12' or '15')
+    :param date: Date of the cycle (YYYYMMDD)
+    :param dirs: Dictionary of locations (see SevereEngine)
+    :param kwargs: Other SevereEngine arguments
+    """
+
+    for fhour in range(CYCLE_HOURS[run][0], CYCLE_HOURS[run][1]+1):
+        SevereEngine(run, date, str(fhour).zfill(3), dirs, **kwargs).forecast()
+    SevereEngine(run, date, 'full', dirs, **kwargs).forecast()
+    return
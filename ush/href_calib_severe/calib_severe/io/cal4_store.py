@@ -0,0 +1,86 @@
+import os
+import re
+import zipfile
+import datetime
+import numpy as np
+
+
+def cal4_fname(store_dir, cycle, fh, cap=False):
+    """Get the store filename for the calibrated 4-hour grids of one hour
+
+    :param store_dir: Location of the store
+    :param cycle: Cycle used for calibration (YYYYMMDDHH, e.g. 2019052003)
+    :param fh: Zero-padded SREF forecast hour (calibration table hour)
+    :param cap: True if the grids were computed from capped tables
+    :return: String with the full path of the store file
+    """
+
+    suffix = '_cap' if cap else ''
+    return os.path.join(store_dir, f'cal4_{cycle}_f{fh}{suffix}.npz')
+
+
+def save(fname, fcsts, version=''):
+    """Store the calibrated 4-hour grids of one hour
+
+    Written atomically so the full period job never sees a partial file.
+
+    :param fname: Store filename from cal4_fname()
+    :param fcsts: Dictionary of 2D arrays (%) keyed by hazard
+    :param version: Identity of the calibration tables the grids were made
+        with (see cal_table_store.version())
+    """
+
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    tmp = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, version=np.array(version), **fcsts)
+    os.replace(tmp, fname)
+    return
+
+
+def load(fname, hazards, version=None):
+    """Load the calibrated 4-hour grids of one hour
+
+    :param fname: Store filename from cal4_fname()
+    :param hazards: Hazards needed (e.g. ['tor', 'hail', 'wind'])
+    :param version: (Optional) Identity of the current calibration tables.
+        Grids made with other tables are treated as missing. None accepts
+        grids made with any tables.
+    :return: Dictionary of 2D arrays (%) keyed by hazard, or None if the hour
+        is not in the store
+    """
+
+    try:
+        with np.load(fname) as x:
+            if version is not None and ('version' not in x.files or str(x['version']) != version):
+                return None
+            return {haz: x[haz] for haz in hazards}
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+
+def prune(store_dir, now, retention):
+    """Remove grids of cycles older than the retention window
+
+    :param store_dir: Location of the store
+    :param now: Datetime object with the current cycle
+    :param retention: Number of hours to keep grids after their cycle
+    :return: Number of files removed
+    """
+
+    removed = 0
+    oldest = now - datetime.timedelta(hours=retention)
+    try:
+        fnames = os.listdir(store_dir)
+    except OSError:
+        return removed
+    for fname in fnames:
+        match = re.match(r'cal4_(\d{10})_f\d+(_cap)?\.npz$', fname)
+        if match is None or datetime.datetime.strptime(match.group(1), '%Y%m%d%H') >= oldest:
+            continue
+        try:
+            os.remove(os.path.join(store_dir, fname))
+            removed += 1
+        except OSError:
+            continue  # already removed by another job
+    return removed
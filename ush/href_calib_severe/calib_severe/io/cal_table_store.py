@@ -0,0 +1,200 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+from calib_severe.calibration.calibrate import CAPS
+
+"""
+Consolidated store of the severe calibration tables in fix/href_calib_severe
+
+One float64 array indexed by [cap, hazard, cycle, forecast hour, UH bin,
+SREF bin]. Forecast hour is the SREF hour (0 - NHOURS-1) of the 4-hour
+tables (cal_{haz}_tbl{run}_f{fh}.npz), and FULL (index NHOURS) holds the full
+period tables (cal_{haz}_24h_tbl{run}.npz). Tables that don't exist are NaN.
+
+The store is built from the fix files at run time and kept in a writable
+cache directory. A manifest (.json) records the size and modification time
+of every table it was built from, and the store is rebuilt as soon as any
+table is added, removed or replaced.
+"""
+
+HAZARDS = ['tor', 'hail', 'wind']
+RUNS = ['00', '03', '12', '15']
+NHOURS = 48
+FULL = NHOURS
+NBINS = 11
+
+TABLE_4HR = re.compile(r'cal_(tor|hail|wind)_tbl(\d{2})_f(\d+)\.npz$')
+TABLE_FULL = re.compile(r'cal_(tor|hail|wind)_24h_tbl(\d{2})\.npz$')
+
+
+def store_fname(cache_dir):
+    """Get the filename of the calibration store
+
+    :param cache_dir: Location of the store (e.g. COMOUTspc_pickle)
+    :return: String with the full path of the store
+    """
+
+    return os.path.join(cache_dir, 'cal_tables.npy')
+
+
+def manifest_fname(fname):
+    """Get the filename of the manifest of a store
+
+    :param fname: Store filename from store_fname()
+    :return: String with the full path of the manifest
+    """
+
+    return fname[:-len('.npy')] + '.json'
+
+
+def sources(fix_dir):
+    """Identify the version of every table in the fix directory
+
+    :param fix_dir: Location of the severe fix files
+    :return: List of [filename, size, mtime_ns] sorted by filename
+    """
+
+    stamps = []
+    for fname in sorted(os.listdir(fix_dir)):
+        if TABLE_4HR.match(fname) or TABLE_FULL.match(fname):
+            stat = os.stat(os.path.join(fix_dir, fname))
+            stamps.append([fname, stat.st_size, stat.st_mtime_ns])
+    return stamps
+
+
+def version(stamps):
+    """Identify a set of tables, e.g. to tag grids calibrated with them
+
+    :param stamps: List from sources()
+    :return: Hex string
+    """
+
+    return hashlib.sha1(json.dumps(stamps).encode()).hexdigest()
+
+
+def build(fix_dir):
+    """Build the calibration store from the individual .npz tables
+
+    :param fix_dir: Location of the severe fix files
+    :return: Array of shape (2, 3, 4, NHOURS+1, NBINS, NBINS), where cap index
+        1 holds the tables limited to calibrate.CAPS
+    """
+
+    tables = np.full((2, len(HAZARDS), len(RUNS), NHOURS + 1, NBINS, NBINS), np.nan)
+    for fname in sorted(os.listdir(fix_dir)):
+        match = TABLE_4HR.match(fname)
+        if match is not None:
+            haz, run, fh = match.group(1), match.group(2), int(match.group(3))
+            known = fh < NHOURS  # index NHOURS is the FULL slot
+        else:
+            match = TABLE_FULL.match(fname)
+            if match is None:
+                continue
+            haz, run, fh = match.group(1), match.group(2), FULL
+            known = True
+        if run not in RUNS or not known:
+            print(f'WARNING: Skipping {fname}, not a known cycle/forecast hour')
+            continue
+
+        caltbl = np.load(os.path.join(fix_dir, fname))['calib_table']
+        if caltbl.shape != (NBINS, NBINS):
+            print(f'WARNING: Skipping {fname}, table shape is {caltbl.shape}')
+            continue
+        h, r = HAZARDS.index(haz), RUNS.index(run)
+        tables[0, h, r, fh] = caltbl
+        tables[1, h, r, fh] = np.minimum(caltbl, CAPS[haz])
+    return tables
+
+
+def save(fname, tables, stamps):
+    """Write the calibration store and its manifest
+
+    The store is written first and the manifest last, so a store is never
+    used with the manifest of another one.
+
+    :param fname: Store filename from store_fname()
+    :param tables: Array from build()
+    :param stamps: List from sources() of the tables the store was built from
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+    tmp = f'{fname}.{os.getpid()}.tmp.npy'
+    np.save(tmp, tables)
+    os.replace(tmp, fname)
+    tmp = f'{manifest_fname(fname)}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'shape': list(tables.shape), 'sources': stamps}, f)
+    os.replace(tmp, manifest_fname(fname))
+    return
+
+
+def load(fname, stamps):
+    """Memory-map the calibration store
+
+    :param fname: Store filename from store_fname()
+    :param stamps: List from sources() of the current tables
+    :return: Read-only array from build(), or None if the store is missing or
+        was built from other tables
+    """
+
+    try:
+        with open(manifest_fname(fname)) as f:
+            manifest = json.load(f)
+        tables = np.load(fname, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    if manifest.get('sources') != stamps or list(tables.shape) != manifest.get('shape'):
+        return None
+    return tables
+
+
+def get(fix_dir, cache_dir):
+    """Get the calibration store, rebuilding it if the tables changed
+
+    :param fix_dir: Location of the severe fix files
+    :param cache_dir: Location of the store
+    :return: Read-only array from build(), or None if there are no tables
+    """
+
+    stamps = sources(fix_dir)
+    if not stamps:
+        return None
+    fname = store_fname(cache_dir)
+    tables = load(fname, stamps)
+    if tables is not None:
+        return tables
+
+    print(f'Building calibration store {fname}')
+    tables = build(fix_dir)
+    try:
+        save(fname, tables, stamps)
+    except OSError as e:
+        print(f'WARNING: Could not save the calibration store ({e})')
+    return tables
+
+
+def table(tables, haz, run, fh=None, cap=False):
+    """Get one table from the store
+
+    :param tables: Array from load()
+    :param haz: Hazard (tor, hail or wind)
+    :param run: Cycle used for calibration ('00', '03', '12' or '15')
+    :param fh: SREF forecast hour, or None for the full period table
+    :param cap: Get the table limited to calibrate.CAPS
+    :return: 2D calibration table, or None if it isn't in the store
+    """
+
+    if fh is None:
+        fh = FULL
+    elif not 0 <= int(fh) < NHOURS:
+        return None  # index NHOURS is the FULL slot
+    else:
+        fh = int(fh)
+    if run not in RUNS or haz not in HAZARDS:
+        return None
+    caltbl = tables[int(cap), HAZARDS.index(haz), RUNS.index(run), fh]
+    if np.isnan(caltbl).any():
+        return None
+    return caltbl
@@ -0,0 +1,39 @@
+import re
+import numpy as np
+
+# Row labels (e.g. 'ROW129') that precede each row of values in gdlist output
+ROW_LABEL = re.compile(r'ROW\s*\d+')
+GRID_SIZE = re.compile(r'GRID SIZE:?\s+(\d+)\s+(\d+)')
+SCALE_FACTOR = re.compile(r'Scale factor(.*)')
+
+
+def read_gdlist(f, mask=-9999):
+    """Parse a GEMPAK gdlist text file into a numpy array
+
+    The header is searched once for the grid size and scale factor, then the
+    whole data block is converted in one pass.
+
+    :param f: Location of the gdlist output file
+    :param mask: Value to mask (GEMPAK missing value), or None for no mask
+    :return: Array of shape (rows, columns) with row 1 (south) first
+    """
+
+    scale_factor = 1
+    with open(f, "r") as IN:
+        text = IN.read()
+
+    # Header holds the grid size and scale factor and ends at the top row label
+    size = GRID_SIZE.search(text)
+    lonsize = int(size.group(1))
+    latsize = int(size.group(2))
+    start = text.index('ROW{:3d}'.format(latsize), size.end())
+    scale = SCALE_FACTOR.search(text, 0, start)
+    if scale:
+        scale_factor = 10**(float(scale.group(1).split()[-1]))
+
+    vals = np.fromstring(ROW_LABEL.sub(' ', text[start:]), dtype=np.float64, sep=' ')
+    vals = scale_factor * vals
+    if mask:
+        vals = np.ma.masked_where(vals == mask, vals)
+    vals = vals.reshape(latsize, -1)
+    return vals[::-1]
@@ -0,0 +1,213 @@
+import datetime
+import numpy as np
+
+"""
+Source: GEMPAK Data Management (DM) library and grid packing routines
+    (gempak/source/gemlib/dm, gempak/source/gemlib/gd, gempak/source/gemlib/gr)
+    Pointers in a DM file are 1-based indices of 4-byte words.
+"""
+
+GEMPAK_HEADER = b'GEMPAK DATA MANAGEMENT FILE '
+USED_FLAG = 9999
+RMISSD = -9999.
+
+# Grid packing types
+MDGNON = 0
+MDGGRB = 1
+MDGNMC = 2
+MDGDIF = 3
+MDGDEC = 4
+
+
+class GempakGrid:
+    """Reader for GEMPAK grid files that decodes grids straight into arrays"""
+
+    def __init__(self, fname):
+        """Constructor for GempakGrid class
+
+        Reads the DM file header, grid navigation, parts and column headers.
+
+        :param fname: Location of the GEMPAK grid file
+        """
+
+        self.fname = fname
+        raw = np.fromfile(fname, dtype=np.uint8)
+        if raw[:len(GEMPAK_HEADER)].tobytes() != GEMPAK_HEADER:
+            raise OSError(f'{fname} is not a GEMPAK file')
+
+        # The DM version (1) is the first word after the label and sets the byte order
+        order = '<' if raw[28:32].view('<i4')[0] == 1 else '>'
+        nwords = raw.size // 4
+        self.raw = raw
+        self.ints = raw[:nwords * 4].view(order + 'i4')
+        self.floats = raw[:nwords * 4].view(order + 'f4')
+
+        # Product description
+        self.file_headers = self._int(9)
+        self.file_keys_ptr = self._int(10)
+        self.rows = self._int(11)
+        self.columns = self._int(15)
+        self.column_keys = self._int(16)
+        self.column_keys_ptr = self._int(17)
+        self.column_headers_ptr = self._int(18)
+        self.parts = self._int(19)
+        self.parts_ptr = self._int(20)
+        self.data_block_ptr = self._int(23)
+
+        # Grid navigation (NAVB file header) gives the grid dimensions
+        names = self._strings(self.file_keys_ptr, self.file_headers)
+        lengths = self.ints[self.file_keys_ptr + self.file_headers - 1:
+                            self.file_keys_ptr + 2 * self.file_headers - 1]
+        ptr = self.file_keys_ptr + 3 * self.file_headers
+        for name, length in zip(names, lengths):
+            if name == 'NAVB':
+                self.kx = int(self.floats[ptr + 4])
+                self.ky = int(self.floats[ptr + 5])
+            ptr += int(length) + 1
+
+        # Parts (a grid file has a single GRID part)
+        self.part_header_lengths = [self._int(self.parts_ptr + self.parts + i)
+                                    for i in range(self.parts)]
+
+        # Column headers describe each grid (time, level, coordinate, parameter)
+        keys = self._strings(self.column_keys_ptr, self.column_keys)
+        self.grids = {}
+        size = self.column_keys + 1
+        for icol in range(self.columns):
+            ptr = self.column_headers_ptr + icol * size
+            if self._int(ptr) != USED_FLAG:
+                continue
+            header = dict(zip(keys, self.ints[ptr:ptr + self.column_keys]))
+            param = ''.join(self._strings(ptr + 1 + keys.index(k), 1)[0]
+                            for k in ('GPM1', 'GPM2', 'GPM3') if k in keys)
+            self.grids.setdefault(param.strip(), []).append((icol, header))
+
+    def _int(self, word):
+        """Integer value of a 1-based word"""
+
+        return int(self.ints[word - 1])
+
+    def _strings(self, word, count):
+        """Decode count 4-character strings starting at a 1-based word"""
+
+        start = (word - 1) * 4
+        return [self.raw[start + 4 * i:start + 4 * i + 4].tobytes().decode('ascii', 'replace').strip()
+                for i in range(count)]
+
+    def find(self, param, fhour, date=None, level=0, vcoord=0):
+        """Find the column holding a grid
+
+        :param param: GEMPAK parameter name (e.g. sigtp1)
+        :param fhour: Forecast hour
+        :param date: (Optional) Datetime object with the model run
+        :param level: First vertical level (GLEVEL)
+        :param vcoord: Vertical coordinate number (0 = NONE)
+        :return: Column index, or None if the grid is not in the file
+        """
+
+        ftime = 100000 + int(fhour) * 100  # forecast type F, HHHMM
+        for icol, header in self.grids.get(param.upper(), []):
+            if header.get('GTM1') != ftime or header.get('GLV1') != level:
+                continue
+            if header.get('GVCD', 0) != vcoord:
+                continue
+            if date is not None and dattim(header.get('GDT1')) != date:
+                continue
+            return icol
+        return None
+
+    def read(self, param, fhour, date=None, level=0, vcoord=0, mask=RMISSD):
+        """Read and unpack a single grid
+
+        :param param: GEMPAK parameter name (e.g. sigtp1)
+        :param fhour: Forecast hour
+        :param date: (Optional) Datetime object with the model run
+        :param level: First vertical level (GLEVEL)
+        :param vcoord: Vertical coordinate number (0 = NONE)
+        :param mask: Value to mask in the returned array (GEMPAK missing value)
+        :return: Masked array of shape (ky, kx) with row 1 (south) first, or
+            None if the grid is missing or uses an unsupported packing
+        :raises ValueError: If the grid runs past the end of the file (e.g. the
+            file is still being written)
+        """
+
+        icol = self.find(param, fhour, date, level, vcoord)
+        if icol is None:
+            print(f'WARNING: {param} f{str(fhour).zfill(3)} not found in {self.fname}')
+            return None
+
+        header_length = self.part_header_lengths[0]
+        data_ptr = self._int(self.data_block_ptr + icol * self.parts)
+        if data_ptr <= 0:
+            return None
+        length = self._int(data_ptr) if data_ptr <= self.ints.size else 0
+        if length <= 0 or data_ptr + length > self.ints.size:
+            raise ValueError(f'{param} f{str(fhour).zfill(3)} runs past the end of {self.fname}')
+        packing = self._int(data_ptr + header_length + 1)
+        start = data_ptr + header_length + 1  # 1-based word holding the packing type
+
+        if packing == MDGNON:
+            grid = self.floats[start:start + length - header_length - 1].astype(np.float64)
+        elif packing in (MDGGRB, MDGDEC):
+            nbits = self._int(start + 1)
+            missing = self._int(start + 2)
+            kxky = self._int(start + 3)
+            reference = float(self.floats[start + 3])
+            scale = float(self.floats[start + 4])
+            words = self.ints[start + 5:start + 5 + length - header_length - 6]
+            if nbits == 0:
+                grid = np.full(kxky, reference)
+            else:
+                idat = unpack_bits(words, nbits, kxky)
+                grid = reference + idat * scale
+                if missing:
+                    grid[idat == 2 ** nbits - 1] = RMISSD
+        else:
+            print(f'WARNING: GEMPAK packing type {packing} is not supported ({self.fname})')
+            return None
+
+        grid = grid.reshape(self.ky, self.kx)
+        if mask is not None:
+            grid = np.ma.masked_where(grid == mask, grid)
+        return grid
+
+
+def unpack_bits(words, nbits, count):
+    """Unpack fixed-width unsigned integers from a stream of 32-bit words
+
+    The stream starts at the most significant bit of the first word, as
+    written by the GEMPAK GRIB packing routines.
+
+    :param words: Array of 32-bit integers as stored in the file
+    :param nbits: Number of bits per value
+    :param count: Number of values to unpack
+    :return: Array of int64 values
+    """
+
+    stream = np.unpackbits(words.astype('>u4').view(np.uint8))[:count * nbits]
+    weights = np.left_shift(1, np.arange(nbits - 1, -1, -1, dtype=np.int64))
+    return stream.reshape(count, nbits).astype(np.int64) @ weights
+
+
+def dattim(value):
+    """Convert a GEMPAK date/time integer to a datetime object
+
+    :param value: GDT1 value (MMDDYYHHMM, or YYMMDD for old files)
+    :return: Datetime object, or None if not set
+    """
+
+    if not value:
+        return None
+    if value < 100000000:
+        return datetime.datetime.strptime(f'{value:06d}', '%y%m%d')
+    return datetime.datetime.strptime(f'{value:010d}', '%m%d%y%H%M')
+
+
+def gempak_dattim(date):
+    """Convert a datetime object to a GEMPAK GDT1 integer
+
+    :param date: Datetime object with the model run
+    :return: Integer in MMDDYYHHMM form
+    """
+
+    return int(date.strftime('%m%d%y%H%M'))
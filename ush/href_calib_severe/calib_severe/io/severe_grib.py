@@ -0,0 +1,61 @@
+import datetime
+import ncepgrib2 as ng
+import numpy as np
+
+# GRIB2 parameter numbers by hazard
+HAZARD_NUMBERS = {
+    'tor': 197,
+    'hail': 198,
+    'wind': 199
+}
+
+
+def save_grib(data, e_time, now, fhour, h_type, out_time, out_grib, run, date):
+    """Write calibrated severe probabilities to a GRIB2 file on the SREF 40 km grid
+
+    :param data: 2D array (or list of 2D arrays) of probabilities (%)
+    :param e_time: Datetime object with the end of the period
+    :param now: Datetime object with the reference time
+    :param fhour: Forecast hour at the start of the period
+    :param h_type: Hazard (tor, hail or wind)
+    :param out_time: Length of the period in hours ('4', '20' or '24')
+    :param out_grib: Location of the output file
+    :param run: Cycle used for calibration (e.g. '00')
+    :param date: Date of the cycle (YYYYMMDD)
+    """
+
+    if type(data) is not list:
+        data = [data]
+
+    day = datetime.datetime(int(date[:4]), int(date[4:6]), int(date[6:8]))
+    if out_time == '4':
+        s_time = e_time - datetime.timedelta(hours=4)
+    elif run == '15':
+        s_time = day + datetime.timedelta(hours=16)
+        e_time = day + datetime.timedelta(hours=12) + datetime.timedelta(days=1)
+    elif run == '21':
+        s_time = day + datetime.timedelta(hours=12) + datetime.timedelta(days=1)
+        e_time = s_time + datetime.timedelta(days=1)
+    else:
+        s_time = day + datetime.timedelta(hours=12)
+        e_time = s_time + datetime.timedelta(days=1)
+
+    idsect = np.array([7, 9, 1, 1, 1, now.year, now.month, now.day, now.hour, now.minute, now.second, 0, 1])
+    gdsinfo = np.array([0, len(data[0].flatten()), 0, 0, 30])
+    gdtmpl = np.array([6, 0, 0, 0, 0, 0, 0, 185, 129, 12190000, 226541000, 8, 25000000,
+                       265000000, 40635000, 40635000, 0, 64, 25000000, 25000000, 0, 0])
+    pdtmpl = np.array([19, HAZARD_NUMBERS[h_type], 5, 0, 0, 0, 0, 1, fhour, 1, 0, 0, 255, 0, 0, 0, 21, 1, 0,
+                       0, 0, 0, e_time.year, e_time.month, e_time.day, e_time.hour,
+                       0, 0, 1, 0, 1, 2, 1, int(out_time), 255, 0])
+    drtmpl = np.array([0, 0, 1, 10, 0, 0, 255])
+
+    encoder = ng.Grib2Encode(0, idsect)
+    encoder.addgrid(gdsinfo, gdtmpl)
+    for forecast in data:
+        encoder.addfield(9, pdtmpl, 40, drtmpl, forecast)
+    encoder.end()
+
+    # Save the file
+    with open(out_grib, 'wb') as f:
+        f.write(encoder.msg)
+    return
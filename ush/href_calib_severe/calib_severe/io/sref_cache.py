@@ -0,0 +1,148 @@
+import os
+import re
+import fcntl
+import zipfile
+import datetime
+from contextlib import contextmanager
+import numpy as np
+
+
+def cache_fname(cache_dir, sref_run):
+    """Get the filename of the environment cache for one SREF run
+
+    :param cache_dir: Location of the cache
+    :param sref_run: SREF run (YYYYMMDDHH)
+    :return: String with the full path of the cache file
+    """
+
+    return os.path.join(cache_dir, f'sref_env_{sref_run}.npz')
+
+
+def source_stamp(sref_file):
+    """Identify the version of an SREF file by its size and modification time
+
+    :param sref_file: SREF GEMPAK file
+    :return: List of [size, mtime_ns], or None if the file does not exist
+    """
+
+    try:
+        stat = os.stat(sref_file)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+@contextmanager
+def locked(fname):
+    """Hold an exclusive lock for filling a cache file
+
+    The lock is released when the block exits or the process dies, so a job
+    that fails part way through never leaves the other jobs blocked.
+
+    :param fname: Cache file to lock
+    """
+
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    with open(f'{fname}.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def save(fname, env, stamps):
+    """Write the SREF environment for a run as one compressed .npz
+
+    :param fname: Cache filename from cache_fname()
+    :param env: Dictionary of {forecast hour: {variable: masked array}}
+    :param stamps: Dictionary of {forecast hour: source_stamp()} of the SREF
+        files each hour was read from
+    """
+
+    arrays = {}
+    for fh in env:
+        arrays[f'stamp_{fh}'] = np.array(stamps[fh], dtype=np.int64)
+        for v in env[fh]:
+            arrays[f'{v}_{fh}'] = np.ma.getdata(env[fh][v])
+            arrays[f'{v}_{fh}_mask'] = np.ma.getmaskarray(env[fh][v])
+    tmp = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, fname)
+
+
+def load(fname, hours, variables, stamps):
+    """Read the SREF environment for a run from the cache
+
+    :param fname: Cache filename from cache_fname()
+    :param hours: List of forecast hours needed (e.g. ['015', '018'])
+    :param variables: List of variables needed for each hour
+    :param stamps: Dictionary of {forecast hour: source_stamp()} of the
+        current SREF files
+    :return: Dictionary of {forecast hour: {variable: masked array}}, or None
+        if the cache does not exist, is missing any hour/variable or any hour
+        was read from another version of its file
+    """
+
+    env = {}
+    try:
+        with np.load(fname) as x:
+            for fh in hours:
+                if stamps.get(fh) is None or x[f'stamp_{fh}'].tolist() != stamps[fh]:
+                    return None
+                env[fh] = {}
+                for v in variables:
+                    env[fh][v] = np.ma.masked_array(x[f'{v}_{fh}'], mask=x[f'{v}_{fh}_mask'])
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+    return env
+
+
+def load_hours(fname, variables, stamps):
+    """Read every complete and current forecast hour held by the cache
+
+    :param fname: Cache filename from cache_fname()
+    :param variables: List of variables needed for each hour
+    :param stamps: Dictionary of {forecast hour: source_stamp()} of the
+        current SREF files
+    :return: Dictionary of {forecast hour: {variable: masked array}} with the
+        hours that have every variable and were read from the current version
+        of their file (empty if the cache does not exist)
+    """
+
+    try:
+        with np.load(fname) as x:
+            hours = [key[len('stamp_'):] for key in x.files if key.startswith('stamp_')]
+            hours = [fh for fh in hours if all(f'{v}_{fh}' in x.files for v in variables)
+                     and stamps.get(fh) is not None and x[f'stamp_{fh}'].tolist() == stamps[fh]]
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return {}
+    return load(fname, hours, variables, stamps) or {}
+
+
+def prune(cache_dir, now, retention):
+    """Remove the caches (and locks) of SREF runs older than the retention window
+
+    :param cache_dir: Location of the cache
+    :param now: Datetime object with the current cycle
+    :param retention: Number of hours to keep a cache after its SREF run
+    :return: Number of files removed
+    """
+
+    removed = 0
+    oldest = now - datetime.timedelta(hours=retention)
+    try:
+        fnames = os.listdir(cache_dir)
+    except OSError:
+        return removed
+    for fname in fnames:
+        match = re.match(r'sref_env_(\d{10})\.npz(\.lock)?$', fname)
+        if match is None or datetime.datetime.strptime(match.group(1), '%Y%m%d%H') >= oldest:
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, fname))
+            removed += 1
+        except OSError:
+            continue  # already removed by another job
+    return removed
@@ -0,0 +1,151 @@
+import os
+import re
+import zipfile
+import datetime
+import numpy as np
+
+
+def mask_fname(cache_dir, name, run, fhour, thresh):
+    """Get the cache filename for a single member-hour UH exceedance mask
+
+    :param cache_dir: Location of the mask cache
+    :param name: Member name pair (e.g. ['arw', 'conus.subset'])
+    :param run: Model run of the member (YYYYMMDDHH)
+    :param fhour: Forecast hour of the member file
+    :param thresh: UH threshold used to build the mask
+    :return: String with the full path of the cached mask
+    """
+
+    model = '_'.join(name).replace('.', '_')
+    return os.path.join(cache_dir, f'uhmask_{model}_{run}f{str(fhour).zfill(2)}_uh{thresh}.npz')
+
+
+def grid_fname(cache_dir, name):
+    """Get the cache filename for the lats/lons of a member's native grid
+
+    :param cache_dir: Location of the mask cache
+    :param name: Member name pair (e.g. ['arw', 'conus.subset'])
+    :return: String with the full path of the cached grid
+    """
+
+    model = '_'.join(name).replace('.', '_')
+    return os.path.join(cache_dir, f'grid_{model}.npz')
+
+
+def source_stamp(source):
+    """Identify the version of an input file by its size and modification time
+
+    :param source: Path of the input grib2 file
+    :return: Array with [size, mtime_ns]
+    """
+
+    stat = os.stat(source)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def _save(fname, **arrays):
+    """Write arrays to an .npz file atomically so concurrent jobs never see partial files"""
+
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    tmp = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, fname)
+
+
+def save_mask(fname, bits, shape, source):
+    """Store a bit-packed exceedance mask
+
+    :param fname: Cache filename from mask_fname()
+    :param bits: Bit-packed mask from mask_util.pack_mask()
+    :param shape: Shape of the unpacked grid
+    :param source: Path of the input grib2 file the mask was built from
+    """
+
+    _save(fname, bits=bits, shape=np.array(shape), source=source_stamp(source))
+
+
+def load_mask(fname, source):
+    """Load a cached exceedance mask if it was built from the current input file
+
+    :param fname: Cache filename from mask_fname()
+    :param source: Path of the input grib2 file the mask should match
+    :return: Bit-packed mask and grid shape, or None, None if not cached or
+        out of date
+    """
+
+    try:
+        with np.load(fname) as x:
+            if not np.array_equal(x['source'], source_stamp(source)):
+                return None, None
+            return x['bits'], tuple(x['shape'])
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None, None
+
+
+def save_grid(fname, lats, lons):
+    """Store the lats/lons of a member's native grid
+
+    :param fname: Cache filename from grid_fname()
+    :param lats: 2D array of latitudes
+    :param lons: 2D array of longitudes
+    """
+
+    _save(fname, lats=lats, lons=lons)
+
+
+def load_grid(fname):
+    """Load the cached lats/lons of a member's native grid
+
+    :param fname: Cache filename from grid_fname()
+    :return: lats and lons arrays, or None, None if not cached
+    """
+
+    try:
+        with np.load(fname) as x:
+            return x['lats'], x['lons']
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None, None
+
+
+def mask_run(fname):
+    """Parse the model run from a cached mask filename
+
+    :param fname: Cache filename from mask_fname()
+    :return: Datetime object with the model run, or None if not a mask file
+    """
+
+    match = re.search(r'_(\d{10})f\d+_uh[^_]+\.npz$', os.path.basename(fname))
+    if match is None:
+        return None
+    return datetime.datetime.strptime(match.group(1), '%Y%m%d%H')
+
+
+def prune(cache_dir, now, retention):
+    """Remove cached masks for model runs older than the retention window
+
+    Masks are kept for whole runs so that time-lagged members in the next
+    cycle can pick up the masks the previous cycle built as current members.
+
+    :param cache_dir: Location of the mask cache
+    :param now: Datetime object with the current cycle
+    :param retention: Number of hours to keep masks after their model run
+    :return: Number of files removed
+    """
+
+    removed = 0
+    oldest = now - datetime.timedelta(hours=retention)
+    try:
+        fnames = os.listdir(cache_dir)
+    except OSError:
+        return removed
+    for fname in fnames:
+        run = mask_run(fname)
+        if run is None or run >= oldest:
+            continue
+        try:
+            os.remove(os.path.join(cache_dir, fname))
+            removed += 1
+        except OSError:
+            continue  # already removed by another job
+    return removed
@@ -0,0 +1,90 @@
+import os
+import numpy as np
+from calib_severe.io.sref_cache import locked
+
+# Forecast hours (0 - 48) of the HREF run held by a store
+NHOURS = 49
+
+
+def store_fname(store_dir, href_run):
+    """Get the filename of the UH probability store for one HREF run
+
+    The store is a preallocated float32 (hour, ny, nx) array (.dat) with a
+    one byte per hour validity index next to it (.idx).
+
+    :param store_dir: Location of the store
+    :param href_run: HREF run (YYYYMMDDHH)
+    :return: String with the full path of the data file
+    """
+
+    return os.path.join(store_dir, f'uhProbs_{href_run}.dat')
+
+
+def index_fname(fname):
+    """Get the filename of the validity index of a store
+
+    :param fname: Store filename from store_fname()
+    :return: String with the full path of the index file
+    """
+
+    return fname[:-len('.dat')] + '.idx'
+
+
+def write(fname, fhour, grid, nhours=NHOURS):
+    """Write the UH probabilities of one hour into the store in place
+
+    The grid is flushed before the hour is marked valid, so readers never see
+    a partially written hour. Jobs of the cycle write under a lock.
+
+    :param fname: Store filename from store_fname()
+    :param fhour: Forecast hour of the HREF run at the end of the 4-hour window
+    :param grid: 2D array of probabilities (%) on the SREF grid
+    :param nhours: Number of forecast hours held by the store
+    """
+
+    shape = (nhours,) + grid.shape
+    index = index_fname(fname)
+    with locked(fname):
+        data = np.memmap(fname, dtype=np.float32, mode='r+' if os.path.exists(fname) else 'w+', shape=shape)
+        data[fhour] = grid
+        data.flush()
+        del data
+
+        valid = np.memmap(index, dtype=np.uint8, mode='r+' if os.path.exists(index) else 'w+', shape=(nhours,))
+        valid[fhour] = 1
+        valid.flush()
+        del valid
+    return
+
+
+def valid_hours(fname):
+    """Forecast hours that have been written to the store
+
+    :param fname: Store filename from store_fname()
+    :return: Array of forecast hours (empty if the store does not exist)
+    """
+
+    try:
+        return np.flatnonzero(np.fromfile(index_fname(fname), dtype=np.uint8))
+    except OSError:
+        return np.array([], dtype=int)
+
+
+def open_store(fname, shape, nhours=NHOURS):
+    """Map the store without reading it
+
+    The array is mapped copy-on-write so callers can modify hours in memory
+    without touching the file.
+
+    :param fname: Store filename from store_fname()
+    :param shape: Shape of the SREF grid (ny, nx)
+    :param nhours: Number of forecast hours held by the store
+    :return: Tuple of the (hour, ny, nx) memmap and the array of valid forecast
+        hours, or None, None if the store does not exist
+    """
+
+    try:
+        data = np.memmap(fname, dtype=np.float32, mode='c', shape=(nhours,) + tuple(shape))
+    except (OSError, ValueError):
+        return None, None
+    return data, valid_hours(fname)
@@ -0,0 +1,24 @@
+import numpy as np
+
+
+def pack_mask(mask):
+    """Bit-pack a 0/1 exceedance mask
+
+    :param mask: 2D array of 0/1 (or boolean) values
+    :return: 1D uint8 array holding 8 grid points per byte
+    """
+
+    return np.packbits(np.asarray(mask, dtype=bool), axis=None)
+
+
+def unpack_mask(bits, shape, dtype=np.uint8):
+    """Expand a bit-packed mask back to a grid
+
+    :param bits: 1D uint8 array from pack_mask()
+    :param shape: Shape of the original grid
+    :param dtype: Data type of the returned grid
+    :return: 2D array of 0/1 values
+    """
+
+    size = int(np.prod(shape))
+    return np.unpackbits(bits, count=size).reshape(shape).astype(dtype, copy=False)
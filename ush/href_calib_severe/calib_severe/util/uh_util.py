@@ -0,0 +1,248 @@
+import os
+import ncepgrib2 as ng
+import numpy as np
+from astropy.convolution import convolve, Gaussian2DKernel
+from scipy.interpolate import NearestNDInterpolator
+from scipy.ndimage.morphology import binary_dilation
+from calib_severe.io import uh_cache
+from calib_severe.util.mask_util import pack_mask
+from spc_common import tile_util
+from spc_common import region_util
+
+# Structure elements for computing neighborhood probabilities
+STRUCT = {
+    '12':np.array([[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0],
+       [0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0],
+       [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0],
+       [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0],
+       [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0],
+       [0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0],
+       [0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]]),
+    '13':np.array([[0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0],
+       [0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0],
+       [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0],
+       [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0],
+       [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0],
+       [0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0],
+       [0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0],
+       [0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0, 0],
+       [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]])
+}
+
+
+def find_uh(grbs):
+    """Find the 2-5 km updraft helicity field in a decoded HREF member file
+
+    :param grbs: ncepgrib2 messages from Grib2Decode()
+    :return: 2D array of UH values, or None if the field is missing
+    """
+
+    for grb in grbs:
+        pdt = grb.product_definition_template
+        if pdt[0] == 7 and pdt[1] == 199 and pdt[2] == 2 and pdt[11] == 5000:
+            return grb.data()
+    return None
+
+
+def dilate(uh_vals, thresh, struct):
+    """Threshold and dilate a UH field (or a tile of one)
+
+    :param uh_vals: 2D array of UH values
+    :param thresh: UH threshold (m2/s2)
+    :param struct: Structure element from STRUCT
+    :return: 2D boolean array
+    """
+
+    return binary_dilation(uh_vals >= thresh, structure=struct)
+
+
+def uh_exceedance(uh_vals, thresh, roi, tile=None):
+    """Dilated UH exceedance for one member and forecast hour
+
+    :param uh_vals: 2D array of UH values
+    :param thresh: UH threshold (m2/s2)
+    :param roi: Radius of influence in grid points (selects the structure element)
+    :param tile: (Optional) Tile size to dilate the field tile by tile (see
+        tile_util.get_tiles()), the result is the same
+    :return: 2D boolean array
+    """
+
+    struct = STRUCT[str(int(round(roi,0)))]
+    if tile is None:
+        return dilate(uh_vals, thresh, struct)
+    return tile_util.map_tiles(dilate, [uh_vals], tile, halo=max(struct.shape) // 2, args=(thresh, struct))
+
+
+def gaussian_halo(sigma):
+    """Reach of the Gaussian smoothing in grid points
+
+    Covers the astropy Gaussian2DKernel (8 sigma wide) and scipy's 4 sigma
+    truncation.
+
+    :param sigma: Kernel standard deviation in grid points
+    :return: Halo width for tile_util
+    """
+
+    return int(np.ceil(4 * sigma)) + 1
+
+
+def smooth(prob, roi):
+    """Gaussian smoothing of probabilities that keeps NaNs (or of a tile of them)
+
+    :param prob: 2D array of probabilities (%), NaN where undefined
+    :param roi: Kernel standard deviation in grid points
+    :return: 2D array of smoothed probabilities
+    """
+
+    return convolve(prob, Gaussian2DKernel(x_stddev=roi), preserve_nan=True)
+
+
+def uh_halo(roi):
+    """Reach of the dilation and smoothing together in grid points
+
+    :param roi: Radius of influence in grid points
+    :return: Halo width
+    """
+
+    return max(STRUCT[str(int(round(roi,0)))].shape) // 2 + gaussian_halo(roi)
+
+
+def uh_grid(href_file, thresh, dx, mask_file=None, grid_file=None, tile=None, bbox=None):
+    """Dilated UH exceedance mask for one member and forecast hour
+
+    Masks are bit-packed and cached so that overlapping 4-hour windows in
+    other jobs of the cycle skip the decode. The function has no global state
+    so it can run in a worker process.
+
+    :param href_file: Location of the member grib2 file
+    :param thresh: UH threshold (m2/s2)
+    :param dx: Grid spacing of the member (km)
+    :param mask_file: (Optional) Location of the cached mask
+    :param grid_file: (Optional) Location of the cached member lats/lons
+    :param tile: (Optional) Tile size for the dilation (see uh_exceedance())
+    :param bbox: (Optional) Region box from region_util.get_bbox(). The field
+        is cropped to the box plus the reach of the dilation and smoothing, so
+        the probabilities inside the box are unchanged.
+    :return: Tuple of (bits, shape, lats, lons, roi) where lats/lons are None
+        for a cached mask (and cropped with bbox), or None if UH is missing
+        from the file
+    """
+
+    roi = 40. / dx
+    if mask_file is not None:
+        bits, shape = uh_cache.load_mask(mask_file, href_file)
+        if bits is not None:
+            return bits, shape, None, None, roi
+
+    grbs = ng.Grib2Decode(href_file)
+    lats, lons = grbs[1].latlons()
+    uh_vals = find_uh(grbs)
+    if uh_vals is None:
+        return None
+
+    if grid_file is not None and not os.path.exists(grid_file):
+        uh_cache.save_grid(grid_file, lats, lons)
+    if bbox is not None:
+        window = region_util.get_window(region_util.in_bbox(lats, lons, bbox, region_util.MARGIN),
+                                        uh_halo(roi))
+        uh_vals, lats, lons = uh_vals[window], lats[window], lons[window]
+
+    exceed = uh_exceedance(uh_vals, thresh, roi, tile=tile)
+    bits = pack_mask(exceed)
+
+    if mask_file is not None:
+        uh_cache.save_mask(mask_file, bits, exceed.shape, href_file)
+    return bits, exceed.shape, lats, lons, roi
+
+
+def uh_grid_task(task):
+    """Pool.map() wrapper for uh_grid()"""
+
+    return uh_grid(*task)
+
+
+def neighborhood_probs(uh, lats, lons, roi, sref_lats, sref_lons, n_members=None, tile=None, pool=None,
+                       targets=None):
+    """Smoothed neighborhood probabilities remapped to the SREF 40 km grid
+
+    :param uh: List of 2D 0/1 arrays (one per member) of 4-hour max UH exceedance,
+        or a 2D count of exceeding members if n_members is given
+    :param lats: 2D array of member latitudes
+    :param lons: 2D array of member longitudes
+    :param roi: Radius of influence in grid points, used as the kernel sigma
+    :param sref_lats: 2D array of SREF grid latitudes
+    :param sref_lons: 2D array of SREF grid longitudes
+    :param n_members: (Optional) Number of members counted in uh
+    :param tile: (Optional) Tile size to smooth the field tile by tile (see
+        tile_util.get_tiles()), the result is the same
+    :param pool: (Optional) multiprocessing Pool to smooth the tiles in
+    :param targets: (Optional) 2D boolean array of the SREF points to compute,
+        the others are 0
+    :return: 2D array of probabilities (%) on the SREF grid
+    """
+
+    # compute grid point probability
+    if n_members is None:
+        prob = np.average(np.array(uh), axis=0) * 100
+    else:
+        prob = uh / n_members * 100
+
+    # Use astropy smoothing function to take into account NaNs.
+    prob[prob < 0.] = np.nan
+    if tile is None:
+        prob = smooth(prob, roi)
+    else:
+        prob = tile_util.map_tiles(smooth, [prob], tile, halo=gaussian_halo(roi), args=(roi,), pool=pool)
+
+    # Set NaNs to zero so the calibration can handle the array.
+    prob[np.isnan(prob)] = 0.
+
+    # convert to SREF 40 km grid
+    g3km = np.vstack((lons.flatten(), lats.flatten())).T
+    interpolator = NearestNDInterpolator(g3km, prob.flatten())
+    sref_x = sref_lons.flatten()
+    sref_y = sref_lats.flatten()
+    if targets is not None:
+        vals = np.zeros(sref_x.shape)
+        points = np.flatnonzero(targets)
+        if points.size:
+            vals[points] = np.array([interpolator(sref_x[j], sref_y[j]) for j in points]).ravel()
+        return vals.reshape(sref_lons.shape)
+    vals = []
+    for j in range(len(sref_x)):
+        vals.append(interpolator(sref_x[j], sref_y[j]))
+    return np.array(vals).reshape(sref_lons.shape)
@@ -51,6 +51,8 @@ if __name__ == '__main__':
             f'-f {forecast_hour}',
             f'-c',
             ]
+        if os.environ.get('COLDSTART') == 'YES':
+            grid_args.append('--coldstart')
         grid_run = subprocess.Popen(['python', '-u', f'{script_dir}forecast_href_cal_severe.py']
                                            + grid_args, stdout=log, stderr=log)
 
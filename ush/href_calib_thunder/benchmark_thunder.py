@@ -0,0 +1,128 @@
+# Program Name: HREF Calibrated Thunder benchmarks
+# Affiliation: NOAA/NWS/Storm Prediction Center
+# Abstract: Times the thunder kernels (map2grid, apply_calib, get_thunder_probs,
+#           HREF.get_xmax, py2grib) on synthetic inputs and records their peak
+#           memory. No operational data is needed.
+#
+# Usage:
+#   python benchmark_thunder.py [-s SCALE] [-r REPEATS] [-k KERNEL ...] [-o OUTPUT] [-c OLD_OUTPUT]
+#   --scale 1 runs on the full 3 km grid; the default is a quick quarter resolution run.
+#   Pass an earlier results file with -c to compare two commits.
+
+import os
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from calib_thunder.benchmark import synthetic
+from calib_thunder.benchmark import measure
+from calib_thunder.util import grid_util
+from calib_thunder.util import data_util
+from calib_thunder.calibration import calibrate
+
+KERNELS = ['compute_map', 'map2grid', 'get_xmax', 'get_thunder_probs', 'apply_calib', 'py2grib']
+
+
+def get_options():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', '--kernels', type=str, nargs='+', metavar='', default=KERNELS,
+                        choices=KERNELS, help='Kernels to run (default: all)')
+    parser.add_argument('-s', '--scale', type=float, metavar='', default=0.25,
+                        help='Resolution of the HREF grid as a fraction of 3 km (default: 0.25)')
+    parser.add_argument('-m', '--members', type=int, metavar='', default=10,
+                        help='Number of ensemble members (default: 10)')
+    parser.add_argument('-r', '--repeats', type=int, metavar='', default=3,
+                        help='Timed runs of each kernel (default: 3)')
+    parser.add_argument('-S', '--seed', type=int, metavar='', default=0,
+                        help='Random seed of the synthetic inputs (default: 0)')
+    parser.add_argument('-f', '--fix_dir', type=str, metavar='', default=None,
+                        help='Where to write the synthetic fix files (default: temporary directory)')
+    parser.add_argument('-o', '--output', type=str, metavar='', default='thunder_benchmark.json',
+                        help='Results file (default: thunder_benchmark.json)')
+    parser.add_argument('-c', '--compare', type=str, metavar='', default=None,
+                        help='Results file of an earlier run to compare with')
+    return parser.parse_args()
+
+
+def main():
+    args = get_options()
+    date = datetime(2026, 5, 1, 0)
+    hour = 18
+    period = 4
+    exper = 1
+
+    fix_dir = args.fix_dir if args.fix_dir is not None else tempfile.mkdtemp(prefix='thunder_bench_')
+    os.makedirs(fix_dir, exist_ok=True)
+
+    print(f'Building synthetic inputs (scale {args.scale}, {args.members} members)...')
+    ltg = synthetic.lightning(date + timedelta(hours=hour))
+    href = synthetic.ensemble(date, hour, period=period, members=args.members,
+                              scale=args.scale, seed=args.seed)
+    lats, lons = href[0].lats, href[0].lons
+    gridmap = synthetic.write_gridmap(fix_dir, lats, lons, ltg)
+    synthetic.write_calib_file(fix_dir, ltg.lats.shape, date.hour, hour, exper=exper, seed=args.seed)
+    refl = href[0].get_xmax(hour, period + 1, 'Reflectivity')
+    tprobs = data_util.get_thunder_probs(fix_dir, synthetic.copy_ensemble(href), ltg, hour,
+                                         exper=exper, period=period)
+
+    results = measure.metadata()
+    results.update({
+        'scale': args.scale,
+        'members': args.members,
+        'seed': args.seed,
+        'href_shape': list(lats.shape),
+        'ltg_shape': list(ltg.lats.shape),
+        'kernels': {}
+        })
+
+    for name in args.kernels:
+        print(f'Running {name}...')
+        if name == 'compute_map':
+            result = measure.measure(lambda: grid_util.compute_map(lats, lons, ltg.lats, ltg.lons),
+                                     repeats=args.repeats)
+        elif name == 'map2grid':
+            result = measure.measure(lambda: grid_util.map2grid(lats, lons, ltg.lats, ltg.lons, refl,
+                                                                latlon_map=gridmap),
+                                     repeats=args.repeats)
+        elif name == 'get_xmax':
+            result = measure.measure(lambda: href[0].get_xmax(hour, period + 1, 'Reflectivity'),
+                                     repeats=args.repeats)
+        elif name == 'get_thunder_probs':
+            result = measure.measure(lambda ens: data_util.get_thunder_probs(fix_dir, ens, ltg, hour,
+                                                                             exper=exper, period=period),
+                                     setup=lambda: (synthetic.copy_ensemble(href),),
+                                     repeats=args.repeats)
+        elif name == 'apply_calib':
+            result = measure.measure(lambda: calibrate.apply_calib(fix_dir, tprobs, date.hour, hour,
+                                                                   exper=exper),
+                                     repeats=args.repeats)
+        elif name == 'py2grib':
+            try:
+                from calib_thunder.io import py2grib
+            except ImportError:
+                print('WARNING: ncepgrib2 is not available, skipping py2grib')
+                results['kernels'][name] = {'skipped': 'ncepgrib2 is not available'}
+                continue
+            out = os.path.join(fix_dir, 'bench.grib2')
+            result = measure.measure(lambda: py2grib.py2grib([tprobs, tprobs], date, hour, ltg.date,
+                                                             period, out),
+                                     repeats=args.repeats)
+
+        results['kernels'][name] = result
+        print(f'  {name}: min {result["min"]:.4f} s, median {result["median"]:.4f} s, '
+              f'peak {result["peak_mb"]:.1f} MB')
+
+    measure.save(args.output, results)
+    print(f'Wrote {args.output}')
+    if args.compare is not None:
+        measure.compare(args.compare, results)
+
+    if args.fix_dir is None:
+        shutil.rmtree(fix_dir, ignore_errors=True)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import gc
+import os
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+
+
+def measure(func, setup=None, repeats=3):
+    """Time a kernel and measure its peak memory
+
+    Timed runs don't trace memory (tracing slows the Python loops down), so
+    peak memory comes from one extra run under tracemalloc.
+
+    :param func: Kernel to run
+    :param setup: (Optional) Function returning a tuple of arguments for func.
+        Called before every run and not timed.
+    :param repeats: Number of timed runs
+    :return: Dictionary of timings (s) and peak memory (MB)
+    """
+
+    times = []
+    for i in range(repeats + 1):
+        args = setup() if setup is not None else ()
+        gc.collect()
+        if i == repeats:
+            tracemalloc.start()
+            func(*args)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        else:
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+
+    return {
+        'repeats': repeats,
+        'times': times,
+        'min': min(times),
+        'median': float(np.median(times)),
+        'mean': float(np.mean(times)),
+        'peak_mb': peak / 2 ** 20
+        }
+
+
+def metadata():
+    """Describe the machine and source tree a benchmark ran on
+
+    :return: Dictionary for the results file
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'date': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'commit': commit or None,
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'numpy': np.__version__
+        }
+
+
+def save(fname, results):
+    """Write benchmark results as JSON
+
+    :param fname: Output filename
+    :param results: Dictionary of results
+    """
+
+    with open(fname, 'w') as f:
+        json.dump(results, f, indent=2)
+    return
+
+
+def compare(fname, results):
+    """Print each kernel's time and peak memory against a previous results file
+
+    :param fname: JSON file from an earlier run
+    :param results: Dictionary of results from this run
+    """
+
+    with open(fname) as f:
+        old = json.load(f)
+    print(f'Compared with {fname} (commit {old.get("commit")}):')
+    for name, new in results['kernels'].items():
+        prev = old.get('kernels', {}).get(name)
+        if prev is None or 'min' not in new or 'min' not in prev:
+            continue
+        print(f'  {name:>18}: {prev["min"]:9.4f} s -> {new["min"]:9.4f} s '
+              f'(x{prev["min"] / max(new["min"], 1e-9):.2f}), '
+              f'{prev["peak_mb"]:8.1f} MB -> {new["peak_mb"]:8.1f} MB')
+    return
@@ -0,0 +1,228 @@
+import os
+import pickle
+import numpy as np
+from datetime import timedelta
+from scipy.ndimage import gaussian_filter
+from calib_thunder.data.href import HREF
+from calib_thunder.data.lightning import Lightning
+from calib_thunder.util import grid_util
+
+"""
+Synthetic inputs for the thunder benchmarks
+
+Nothing here reads operational data. Grids are built from the Lambert
+conformal definitions of the 3 km HREF grid and NCEP grid 212 (the 40 km
+lightning grid in calib_thunder/io/grid.grib2), fields are random convective
+cells inside a smooth unstable region, and the fix files have the layout
+gen_thunder_grids.py expects.
+"""
+
+EARTH_RADIUS = 6371229.
+
+# nx, ny, lat1, lon1, lov, latin, dx (m)
+HREF_GRID = (1799, 1059, 21.138, 237.28, 262.5, 38.5, 3000.)
+LTG_GRID = (185, 129, 12.19, 226.541, 265., 25., 40635.)
+
+# Same order as gen_thunder_grids.get_members(), each followed by its time-lagged run
+MEMBERS = ['conusnssl', 'conusarw', 'conushrw', 'conusnest', 'hrrr_ncep']
+
+BINS = range(0, 100, 10)
+
+
+def lambert_grid(nx, ny, lat1, lon1, lov, latin, dx):
+    """Lats and lons of a tangent Lambert conformal grid on a sphere
+
+    :param nx: Number of points in x
+    :param ny: Number of points in y
+    :param lat1: Latitude of the first (lower left) point
+    :param lon1: Longitude of the first point (degrees east, 0 - 360)
+    :param lov: Orientation longitude (degrees east, 0 - 360)
+    :param latin: Tangent latitude
+    :param dx: Grid spacing (m)
+    :return: lat and lon arrays of shape (ny, nx), lons in 0 - 360
+    """
+
+    phi1 = np.radians(latin)
+    n = np.sin(phi1)
+    f = np.cos(phi1) * np.tan(np.pi / 4 + phi1 / 2) ** n / n
+    rho0 = EARTH_RADIUS * f / np.tan(np.pi / 4 + phi1 / 2) ** n
+
+    # Projected coordinates of the first point
+    rho = EARTH_RADIUS * f / np.tan(np.pi / 4 + np.radians(lat1) / 2) ** n
+    theta = n * np.radians(lon1 - lov)
+    x0 = rho * np.sin(theta)
+    y0 = rho0 - rho * np.cos(theta)
+
+    x, y = np.meshgrid(x0 + dx * np.arange(nx), y0 + dx * np.arange(ny))
+    rho = np.sign(n) * np.hypot(x, rho0 - y)
+    theta = np.arctan2(x, rho0 - y)
+    lats = np.degrees(2 * np.arctan((EARTH_RADIUS * f / rho) ** (1 / n)) - np.pi / 2)
+    lons = (lov + np.degrees(theta / n)) % 360
+    return lats, lons
+
+
+def href_grid(scale=1.):
+    """Lats and lons of the 3 km HREF grid
+
+    :param scale: Fraction of the full resolution in each direction (the grid
+        spacing is 3 km / scale, the domain is unchanged)
+    :return: lat and lon arrays
+    """
+
+    nx, ny, lat1, lon1, lov, latin, dx = HREF_GRID
+    nx = max(2, int(round(nx * scale)))
+    ny = max(2, int(round(ny * scale)))
+    dx = dx * (HREF_GRID[0] - 1) / (nx - 1)
+    return lambert_grid(nx, ny, lat1, lon1, lov, latin, dx)
+
+
+def lightning(date):
+    """Lightning object on the 40 km grid
+
+    :param date: Datetime object with the valid date
+    :return: Lightning object without data
+    """
+
+    lats, lons = lambert_grid(*LTG_GRID)
+    return Lightning(date, lats, lons)
+
+
+def reflectivity(shape, envelope, rng, scale=1.):
+    """One hour of composite reflectivity with convective-scale cells
+
+    :param shape: Shape of the 3 km grid
+    :param envelope: Array (0 - 1) of where convection is favored
+    :param rng: numpy RandomState
+    :param scale: Grid scale from href_grid()
+    :return: Array of reflectivity (dBZ)
+    """
+
+    # Cells are ~10-30 km across, stratiform rain fills in the envelope
+    cells = np.zeros(shape)
+    seeds = rng.random_sample(shape) < 4e-4 / scale ** 2 * envelope
+    cells[seeds] = rng.uniform(0.5, 1., seeds.sum())
+    cells = gaussian_filter(cells, max(1., 3. * scale))
+    cells = cells / max(cells.max(), 1e-6)
+    refl = 70 * np.sqrt(cells) + 25 * envelope + rng.normal(0, 3, shape)
+    return np.clip(refl, 0, 75)
+
+
+def href_member(model, date, hour, period, lats, lons, rng, old=False, scale=1.):
+    """HREF object with every hour a thunder forecast needs
+
+    :param model: Name of the member (e.g. conusnssl)
+    :param date: Datetime object with the date and hour of the run
+    :param hour: The valid forecast hour of the forecast (of the current run)
+    :param period: Forecast period (hours)
+    :param lats: 3 km lats from href_grid()
+    :param lons: 3 km lons from href_grid()
+    :param rng: numpy RandomState
+    :param old: Time-lagged member
+    :param scale: Grid scale from href_grid()
+    :return: HREF object
+    """
+
+    lag = 0
+    if old:
+        lag = 6 if model == 'hrrr_ncep' else 12
+    href = HREF(model, date - timedelta(hours=lag), lats, lons, old=bool(old))
+
+    # Broad unstable region that drifts a little each hour
+    noise = gaussian_filter(rng.normal(0, 1, lats.shape), max(2., 60. * scale))
+    noise = (noise - noise.mean()) / noise.std()
+    for fhour in range(hour + lag, hour + lag + period + 1):
+        envelope = np.clip(np.roll(noise, fhour - hour - lag, axis=1) - 0.3, 0, 2) / 2
+        refl = reflectivity(lats.shape, envelope, rng, scale=scale)
+
+        # Marshall-Palmer rain rate (mm/hr)
+        precip = (10 ** (refl / 10) / 200) ** (1 / 1.6)
+        precip[refl < 15] = 0
+        li = 8 - 14 * envelope - 0.05 * refl + rng.normal(0, 0.5, lats.shape)
+        href.add_hour_data(fhour, {'Reflectivity': refl, 'Precipitation': precip,
+                                   'Lifted Index': li})
+    return href
+
+
+def ensemble(date, hour, period=4, members=10, scale=1., seed=0):
+    """Synthetic HREF ensemble
+
+    :param date: Datetime object with the date and hour of the run
+    :param hour: The valid forecast hour of the forecast
+    :param period: Forecast period (hours)
+    :param members: Number of members (current and time-lagged runs alternate)
+    :param scale: Grid scale from href_grid()
+    :param seed: Random seed
+    :return: List of HREF objects
+    """
+
+    rng = np.random.RandomState(seed)
+    lats, lons = href_grid(scale)
+    href = []
+    for index in range(members):
+        model = MEMBERS[(index // 2) % len(MEMBERS)]
+        href.append(href_member(model, date, hour, period, lats, lons, rng,
+                                old=index % 2, scale=scale))
+    return href
+
+
+def copy_ensemble(href):
+    """Copy an ensemble so a kernel can modify the hourly data
+
+    get_thunder_probs() sums precipitation into the stored arrays, so every
+    timed repeat gets its own copy.
+
+    :param href: List of HREF objects
+    :return: List of HREF objects
+    """
+
+    copies = []
+    for member in href:
+        new = HREF(member.model, member.date, member.lats, member.lons, old=member.old)
+        for fhour, data in member.data.items():
+            new.add_hour_data(fhour, {param: arr.copy() for param, arr in data.items()})
+        copies.append(new)
+    return copies
+
+
+def write_gridmap(fix_dir, lats, lons, ltg):
+    """Compute the 3 km to 40 km grid map and save it as fix_dir/gridmap.pkl
+
+    :param fix_dir: Location of the fix directory
+    :param lats: 3 km lats from href_grid()
+    :param lons: 3 km lons from href_grid()
+    :param ltg: Lightning object from lightning()
+    :return: Map from grid_util.compute_map()
+    """
+
+    gridmap = grid_util.compute_map(lats, lons, ltg.lats, ltg.lons)
+    with open(os.path.join(fix_dir, 'gridmap.pkl'), 'wb') as f:
+        pickle.dump(gridmap, f)
+    return gridmap
+
+
+def write_calib_file(fix_dir, shape, run, hour, exper=1, seed=0):
+    """Save a calibration pickle read by calibrate.apply_calib()
+
+    Corrections (%) are a dict keyed by 40 km grid index, each holding a dict
+    keyed by forecast bin (0, 10, ..., 90).
+
+    :param fix_dir: Location of the fix directory
+    :param shape: Shape of the 40 km grid
+    :param run: Which model run (0 or 12)
+    :param hour: Valid hour of the forecast
+    :param exper: Which formula to use
+    :param seed: Random seed
+    :return: Filename of the pickle
+    """
+
+    rng = np.random.RandomState(seed)
+    corr = rng.normal(0, 5, shape + (len(BINS),))
+    corr_data = {index: {b: float(corr[index][i]) for i, b in enumerate(BINS)}
+                 for index in np.ndindex(shape)}
+
+    out_dir = os.path.join(fix_dir, 'calib_files', str(exper))
+    os.makedirs(out_dir, exist_ok=True)
+    fname = os.path.join(out_dir, f'{str(run).zfill(2)}_{hour}.pkl')
+    with open(fname, 'wb') as f:
+        pickle.dump(corr_data, f, protocol=2)
+    return fname
@@ -3,7 +3,7 @@ import pickle as pickle
 from scipy.ndimage.filters import gaussian_filter
 
 
-def apply_calib(fix_dir, tprobs, run, hour, exper=1, smooth=1, wd=''):
+def apply_calib(fix_dir, tprobs, run, hour, exper=1, smooth=1, wd='', mask=None):
     """Apply reliability calibration corrections to a single thunder forecast
 
     :param tprobs: 2D array containing the original thunder probs
@@ -12,6 +12,8 @@ def apply_calib(fix_dir, tprobs, run, hour, exper=1, smooth=1, wd=''):
     :param exper: Which formula to use (1 - 4)
     :param smooth: Sigma to use for Gaussian filter
     :param wd: Working directory - location of the hrefct.vX.Y.Z directory
+    :param mask: (Optional) 2D boolean array of the points to calibrate, the
+        others are only smoothed
     :return: 2D array with the updated probabilities
     """
 
@@ -25,7 +27,11 @@ def apply_calib(fix_dir, tprobs, run, hour, exper=1, smooth=1, wd=''):
     with open(in_dir, 'rb') as f:
         corr_data = pickle.load(f, encoding='latin1')
 
-    for index in np.ndindex(calib_probs.shape):
+    if mask is None:
+        indices = np.ndindex(calib_probs.shape)
+    else:
+        indices = zip(*np.nonzero(mask))
+    for index in indices:
         this_forecast = calib_probs * 100
         if this_forecast[index] < 5:
             bin = 0
@@ -21,18 +21,33 @@ class HREF:
         self.lats = lats
         self.lons = lons
         self.data = {}
+        self.sources = {}
         self.old = old
 
-    def add_hour_data(self, hour, data):
+    def add_hour_data(self, hour, data, source=None):
         """Add one hour of href forecast data to the grid
 
         :param hour: The forecast hour of the data (e.g. 1, 5, 13, 23, etc)
         :param data: The href data to add.  Should be a dict with structure
                         {var name: data}
+        :param source: (Optional) Identity of the file the data was read from
+            (see exceed_cache.source_stamp())
         """
 
         # Add data to self.data dictionary with the forecast hour as the key
         self.data[hour] = data
+        if source is not None:
+            self.sources[hour] = source
+        return
+
+    def remove_hour_data(self, hour):
+        """Remove one hour of href forecast data (e.g. when its file changed)
+
+        :param hour: The forecast hour of the data
+        """
+
+        self.data.pop(hour, None)
+        self.sources.pop(hour, None)
         return
 
     def get_hour_data(self, hour, param):
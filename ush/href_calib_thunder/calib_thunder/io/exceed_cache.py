@@ -0,0 +1,133 @@
+import os
+import json
+import zipfile
+import hashlib
+import numpy as np
+
+"""
+Cache of each member's 40 km exceedance for HREF Calibrated Thunder
+
+Entries are named by a hash of everything the exceedance depends on: the
+input files (path, size and modification time), the forecast hours,
+statistical model, thresholds, crop window and grid map. A replaced input
+file gives a new name, so stale entries are never read and are left to the
+eviction, which removes the least recently used entries past a size budget.
+"""
+
+# Bump when the exceedance computation changes so old entries are not used
+VERSION = 1
+
+# Default size (MB) the cache is pruned to
+BUDGET = 512
+
+
+def source_stamp(source):
+    """Identify the version of an input file by its size and modification time
+
+    :param source: Path of the input grib2 file
+    :return: List of [path, size, mtime_ns]
+    """
+
+    stat = os.stat(source)
+    return [source, stat.st_size, stat.st_mtime_ns]
+
+
+def entry_key(sources, **inputs):
+    """Hash of the inputs of one member's exceedance
+
+    :param sources: List of source_stamp() of the input files, in hour order
+    :param inputs: Other inputs (hours, model, thresholds, window, grid map)
+        as JSON-serializable values
+    :return: Hex string
+    """
+
+    text = json.dumps({'version': VERSION, 'sources': sources, **inputs}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def entry_fname(cache_dir, key):
+    """Get the cache filename of an entry
+
+    :param cache_dir: Location of the cache
+    :param key: Hash from entry_key()
+    :return: String with the full path of the entry
+    """
+
+    return os.path.join(cache_dir, f'exceed_{key}.npz')
+
+
+def save(fname, grids):
+    """Store the bit-packed exceedance grids of one member
+
+    Written atomically so concurrent jobs never see partial files.
+
+    :param fname: Cache filename from entry_fname()
+    :param grids: Dictionary of 2D boolean arrays keyed by parameter
+    """
+
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    arrays = {param: np.packbits(grid, axis=None) for param, grid in grids.items()}
+    shape = next(iter(grids.values())).shape
+    tmp = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, shape=np.array(shape), **arrays)
+    os.replace(tmp, fname)
+    return
+
+
+def load(fname, params):
+    """Load the exceedance grids of one member
+
+    The entry's modification time is updated, so eviction removes the least
+    recently used entries first.
+
+    :param fname: Cache filename from entry_fname()
+    :param params: Parameters needed
+    :return: Dictionary of 2D boolean arrays keyed by parameter, or None if
+        the entry is not cached
+    """
+
+    try:
+        with np.load(fname) as x:
+            shape = tuple(x['shape'])
+            grids = {param: np.unpackbits(x[param], count=int(np.prod(shape))).reshape(shape).astype(bool)
+                     for param in params}
+        os.utime(fname)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+    return grids
+
+
+def prune(cache_dir, budget):
+    """Remove the least recently used entries until the cache fits its budget
+
+    :param cache_dir: Location of the cache
+    :param budget: Largest total size of the entries in bytes
+    :return: Number of files removed
+    """
+
+    entries = []
+    try:
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.startswith('exceed_') and entry.name.endswith('.npz'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    except OSError:
+        return 0
+
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= budget:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass  # already removed by another job
+        total -= size
+    return removed
@@ -3,6 +3,10 @@ import datetime
 import os
 import ncepgrib2
 from calib_thunder.data.href import HREF
+from calib_thunder.io import exceed_cache
+
+# Fields decoded from every file (there is no 1 hr QPF at hour 0)
+FIELDS = ['Reflectivity', 'Precipitation', 'Lifted Index']
 
 
 def get_fname(model, date, hour):
@@ -30,8 +34,25 @@ def get_fname(model, date, hour):
     return fname
 
 
+def get_dir(directory, model, run):
+    """Get the directory holding a model run's files
+
+    :param directory: Base directory of the model
+    :param model: Name of the model (e.g. conusnssl)
+    :param run: Datetime object containing the run date
+    :return: String with the directory (with a trailing slash)
+    """
+
+    run_date = run.strftime('%Y%m%d')
+    if model == 'hrrr_ncep':
+        return os.path.join(directory, f'hrrr.{run_date}', 'conus', '')
+    elif model == 'conusnest':
+        return os.path.join(directory, f'spc_post.{run_date}', 'spc_nam', '')
+    return os.path.join(directory, f'hiresw.{run_date}', '')
+
+
 def load_hour(directory, filename, model, run, hour, href=None, params=[], old=False,
-              verbose=True):
+              verbose=True, window=None):
     """Load a single hour of href forecast data
 
     :param directory: Directory where file is stored
@@ -39,6 +60,8 @@ def load_hour(directory, filename, model, run, hour, href=None, params=[], old=F
     :param model: Name of model to load (e.g. conusnssl, etc)
     :param href: (Optional) Existing href object to add to
     :param params: (Optional) List of variables to load
+    :param window: (Optional) Tuple of (row slice, column slice) to crop the
+        grid and fields to after decoding
     :return: HREF class with the added data
     """
 
@@ -49,17 +72,14 @@ def load_hour(directory, filename, model, run, hour, href=None, params=[], old=F
     #    hour = int(str(filename.split('.')[3][-2:]))
 
     # Load grib file using ncepgrib2
-    run_date = run.strftime('%Y%m%d')
-    if model == 'hrrr_ncep':
-        data_directory = os.path.join(directory, f'hrrr.{run_date}', 'conus', '')
-    elif model == 'conusnest':
-        data_directory = os.path.join(directory, f'spc_post.{run_date}', 'spc_nam', '')
-    else:
-        data_directory = os.path.join(directory, f'hiresw.{run_date}', '')
+    data_directory = get_dir(directory, model, run)
     # Load grib file
     try:
+        source = exceed_cache.source_stamp(data_directory + filename)
         gribs = ncepgrib2.Grib2Decode(data_directory + filename, gribmsg=False)
         lats, lons = gribs[1].grid()
+        if window is not None:
+            lats, lons = lats[window], lons[window]
     except OSError as e:
         if verbose:
             print(f'WARNING: Unable to load {data_directory}{filename}')
@@ -96,12 +116,24 @@ def load_hour(directory, filename, model, run, hour, href=None, params=[], old=F
         ):  # 4LFTX
             data["Lifted Index"] = np.ma.filled(gribs[i].data(), 0)
 
-    href.add_hour_data(hour, data)
+    # A file caught while it is still being written is left out until it is complete
+    missing = [param for param in FIELDS if param not in data and not (param == 'Precipitation' and hour == 0)]
+    if missing:
+        if verbose:
+            print(f'WARNING: {data_directory}{filename} is missing {", ".join(missing)}, '
+                  'reading it again on the next check')
+        href.remove_hour_data(hour)
+        return href
+
+    if window is not None:
+        data = {param: values[window] for param, values in data.items()}
+    href.add_hour_data(hour, data, source)
 
     return href
 
 
-def load_run(directory, model, run, hours=[], params=[], old=False, verbose=True):
+def load_run(directory, model, run, hours=[], params=[], old=False, verbose=True,
+             href=None, window=None):
     """Load a full model run for a given date and time
 
     :param directory: Location of the files
@@ -112,6 +144,10 @@ def load_run(directory, model, run, hours=[], params=[], old=False, verbose=True
     :param old: Flag to indicate whether the model is a previous run relative
         to the active period
     :param search: If false, will attempt to directly load all files without searching
+    :param href: (Optional) HREF object from a previous call to add to. Hours
+        it already holds are only loaded again if their file has changed.
+    :param window: (Optional) Tuple of (row slice, column slice) to crop the
+        grid and fields to (see load_hour())
     :return: HREF class with the added data
     """
 
@@ -122,12 +158,11 @@ def load_run(directory, model, run, hours=[], params=[], old=False, verbose=True
     # Load files
     files = [get_fname(model, run, hour) for hour in hours]
     # Load the data
-    href = None
     if len(files) == 0:
         if verbose:
             print('WARNING: No files found for the specified model and run: '
                   f'{run.strftime("%Y%m%d %H")}z')
-        return None
+        return href
 
     for filename in files:
         # Parse hour from filename
@@ -137,10 +172,16 @@ def load_run(directory, model, run, hours=[], params=[], old=False, verbose=True
             hour = int(str(filename.split('.')[3][-2:]))
         if (model == 'conusnssl' or model == 'conusarw' or model == 'hrrr_ncep') and hour >=49:
             continue
+        if href is not None and hour in href.data:
+            try:
+                if href.sources.get(hour) == exceed_cache.source_stamp(get_dir(directory, model, run) + filename):
+                    continue
+            except OSError:
+                continue
         if verbose:
             print(f'Loading {filename}')
         href = load_hour(directory, filename, model, run, hour, href, params,
-                         old, verbose)
+                         old, verbose, window)
 
     return href
 
@@ -5,6 +5,9 @@ from calib_thunder.data.lightning import Lightning
 # Relative filepath of the SREF file to get the grid from
 GRID_LOC = 'calib_thunder/io/grid.grib2'
 
+# Grids already read by this process, by location
+GRIDS = {}
+
 
 def get_grid(loc=GRID_LOC):
     """Get the NCEP 212 grid from a random SREF GRIB2 file
@@ -13,8 +16,10 @@ def get_grid(loc=GRID_LOC):
     :return: lat and lon arrays of the grid
     """
 
-    sref = ncepgrib2.Grib2Decode(loc, gribmsg=False)
-    lats, lons = sref[0].grid()
+    if loc not in GRIDS:
+        sref = ncepgrib2.Grib2Decode(loc, gribmsg=False)
+        GRIDS[loc] = sref[0].grid()
+    lats, lons = GRIDS[loc]
 
     return lats, lons
 
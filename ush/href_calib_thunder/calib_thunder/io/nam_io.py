@@ -0,0 +1,340 @@
+import os
+import struct
+import datetime
+import ncepgrib2
+import numpy as np
+
+"""
+Preprocessing of the NAM nest camfld files for HREF Calibrated Thunder
+
+Replaces the wgrib2 passes of exnam_process.sh. Each file is indexed once by
+reading only the section headers, the fields thunder needs are copied as-is,
+and 3-hour bucket APCP is turned into 1-hour precip in NumPy (the same
+subtraction as wgrib2 -ncep_norm).
+
+Source: www.nco.ncep.noaa.gov/pmb/docs/grib2/grib2_doc/grib2_sect4.shtml
+    www.nco.ncep.noaa.gov/pmb/docs/grib2/grib2_doc/grib2_table4-5.shtml
+"""
+
+# Fields kept in the spc_nam files, in output order:
+# (wgrib2 name, wgrib2 level, parameter category, parameter number, surface type, surface value)
+FIELDS = [
+    ('4LFTX', '180-0 mb above ground', 7, 193, 108, 18000.),
+    ('REFD', '263 K level', 16, 195, 20, 263.),
+    ('REFD', '4000 m above ground', 16, 195, 103, 4000.),
+    ('APCP', 'surface', 1, 8, 1, 0.)
+]
+
+# Statistical processes (code table 4.10) as named in wgrib2 inventories
+STAT_NAMES = {0: 'ave', 1: 'acc', 2: 'max', 3: 'min'}
+
+
+def get_fname(run, hour):
+    """Get the NAM nest camfld filename for a forecast hour
+
+    :param run: Datetime object with the date and hour of the run
+    :param hour: The forecast hour
+    :return: String with the filename (same in COMINnam and spc_nam)
+    """
+
+    return f'nam.t{run.strftime("%H")}z.conusnest.camfld{str(hour).zfill(2)}.tm00.grib2'
+
+
+def chunk_hours(fhour):
+    """Forecast hours processed by one NAM job
+
+    :param fhour: Last forecast hour of the chunk (a multiple of 3)
+    :return: List of forecast hours (0 - 3 for the first chunk, otherwise fhour-2 - fhour)
+    """
+
+    fhour = int(fhour)
+    start = 0 if fhour == 3 else fhour - 2
+    return list(range(start, fhour + 1))
+
+
+def scan(fname):
+    """Index a GRIB2 file by reading only the section headers
+
+    :param fname: Location of the grib2 file
+    :return: List of dictionaries (one per message) with the byte offset and
+        length of the message and the section 4 fields used to select it
+    """
+
+    inventory = []
+    with open(fname, 'rb') as f:
+        offset = 0
+        while True:
+            f.seek(offset)
+            sec0 = f.read(16)
+            if len(sec0) < 16 or sec0[:4] != b'GRIB':
+                break
+            discipline = sec0[6]
+            length = struct.unpack('>Q', sec0[8:16])[0]
+            msg = {'offset': offset, 'length': length, 'discipline': discipline}
+
+            # Walk sections 1-7 up to the first product definition section
+            pos = offset + 16
+            while pos < offset + length - 4:
+                f.seek(pos)
+                sec_len, sec_num = struct.unpack('>IB', f.read(5))
+                if sec_num == 4:
+                    msg.update(parse_pds(f.read(sec_len - 5)))
+                    break
+                pos += sec_len
+            inventory.append(msg)
+            offset += length
+    return inventory
+
+
+def parse_pds(body):
+    """Decode the parts of a product definition section needed for selection
+
+    :param body: Section 4 bytes after the section length and number
+    :return: Dictionary with the template number, parameter, first surface,
+        forecast time and (templates 4.8 / 4.9) statistical process and length
+    """
+
+    pdtn = struct.unpack('>H', body[2:4])[0]
+
+    # Scale factors are sign and magnitude; all ones is missing (e.g. the surface)
+    surf_scale = body[18]
+    surf_value = struct.unpack('>I', body[19:23])[0]
+    if surf_scale == 255 or surf_value == 0xFFFFFFFF:
+        surf_scale, surf_value = 0, 0
+    elif surf_scale & 0x80:
+        surf_scale = -(surf_scale & 0x7F)
+    pds = {
+        'pdtn': pdtn,
+        'category': body[4],
+        'number': body[5],
+        'fcst_time': struct.unpack('>I', body[13:17])[0],
+        'surface': body[17],
+        'level': surf_value / 10. ** surf_scale,
+        'stat': None,
+        'range': 0
+        }
+    if pdtn == 8:
+        pds['stat'] = body[41]
+        pds['range'] = struct.unpack('>I', body[44:48])[0]
+    return pds
+
+
+def select(inventory):
+    """Pick the messages of each field in FIELDS
+
+    :param inventory: List from scan()
+    :return: List of (field index, message) in FIELDS order, keeping the file
+        order within a field
+    """
+
+    selected = []
+    for i, (_, _, cat, num, surface, level) in enumerate(FIELDS):
+        for msg in inventory:
+            if (msg.get('discipline') == 0 and msg.get('category') == cat
+                    and msg.get('number') == num and msg.get('surface') == surface
+                    and msg.get('level') == level):
+                selected.append((i, msg))
+    return selected
+
+
+def read_message(fname, msg):
+    """Read the raw bytes of one message
+
+    :param fname: Location of the grib2 file
+    :param msg: Message from scan()
+    :return: Bytes of the whole message
+    """
+
+    with open(fname, 'rb') as f:
+        f.seek(msg['offset'])
+        return f.read(msg['length'])
+
+
+def decode(raw):
+    """Decode a single raw GRIB2 message
+
+    :param raw: Bytes from read_message()
+    :return: ncepgrib2 Grib2Message
+    """
+
+    grb = ncepgrib2.Grib2Decode(raw, gribmsg=True)
+    return grb[0] if type(grb) is list else grb
+
+
+def hourly_precip(grb, prev):
+    """1-hour precip from bucket accumulated APCP
+
+    :param grb: Grib2Message with APCP accumulated over pdt[26] hours
+    :param prev: Grib2Message with APCP of the previous hour in the same
+        bucket, or None when the accumulation is already 1 hour
+    :return: 2D array of 1-hour precip (kg/m2)
+    """
+
+    data = np.ma.filled(grb.data(), 0).astype(np.float64)
+    if prev is not None:
+        data = data - np.ma.filled(prev.data(), 0)
+    return data
+
+
+def encode_precip(grb, data):
+    """Encode 1-hour precip with the templates of the bucket APCP message
+
+    :param grb: Grib2Message with the bucket APCP
+    :param data: 2D array from hourly_precip()
+    :return: Bytes of the new message
+    """
+
+    pdtmpl = np.array(grb.product_definition_template)
+    length = pdtmpl[26]
+    pdtmpl[8] = pdtmpl[8] + length - 1
+    pdtmpl[26] = 1
+
+    encoder = ncepgrib2.Grib2Encode(grb.discipline_code, np.array(grb.identification_section))
+    encoder.addgrid(np.array(grb.grid_definition_info), np.array(grb.grid_definition_template))
+    encoder.addfield(grb.product_definition_template_number, pdtmpl,
+                     grb.data_representation_template_number,
+                     np.array(grb.data_representation_template), data)
+    encoder.end()
+    return encoder.msg
+
+
+def inventory_line(n, offset, run, field, msg):
+    """One line of a wgrib2-style inventory
+
+    :param n: Message number (1-based)
+    :param offset: Byte offset of the message in the output file
+    :param run: Datetime object with the date and hour of the run
+    :param field: Entry of FIELDS
+    :param msg: Message from scan() (after any de-accumulation)
+    :return: String such as 1:0:d=2026050100:REFD:263 K level:6 hour fcst:
+    """
+
+    ft = msg['fcst_time']
+    if msg['stat'] is not None:
+        span = f'{ft}-{ft + msg["range"]} hour {STAT_NAMES.get(msg["stat"], "")} fcst'
+    else:
+        span = 'anl' if ft == 0 else f'{ft} hour fcst'
+    return f'{n}:{offset}:d={run.strftime("%Y%m%d%H")}:{field[0]}:{field[1]}:{span}:'
+
+
+def is_processed(out_dir, run, hour):
+    """Check whether an hour already has an spc_nam file and inventory
+
+    :param out_dir: Location of the spc_nam files
+    :param run: Datetime object (including hour) or formatted string (YYYYMMDDHH)
+    :param hour: The forecast hour
+    :return: True if the .idx exists
+    """
+
+    if type(run) == str:
+        run = datetime.datetime.strptime(run, '%Y%m%d%H')
+    return os.path.exists(os.path.join(out_dir, get_fname(run, hour)) + '.idx')
+
+
+def process_hour(in_dir, out_dir, run, hour, verbose=True):
+    """Write the spc_nam file and inventory for one forecast hour
+
+    The grib2 file is written first and the .idx last, since the thunder
+    manager treats the .idx as the signal that the hour is ready. Nothing is
+    written unless every field in FIELDS was found and encoded (there is no
+    1-hour precip at the initial time), so an incomplete hour is retried.
+
+    :param in_dir: Location of the operational NAM nest files
+    :param out_dir: Location of the spc_nam files
+    :param run: Datetime object with the date and hour of the run
+    :param hour: The forecast hour
+    :param verbose: Print each file processed
+    :return: True if the file was written
+    """
+
+    def incomplete(reason):
+        print(f'WARNING: {reason}, not writing {fname}')
+        return False
+
+    fname = get_fname(run, hour)
+    in_file = os.path.join(in_dir, fname)
+    try:
+        selected = select(scan(in_file))
+    except OSError:
+        print(f'WARNING: Unable to read {in_file}')
+        return False
+    if verbose:
+        print(f'Processing {in_file} ({len(selected)} messages)')
+
+    msgs = []
+    done = set()
+    for i, msg in selected:
+        raw = read_message(in_file, msg)
+        if len(raw) != msg['length']:
+            return incomplete(f'{in_file} is truncated')
+        if FIELDS[i][0] != 'APCP':
+            msgs.append((i, msg, raw))
+            done.add(i)
+            continue
+
+        # No 1-hour precip at the initial time
+        if msg['range'] == 0:
+            if hour == 0:
+                done.add(i)
+            continue
+        grb = decode(raw)
+        prev = None
+        if msg['range'] > 1:
+            prev_file = os.path.join(in_dir, get_fname(run, hour - 1))
+            try:
+                prev_msgs = [m for j, m in select(scan(prev_file)) if FIELDS[j][0] == 'APCP'
+                             and m['range'] == msg['range'] - 1]
+            except OSError:
+                prev_msgs = []
+            if not prev_msgs:
+                return incomplete(f'{msg["range"] - 1} hour APCP not found in {prev_file}')
+            prev_raw = read_message(prev_file, prev_msgs[0])
+            if len(prev_raw) != prev_msgs[0]['length']:
+                return incomplete(f'{prev_file} is truncated')
+            prev = decode(prev_raw)
+        raw = encode_precip(grb, hourly_precip(grb, prev))
+        msgs.append((i, dict(msg, fcst_time=msg['fcst_time'] + msg['range'] - 1, range=1), raw))
+        done.add(i)
+
+    missing = [f'{FIELDS[i][0]}:{FIELDS[i][1]}' for i in range(len(FIELDS))
+               if i not in done and not (FIELDS[i][0] == 'APCP' and hour == 0)]
+    if missing:
+        return incomplete(f'{", ".join(missing)} not found in {in_file}')
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, fname)
+    lines = []
+    offset = 0
+    with open(f'{out_file}.{os.getpid()}.tmp', 'wb') as f:
+        for n, (i, msg, raw) in enumerate(msgs, 1):
+            f.write(raw)
+            lines.append(inventory_line(n, offset, run, FIELDS[i], msg))
+            offset += len(raw)
+    os.replace(f'{out_file}.{os.getpid()}.tmp', out_file)
+    with open(f'{out_file}.idx.{os.getpid()}.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(f'{out_file}.idx.{os.getpid()}.tmp', f'{out_file}.idx')
+    return True
+
+
+def process_chunk(in_dir, out_dir, run, fhour, coldstart=False):
+    """Preprocess every forecast hour of one NAM job
+
+    :param in_dir: Location of the operational NAM nest files
+    :param out_dir: Location of the spc_nam files
+    :param run: Datetime object (including hour) or formatted string (YYYYMMDDHH)
+    :param fhour: Last forecast hour of the chunk (a multiple of 3)
+    :param coldstart: Reprocess hours that already have an spc_nam file
+    :return: List of forecast hours that were written
+    """
+
+    if type(run) == str:
+        run = datetime.datetime.strptime(run, '%Y%m%d%H')
+
+    written = []
+    for hour in chunk_hours(fhour):
+        if is_processed(out_dir, run, hour) and not coldstart:
+            continue
+        if process_hour(in_dir, out_dir, run, hour):
+            written.append(hour)
+    return written
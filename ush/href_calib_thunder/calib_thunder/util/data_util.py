@@ -1,166 +1,376 @@
 import pickle
 import numpy as np
 import traceback
+from multiprocessing import Pool
+from scipy.ndimage import binary_dilation
 from calib_thunder.util import grid_util
+from spc_common import region_util
+from calib_thunder.io import exceed_cache
 
 
-def get_thunder_probs(fix_dir, ensemble, ltg, hour, exper=1, period=4, wd=''):
-    """Calculates the ensemble probability of thunder at each grid point
+# Predictors, thresholds and weights of each statistical model
+# Exper 1 = 4-hour probs
+# Exper 2 = Full-period probs
+# Exper 3 = 1-hour probs
+EXPERS = {
+    1: {
+        'params': ['Reflectivity', 'Precipitation', 'Lifted Index'],
+        'thresh': {'Reflectivity': 40, 'Precipitation': 2, 'Lifted Index': -1},
+        'weights': [0.6, 0.3, 0.1]
+        },
+    2: {
+        'params': ['Reflectivity', 'Precipitation'],
+        'thresh': {'Reflectivity': 40, 'Precipitation': 2},
+        'weights': [0.6, 0.4]
+        },
+    3: {
+        'params': ['Reflectivity', 'Precipitation', 'Lifted Index'],
+        'thresh': {'Reflectivity': 40, 'Precipitation': 1, 'Lifted Index': -3},
+        'weights': [0.6, 0.3, 0.1]
+        }
+    }
 
-    :param ensemble: List of href objects
-    :param ltg: A lightning object to use for grid conversion
-    :param hour: The valid forecast hour
-    :param exper: The version of the statistical model to use
-    :param period: The number of hours to use for the calculation (how long
-        the forecast period is)
-    :param wd: Working directory - where the hrefct.vX.Y.Z directory is located
-    :return: A 2D array with probability of thunder values
-    """
+# Grid maps already loaded by this process, by fix directory
+GRIDMAPS = {}
 
-    lat1 = ensemble[0].lats
-    lon1 = ensemble[0].lons
-    lat2 = ltg.lats
-    lon2 = ltg.lons
-    masks = []
+# CellMaps of the grid maps used by this process, by id of the grid map and
+# crop window
+CELLMAPS = {}
 
-    # Load the grid map
+# 40 km cells around a region that can reach it through the calibration
+# smoothing (gaussian_filter reaches 4 sigma, sigma is at most 2)
+REGION_HALO = 8
+
+
+def load_gridmap(fix_dir):
+    """Load the 3 km to 40 km grid map
+
+    The map is read once per process and shared by every later forecast hour
+    (it is never modified).
+
+    :param fix_dir: Location of the fix directory
+    :return: Map from grid_util.compute_map(), or an empty list if it can't be
+        loaded (the map is then computed for each member)
+    """
+
+    if fix_dir in GRIDMAPS:
+        return GRIDMAPS[fix_dir]
     try:
         with open(fix_dir + '/gridmap.pkl', 'rb') as f:
-            gridmap = pickle.load(f)
+            GRIDMAPS[fix_dir] = pickle.load(f)
     except Exception as e:
         traceback.print_exc()
-    # Use the specified formula
-    # Exper 1 = 4-hour probs
-    # Exper 2 = Full-period probs
-    # Exper 3 = 1-hour probs
-    if exper == 1:
-        params = [
-            'Reflectivity',
-            'Precipitation',
-            'Lifted Index'
-            ]
-        data = {
-            'Reflectivity': [],
-            'Precipitation': [],
-            'Lifted Index': []
-            }
-        thresh = {
-            'Reflectivity': 40,
-            'Precipitation': 2,
-            'Lifted Index': -1
-            }
-    elif exper == 3:
-        params = [
-            'Reflectivity',
-            'Precipitation',
-            'Lifted Index'
-            ]
-        data = {
-            'Reflectivity': [],
-            'Precipitation': [],
-            'Lifted Index': []
-            }
-        thresh = {
-            'Reflectivity': 40,
-            'Precipitation': 1,
-            'Lifted Index': -3
-            }
-    elif exper == 2:
-        params = [
-            'Reflectivity',
-            'Precipitation'
-            ]
-        data = {
-            'Reflectivity': [],
-            'Precipitation': []
-            }
-        thresh = {
-            'Reflectivity': 40,
-            'Precipitation': 2
-            }
-
-    # Iterate through each href member and process the data
-    for href in ensemble:
-
-        # set mask variables
-        refl = None
-        li = None
+        return []
+    return GRIDMAPS[fix_dir]
 
-        for param in params:
 
-            if href.old and href.model == 'hrrr_ncep':
-                this_hour = hour + 6
-            elif href.old:
-                this_hour = hour + 12
-            else:
-                this_hour = hour
+def get_cellmap(gridmap, shape, window=None):
+    """Get the CellMap of a grid map, built once per process
+
+    :param gridmap: Grid map from load_gridmap()
+    :param shape: Shape of the 40 km grid
+    :param window: (Optional) Tuple of (row slice, column slice) of the 3 km
+        grid the fields are cropped to
+    :return: grid_util.CellMap, or None if there is no grid map
+    """
+
+    if len(gridmap) == 0:
+        return None
+    key = id(gridmap)
+    if window is not None:
+        key = (id(gridmap),) + tuple((s.start, s.stop) for s in window)
+    if key not in CELLMAPS:
+        # Keep the grid map with its CellMap so the id isn't reused
+        latlon_map = gridmap if window is None else gridmap[window]
+        CELLMAPS[key] = (gridmap, grid_util.CellMap(latlon_map, shape))
+    return CELLMAPS[key][1]
+
+
+def get_region(gridmap, ltg, bbox):
+    """40 km cells of a region and the part of the 3 km grid they need
+
+    The 3 km window holds every point that maps to a cell within REGION_HALO
+    cells of the region, so the calibrated probabilities inside the region
+    are the same as for the whole domain.
+
+    :param gridmap: Grid map from load_gridmap()
+    :param ltg: A lightning object with the 40 km grid
+    :param bbox: Box (west, south, east, north) from region_util.get_bbox()
+    :return: Tuple of (targets, window) with a 2D boolean array of the 40 km
+        cells in the region and a tuple of (row slice, column slice) of the
+        3 km grid, or None if there is no grid map to find it from
+    """
+
+    targets = region_util.in_bbox(ltg.lats, ltg.lons, bbox)
+    cellmap = get_cellmap(gridmap, ltg.lats.shape)
+    if cellmap is None:
+        print('WARNING: No grid map to crop the HREF fields with, loading the whole domain')
+        return targets, None
+    size = 2 * REGION_HALO + 1
+    reach = binary_dilation(targets, structure=np.ones((size, size), dtype=bool))
+    return targets, region_util.get_window(reach.ravel()[cellmap.cells].reshape(gridmap.shape))
+
+
+class ThunderAccumulator:
+    """Running ensemble exceedance sums for one thunder forecast
+
+    Members are added one at a time as their data arrives. Each member is
+    regridded and thresholded once, so only the weighting is left when the
+    last member is in. With a grid map, only the 3 km points past each
+    threshold are scattered to the 40 km grid. With a cache directory, each
+    member's masked exceedance is kept (see exceed_cache) and reused when the
+    same input files are seen again.
+    """
+
+    def __init__(self, gridmap, ltg, hour, exper=1, period=4, tile=None, pool=None, window=None,
+                 cache_dir=None):
+        """Constructor for ThunderAccumulator class
+
+        :param gridmap: Grid map from load_gridmap()
+        :param ltg: A lightning object to use for grid conversion
+        :param hour: The valid forecast hour
+        :param exper: The version of the statistical model to use
+        :param period: The number of hours to use for the calculation (how long
+            the forecast period is)
+        :param tile: (Optional) Tile size to threshold and regrid each field
+            tile by tile (see tile_util.get_tiles())
+        :param pool: (Optional) multiprocessing Pool to run the tiles in
+        :param window: (Optional) Tuple of (row slice, column slice) of the
+            3 km grid the members were cropped to (see get_region())
+        :param cache_dir: (Optional) Location of the exceedance cache
+        """
+
+        self.gridmap = gridmap
+        if window is not None and len(gridmap) != 0:
+            self.gridmap = gridmap[window]
+        self.tile = tile
+        self.pool = pool
+        self.cellmap = get_cellmap(gridmap, ltg.lats.shape, window)
+        self.window = window
+        self.cache_dir = cache_dir
+        self.lats = ltg.lats
+        self.lons = ltg.lons
+        self.hour = hour
+        self.exper = exper
+        self.period = period
+        self.params = EXPERS[exper]['params']
+        self.thresh = EXPERS[exper]['thresh']
+        self.weights = EXPERS[exper]['weights']
+        self.sums = {param: np.zeros(self.lats.shape, dtype=int) for param in self.params}
+        self.count = 0
+        self.members = []
+        self.used = []
+        self.added = {}
+
+    def start_hour(self, href):
+        """First forecast hour of a member used by the forecast
+
+        :param href: href object
+        :return: Forecast hour of the member's own run
+        """
+
+        if href.old and href.model == 'hrrr_ncep':
+            return self.hour + 6
+        elif href.old:
+            return self.hour + 12
+        return self.hour
+
+    def ready(self, href):
+        """Check whether a member has every hour the forecast needs
+
+        :param href: href object
+        :return: True if all hours have been loaded
+        """
+
+        this_hour = self.start_hour(href)
+        return all(hour in href.data for hour in range(this_hour, this_hour + self.period + 1))
+
+    def add(self, key, href):
+        """Add one member's exceedance to the running sums
+
+        Members that were already added are skipped, unless one of their files
+        was read again since (e.g. it was still being written when first read),
+        in which case the old exceedance is taken out and the member is added
+        again.
+
+        :param key: Unique name of the member (e.g. position in the ensemble)
+        :param href: href object
+        :return: True if the member was added
+        """
+
+        this_hour = self.start_hour(href)
+        stamps = [href.sources.get(hour) for hour in range(this_hour, this_hour + self.period + 1)]
+        if key in self.members:
+            if self.added[key][0] == stamps:
+                return False
+            print(f'WARNING: Files of member {key} changed after it was added, adding it again')
+            self.remove(key)
+        self.members.append(key)
+        self.added[key] = (stamps, None)
+
+        fname = self.cache_fname(href, this_hour)
+        contrib = None
+        if fname is not None:
+            contrib = exceed_cache.load(fname, self.params)
+        if contrib is None:
+            contrib = self.exceed(href, this_hour)
+            if contrib is None:
+                return True
+            if fname is not None:
+                try:
+                    exceed_cache.save(fname, contrib)
+                except OSError as err:
+                    print(f'WARNING: Could not cache exceedance {fname}: {err}')
+
+        for param in self.params:
+            self.sums[param] += contrib[param]
+        self.count += 1
+        self.used.append(key)
+        self.added[key] = (stamps, contrib)
+        return True
+
+    def remove(self, key):
+        """Take a member's exceedance back out of the running sums
+
+        :param key: Unique name of the member given to add()
+        """
+
+        _, contrib = self.added.pop(key)
+        self.members.remove(key)
+        if contrib is not None:
+            for param in self.params:
+                self.sums[param] -= contrib[param]
+            self.count -= 1
+            self.used.remove(key)
+        return
+
+    def cache_fname(self, href, this_hour):
+        """Cache filename of a member's exceedance
+
+        :param href: href object
+        :param this_hour: First forecast hour of the member used
+        :return: String with the full path of the entry, or None if the
+            member can not be cached
+        """
+
+        hours = range(this_hour, this_hour + self.period + 1)
+        if self.cache_dir is None or not all(hour in href.sources for hour in hours):
+            return None
+        window = None
+        if self.window is not None:
+            window = [[int(part.start), int(part.stop)] for part in self.window]
+        key = exceed_cache.entry_key([href.sources[hour] for hour in hours],
+                                     exper=self.exper, period=self.period,
+                                     thresh=self.thresh, window=window,
+                                     grid=list(self.lats.shape),
+                                     cellmap=None if self.cellmap is None else self.cellmap.digest)
+        return exceed_cache.entry_fname(self.cache_dir, key)
+
+    def exceed(self, href, this_hour):
+        """Regrid and threshold one member
+
+        :param href: href object
+        :param this_hour: First forecast hour of the member used
+        :return: Dictionary of masked 2D boolean exceedance arrays keyed by
+            parameter, or None if the member has no data
+        """
+
+        exceed = {}
+        refl = None
+        li = None
+        for param in self.params:
 
             # Get the data and convert to 40km grid
             if param == 'Precipitation':
-                if period == 4 or exper == 2:
-                    i = 1
-                    temp = []
-                    while i <= period:
-                        if i == 1:
-                            temp = href.get_hour_data(this_hour + i, param=param)
-                        else:
-                            temp += href.get_hour_data(this_hour + i, param=param)
-                        i += 1
-                elif period == 1:
-                    temp = (href.get_hour_data(this_hour + (period), param=param))
+                if self.period == 4 or self.exper == 2:
+                    temp = href.get_hour_data(this_hour + 1, param=param)
+                    for i in range(2, self.period + 1):
+                        temp = temp + href.get_hour_data(this_hour + i, param=param)
+                elif self.period == 1:
+                    temp = href.get_hour_data(this_hour + 1, param=param)
             elif param == 'Lifted Index':
-                temp = href.get_xmin(this_hour, period + 1, param)
+                temp = href.get_xmin(this_hour, self.period + 1, param)
             else:
-                temp = href.get_xmax(this_hour, period + 1, param)
+                temp = href.get_xmax(this_hour, self.period + 1, param)
 
-            broke = False
-            if np.isnan(temp).all():
-                broke = True
-                break
+            nans = np.isnan(temp)
+            if nans.all():
+                return None
 
-            temp = grid_util.map2grid(lat1, lon1, lat2, lon2, temp,
-                                      latlon_map=gridmap)
-
-            # Save variables for mask
-            if param == 'Lifted Index':
-                li = temp
-            elif param == 'Reflectivity':
-                refl = temp
+            # Compare data to specified thresholds on the 40km grid, keeping
+            # what the mask needs (stable LI, weak reflectivity)
+            if self.cellmap is not None and temp.size == self.cellmap.cells.size and not nans.any():
+                tiles = {'tile': self.tile, 'pool': self.pool}
+                if param == 'Lifted Index':
+                    exceed[param] = self.cellmap.exceed(temp, self.thresh[param], 'le', **tiles)
+                    li = self.cellmap.exceed(temp, 0, 'ge', **tiles)
+                else:
+                    exceed[param] = self.cellmap.exceed(temp, self.thresh[param], 'ge', **tiles)
+                if param == 'Reflectivity':
+                    refl = self.cellmap.exceed(temp, 35, 'lt', **tiles)
+                continue
 
-            # Compare data to specified thresholds
+            temp = grid_util.map2grid(href.lats, href.lons, self.lats, self.lons, temp,
+                                      latlon_map=self.gridmap)
             if param == 'Lifted Index':
-                data[param].append(np.where(temp <= thresh[param], 1, 0))
+                exceed[param] = temp <= self.thresh[param]
+                li = temp >= 0
             else:
-                data[param].append(np.where(temp >= thresh[param], 1, 0))
+                exceed[param] = temp >= self.thresh[param]
+            if param == 'Reflectivity':
+                refl = temp < 35
 
         # Create the mask
-        if not broke:
-            if exper == 1 or exper == 3:
-                if refl is None or li is None:
-                    masks.append(np.zeros(lat2.shape))
-                else:
-                    masks.append(np.where((li >= 0) & (refl < 35), 0, 1))
-            elif exper == 2:
-                if refl is None:
-                    masks.append(np.zeros(lat2.shape))
-                else:
-                    masks.append(np.where((refl < 35), 0, 1))
+        if self.exper == 1 or self.exper == 3:
+            mask = ~(li & refl)
+        else:
+            mask = ~refl
+
+        return {param: exceed[param] & mask for param in self.params}
 
-    # Apply mask and take the mean of each parameter
-    for param in params:
-        if len(data[param]) == 0:
-            data[param] = np.zeros(lat2.shape)
+    def probs(self):
+        """Probability of thunder from the members added so far
+
+        :return: A 2D array with probability of thunder values
+        """
+
+        # Take the mean of each parameter and apply weights
+        if self.count == 0:
+            data = [np.zeros(self.lats.shape) for param in self.params]
         else:
-            data[param] = np.array(data[param]) * np.array(masks)
-            data[param] = np.average(data[param], axis=0)
+            data = [self.sums[param] / self.count for param in self.params]
+        return np.average(data, axis=0, weights=self.weights)
 
-    # Apply weights and compute the probabilities
-    if exper in [1, 3]:
-        tprobs = np.average([data[key] for key in params],
-                            axis=0, weights=[0.6, 0.3, 0.1])
-    else:
-        tprobs = np.average([data[key] for key in params],
-                            axis=0, weights=[0.6, 0.4])
 
-    return tprobs
+def get_thunder_probs(fix_dir, ensemble, ltg, hour, exper=1, period=4, wd='', tile=None, nprocs=1,
+                      window=None, cache_dir=None):
+    """Calculates the ensemble probability of thunder at each grid point
 
+    :param ensemble: List of href objects
+    :param ltg: A lightning object to use for grid conversion
+    :param hour: The valid forecast hour
+    :param exper: The version of the statistical model to use
+    :param period: The number of hours to use for the calculation (how long
+        the forecast period is)
+    :param wd: Working directory - where the hrefct.vX.Y.Z directory is located
+    :param tile: (Optional) Tile size to threshold and regrid each field tile
+        by tile (see tile_util.get_tiles())
+    :param nprocs: Number of processes to run the tiles in
+    :param window: (Optional) Tuple of (row slice, column slice) of the 3 km
+        grid the members were cropped to (see get_region())
+    :param cache_dir: (Optional) Location of the exceedance cache
+    :return: A 2D array with probability of thunder values
+    """
+
+    pool = Pool(nprocs) if tile is not None and nprocs > 1 else None
+    try:
+        acc = ThunderAccumulator(load_gridmap(fix_dir), ltg, hour, exper=exper, period=period,
+                                 tile=tile, pool=pool, window=window,
+                                 cache_dir=cache_dir)
+        for index, href in enumerate(ensemble):
+            acc.add(index, href)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return acc.probs()
@@ -1,5 +1,11 @@
+import hashlib
 import numpy as np
 from scipy.spatial import cKDTree
+from spc_common import tile_util
+
+# Fraction of exceeding points above which CellMap.exceed() counts every point
+# instead of scattering the exceeding ones
+DENSE_FRACTION = 0.2
 
 
 def compute_map(lat1, lon1, lat2, lon2):
@@ -74,3 +80,78 @@ def map2grid(lat1, lon1, lat2, lon2, data, latlon_map=[], method='max'):
 
     return new_data
 
+
+
+def cell_hits(data, cells, thresh, strict, size):
+    """Cells of a new grid that any point past a threshold maps to
+
+    :param data: Array of data (or a tile of it)
+    :param cells: Array of the same shape with the flat index on the new grid
+        of each point (CellMap.cells)
+    :param thresh: Threshold
+    :param strict: Compare with > instead of >=
+    :param size: Number of points in the new grid
+    :return: 1D boolean array of the new grid
+    """
+
+    flat = np.asarray(data).ravel()
+    hits = flat > thresh if strict else flat >= thresh
+    n_hits = np.count_nonzero(hits)
+    if n_hits > DENSE_FRACTION * flat.size:
+        return np.bincount(cells.ravel(), weights=hits, minlength=size) > 0
+    any_hit = np.zeros(size, dtype=bool)
+    any_hit[cells.ravel()[np.flatnonzero(hits)]] = True
+    return any_hit
+
+
+class CellMap:
+    """Flat form of a map from compute_map() for regridding exceedance
+
+    Thresholding the 'max' output of map2grid() only needs to know whether
+    any point of a cell passes the threshold, so only the points that do are
+    scattered to the new grid. On quiet hours that is a small fraction of the
+    3 km grid.
+    """
+
+    def __init__(self, latlon_map, shape):
+        """Constructor for CellMap class
+
+        :param latlon_map: Map produced by compute_map()
+        :param shape: Shape of the grid mapped to
+        """
+
+        self.shape = shape
+        self.size = int(np.prod(shape))
+        index = np.array(latlon_map.ravel().tolist()).T
+        self.cells = np.ravel_multi_index(tuple(index), shape).astype(np.int32)
+        self.covered = np.bincount(self.cells, minlength=self.size) > 0
+        self.digest = hashlib.sha1(self.cells.tobytes() + np.array(shape).tobytes()).hexdigest()
+
+    def exceed(self, data, thresh, op='ge', tile=None, pool=None):
+        """Compare the 'max' regridded data with a threshold
+
+        Same as op(map2grid(..., data, method='max'), thresh) for data without
+        NaNs, including cells no point maps to (which map2grid() sets to 0).
+
+        :param data: Array with the data to map (same shape as the mapped grid)
+        :param thresh: Threshold
+        :param op: 'ge', 'gt', 'le' or 'lt'
+        :param tile: (Optional) Tile size to scatter the data tile by tile (see
+            tile_util.get_tiles()), the result is the same
+        :param pool: (Optional) multiprocessing Pool to scatter the tiles in
+        :return: Boolean array with the shape of the new grid
+        """
+
+        # max >= t / max < t depend on any point >= t, max > t / max <= t on any point > t
+        strict = op in ('gt', 'le')
+        if tile is None:
+            any_hit = cell_hits(data, self.cells, thresh, strict, self.size)
+        else:
+            data = np.asarray(data)
+            any_hit = tile_util.reduce_tiles(cell_hits, [data, self.cells.reshape(data.shape)], tile,
+                                             np.logical_or, args=(thresh, strict, self.size), pool=pool)
+        if op in ('le', 'lt'):
+            any_hit = ~any_hit
+
+        empty = {'ge': 0 >= thresh, 'gt': 0 > thresh, 'le': 0 <= thresh, 'lt': 0 < thresh}[op]
+        return np.where(self.covered, any_hit, empty).reshape(self.shape)
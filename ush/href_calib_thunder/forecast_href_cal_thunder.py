@@ -48,6 +48,15 @@ params = [
     ]
 mp = False
 cpu = 6
+# Optional latency deadline (minutes) for the 1hr/4hr forecasts, after which
+# they are made from the members that have arrived (at least THUNDER_MIN_MEMBERS)
+deadline = os.environ.get('THUNDER_DEADLINE', '')
+min_members = os.environ.get('THUNDER_MIN_MEMBERS', '6')
+reissue = os.environ.get('THUNDER_REISSUE', 'NO') == 'YES'
+# Each member's 40 km exceedance is cached between jobs (pruned to THUNDER_CACHE_MB)
+cache_dir = os.path.join(os.environ.get('COMOUTspc_thundercache',
+                         os.path.join(os.environ['COMOUTspc_post'], 'spc_pickle', 'thunder_exceed')), '')
+cache_mb = os.environ.get('THUNDER_CACHE_MB', '')
 
 os.chdir(wd)
 
@@ -85,7 +94,15 @@ with open(os.path.join(log_dir, f'calibrated_thunder.stderrout'), 'w') as log:
         f'-c {cpu}',
         f'-m {mp}',
         f'-j {job}',
+        f'-M {min_members}',
+        f'-C {cache_dir}',
         ]
+    if deadline:
+        grid_args.append(f'-D {deadline}')
+    if reissue:
+        grid_args.append('-R')
+    if cache_mb:
+        grid_args.append(f'-B {cache_mb}')
     grid_run = subprocess.Popen(['python', '-u', 'gen_thunder_grids.py']
                                        + grid_args, stdout=log, stderr=log)
 
@@ -11,9 +11,15 @@ import os
 from calib_thunder.io import lightning_io
 from calib_thunder.io import href_io
 from calib_thunder.io import py2grib
+from spc_common import product_cube
+from calib_thunder.io import exceed_cache
 from calib_thunder.util import data_util
+from spc_common import region_util
 from calib_thunder.calibration import calibrate
 
+# Products of the cycle's product cube, in cube order
+CUBE_PRODUCTS = ['thunder_1hr', 'thunder_4hr', 'thunder_full']
+
 
 def init(L, b=None):
     """Constructor for multiprocessing"""
@@ -47,13 +53,30 @@ def get_options():
                         help='Number of CPUs to use during 1hr/4hr processing')
     parser.add_argument('-j', '--job', type=str, metavar='', default='',
                         help='Job Number')
+    parser.add_argument('-D', '--deadline', type=int, metavar='', default=None,
+                        help='Minutes to wait for missing 1hr/4hr files before using the members available')
+    parser.add_argument('-M', '--min_members', type=int, metavar='', default=6,
+                        help='Fewest members a 1hr/4hr forecast can be made from after the deadline')
+    parser.add_argument('-R', '--reissue', action='store_true', default=False,
+                        help='Remake 1hr/4hr forecasts made after the deadline if the late members arrive')
+    parser.add_argument('-W', '--wait', type=int, metavar='', default=120,
+                        help='Minutes to wait for missing 1hr/4hr files before exiting (default: 120)')
+    parser.add_argument('-b', '--bbox', type=str, metavar='', default=None,
+                        help='Only forecast a lat/lon box west,south,east,north (e.g. -104,30,-93.5,37.5)')
+    parser.add_argument('-r', '--region', type=str, metavar='', default=None,
+                        choices=sorted(region_util.REGIONS),
+                        help='Only forecast a named region instead of --bbox')
+    parser.add_argument('-C', '--cache_dir', type=str, metavar='', default=None,
+                        help='Directory to cache each member\'s 40 km exceedance in between jobs')
+    parser.add_argument('-B', '--cache_budget', type=int, metavar='', default=exceed_cache.BUDGET,
+                        help=f'Size (MB) the exceedance cache is pruned to (default: {exceed_cache.BUDGET})')
     args = parser.parse_args()
 
     return args
 
 
 def load_href(member, date, fhours, href_dir, nam_dir, hrrr_dir, params,
-              old=False, verbose=False):
+              old=False, verbose=False, href=None, window=None):
     """Loads a single HREF member for the specified forecast period
 
     :param member: Name of model to load
@@ -65,27 +88,26 @@ def load_href(member, date, fhours, href_dir, nam_dir, hrrr_dir, params,
     :param params: List of HREF variables to load
     :param old: Flag to indicate whether the model is time-lagged
     :param verbose: Debug printing (recommend false for multiprocessing)
+    :param href: (Optional) Previously loaded href object of the member to add
+        newly arrived hours to
+    :param window: (Optional) Tuple of (row slice, column slice) to crop the
+        3 km fields to
     :return: list of href objects
     """
     verbose=True
-    href = []
+    run = date.strftime('%Y%m%d') + str(date.hour)
     if member == 'conusnest':
-        href.append(href_io.load_run(nam_dir, 'conusnest', date.strftime('%Y%m%d')
-                                     + str(date.hour), hours=fhours,
-                                     params=params, old=old, verbose=verbose))
+        directory = nam_dir
     elif member == 'hrrr_ncep':
-        href.append(href_io.load_run(hrrr_dir, 'hrrr_ncep', date.strftime('%Y%m%d')
-                                     + str(date.hour), hours=fhours,
-                                     params=params, old=old, verbose=verbose))
+        directory = hrrr_dir
     else:
-        href.append(href_io.load_run(href_dir, member, date.strftime('%Y%m%d')
-                                     + str(date.hour), hours=fhours,
-                                     params=params, old=old, verbose=verbose))
+        directory = href_dir
 
-    return href
+    return [href_io.load_run(directory, member, run, hours=fhours, params=params,
+                             old=old, verbose=verbose, href=href, window=window)]
 
 
-def get_members(date, fhour, href_dir, nam_dir, hrrr_dir, params):
+def get_members(date, fhour, href_dir, nam_dir, hrrr_dir, params, loaded=None, window=None):
     """Load all available members for a given range of forecast hours
 
     :date: Datetime object with the date and hour of the model run
@@ -94,6 +116,11 @@ def get_members(date, fhour, href_dir, nam_dir, hrrr_dir, params):
     :param nam_dir: Location of the NAM CONUS Nest
     :param hrrr_dir: Location of the HRRR
     :param params: List of variables to load
+    :param loaded: (Optional) Dict of the members loaded by a previous call,
+        keyed by member index. Only hours that aren't loaded yet or whose file
+        changed since are read, and the dict is updated in place.
+    :param window: (Optional) Tuple of (row slice, column slice) to crop the
+        3 km fields to
     :return: List of HREF objects
     """
 
@@ -112,19 +139,24 @@ def get_members(date, fhour, href_dir, nam_dir, hrrr_dir, params):
     Use index % 2 to determine whether to load time-lagged version
     Iterate through the list of members and load sequentially
     """
+    if loaded is None:
+        loaded = {}
     for index in range(len(members)):
         if members[index] == 'hrrr_ncep':
             href.extend(load_href(members[index],
                                   dates[2] if index % 2 else dates[0],
                                   fhours[2] if index % 2 else fhours[0],
                                   href_dir, nam_dir, hrrr_dir,
-                                  params, old=index % 2, verbose=True))
+                                  params, old=index % 2, verbose=True,
+                                  href=loaded.get(index), window=window))
         else:
             href.extend(load_href(members[index],
                                   dates[index % 2],
                                   fhours[index % 2],
                                   href_dir, nam_dir, hrrr_dir,
-                                  params, old=index % 2, verbose=True))
+                                  params, old=index % 2, verbose=True,
+                                  href=loaded.get(index), window=window))
+        loaded[index] = href[-1]
 
     # Remove empty href objects
     href = [member for member in href if member is not None]
@@ -175,8 +207,123 @@ def full_check_exists(fhour, grid_dir, date):
         return False
 
 
+def cube_fname(grid_dir, date):
+    """Get the product cube filename of a cycle
+
+    :param grid_dir: Where the grids are saved (grib2)
+    :param date: Datetime object with the date and hour of the model run
+    :return: String with the full path of the cube
+    """
+
+    return f'{grid_dir}hrefct.t{date.strftime("%H")}z.thunder_cube.dat'
+
+
+def write_cube(grid_dir, date, product, fhour, probs):
+    """Add one forecast hour to the cycle's product cube
+
+    The grib2 files are the product, so a cube that can't be written is only
+    a warning.
+
+    :param grid_dir: Where the grids are saved (grib2)
+    :param date: Datetime object with the date and hour of the model run
+    :param product: Product name (in CUBE_PRODUCTS)
+    :param fhour: Forecast hour in the grib2 filename
+    :param probs: 2D array of probabilities (%)
+    """
+
+    try:
+        product_cube.write(cube_fname(grid_dir, date), product, fhour, probs, CUBE_PRODUCTS, date)
+    except OSError as e:
+        print(f'WARNING: Unable to write {product} f{str(fhour).zfill(3)} to {cube_fname(grid_dir, date)}: {e}')
+    return
+
+
+def member_name(href):
+    """Name of a loaded member for the log
+
+    :param href: href object
+    :return: String with the model and run (e.g. conusnssl 2026050100z)
+    """
+
+    return f'{href.model} {href.date.strftime("%Y%m%d%H")}z'
+
+
+def print_members(accumulators, loaded, fhour, expected):
+    """Log the members used by each forecast of a forecast hour
+
+    :param accumulators: Dictionary of ThunderAccumulator objects keyed by product
+    :param loaded: Dictionary of loaded href objects keyed by member index
+    :param fhour: Forecast hour
+    :param expected: Number of members expected for the forecast hour
+    """
+
+    for product, acc in accumulators.items():
+        print(f'{product} forecast f{str(fhour).zfill(3)} uses {acc.count} of {expected} members: '
+              + ', '.join(member_name(loaded[index]) for index in acc.used))
+    return
+
+
+def write_hour_forecast(accumulators, ensemble, date, fhour, grid_dir, wd, mp=False, targets=None):
+    """Calibrate and save the 1-hour and 4-hour forecasts of a forecast hour
+
+    :param accumulators: Dictionary of ThunderAccumulator objects keyed by
+        product ('1hr', '4hr')
+    :param ensemble: List of loaded href objects
+    :param date: Datetime object with the date and hour of the model run
+    :param fhour: Forecast hour
+    :param grid_dir: Where to save the grids (grib2)
+    :param wd: Working directory - Location of the hrefct.vX.Y.Z directory
+    :param mp: Flag to indicate if the function is being called via multiprocessing
+    :param targets: (Optional) 2D boolean array of the cells of a region, the
+        others are masked in the grib2 files
+    """
+
+    # Identify which hour to use for calibration
+    period = date + timedelta(hours=fhour)
+    calib_period = period.hour
+
+    # Make forecasts and apply calibration
+    # 1-hour forecasts
+    if fhour >= 1:
+        if not mp:
+            print('Generating 1-hour forecast for forecast hour '
+                  f'f{str(fhour).zfill(3)}')
+        ftime = date + timedelta(hours=fhour)
+        probs_1hour = accumulators['1hr'].probs()
+        probs_1hour = calibrate.apply_calib(fix_dir, probs_1hour, ensemble[0].date.hour,
+                                            calib_period, exper='grid1hr',
+                                            smooth=1, wd=wd, mask=targets)
+        probs_1hour = np.around(probs_1hour * 100, decimals=0)
+        if targets is not None:
+            probs_1hour = np.ma.masked_where(~targets, probs_1hour)
+        py2grib.py2grib([probs_1hour], date, fhour-1, ftime, 1,
+                        f'{grid_dir}hrefct.t{date.strftime("%H")}z.thunder_1hr.'
+                        f'f{str(fhour).zfill(3)}.grib2')
+        write_cube(grid_dir, date, 'thunder_1hr', fhour, probs_1hour)
+
+    # 4-hour forecasts
+    if fhour >= 4:
+        if not mp:
+            print('Generating 4-hour forecast for forcast hour '
+                  f'f{str(fhour).zfill(3)}')
+        ftime = date + timedelta(hours=fhour)
+        probs_4hour = accumulators['4hr'].probs()
+        probs_4hour = calibrate.apply_calib(fix_dir, probs_4hour, ensemble[0].date.hour,
+                                            calib_period, exper='grid',
+                                            smooth=1, wd=wd, mask=targets)
+        probs_4hour = np.around(probs_4hour * 100, decimals=0)
+        if targets is not None:
+            probs_4hour = np.ma.masked_where(~targets, probs_4hour)
+        py2grib.py2grib([probs_4hour], date, fhour-4, ftime, 4,
+                        f'{grid_dir}hrefct.t{date.strftime("%H")}z.thunder_4hr.'
+                        f'f{str(fhour).zfill(3)}.grib2')
+        write_cube(grid_dir, date, 'thunder_4hr', fhour, probs_4hour)
+    return
+
+
 def gen_hour_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, grid_dir,
-                      params, wd, mp=False):
+                      params, wd, mp=False, deadline=None, min_members=6, reissue=False, wait=120,
+                      region=None, cache_dir=None):
     """Make 1-hour and 4-hour forecasts for each forecast hour
 
     :param ltg_object: empty lightning object
@@ -189,8 +336,27 @@ def gen_hour_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
     :param params: List of variables to load
     :param wd: Working directory - Location of the hrefct.vX.Y.Z directory
     :param mp: Flag to indicate if the function is being called via multiprocessing
+    :param deadline: (Optional) Minutes to wait for missing files before making
+        the forecasts from the members available so far. None waits for every
+        member.
+    :param min_members: Fewest complete members a forecast can be made from
+        once the deadline has passed
+    :param reissue: Keep waiting after a forecast was made without every member
+        and remake it if the missing files arrive
+    :param wait: Minutes to wait for missing files before exiting (0 for
+        archived data that won't arrive later)
+    :param region: (Optional) Box (west, south, east, north) from
+        region_util.get_bbox(). The members are cropped to the part of the
+        3 km grid the box needs and the cells outside it are masked. The
+        grids and cube are written to grid_dir/region_<box>.
+    :param cache_dir: (Optional) Location of the exceedance cache (see
+        exceed_cache)
     """
 
+    # Region grids and cube go under grid_dir/region_<box>
+    grid_dir = os.path.join(region_util.region_dir(grid_dir, region), '')
+    os.makedirs(grid_dir, exist_ok=True)
+
     # Dictionary of expected membership numbers based on forecasthour
     switch_date = datetime.strptime('202012030000', '%Y%m%d%H%M')
     if date >= switch_date and os.environ['COMINhrw_string'] == "fv3":
@@ -210,6 +376,7 @@ def gen_hour_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
 
         delay = 0         # Timeout counter
         success = False   # Flag to signal if there are enough members to proceed
+        degraded = False  # Flag to signal a forecast was made without every member
 
         already_exists = check_exists(fhour, grid_dir, date)
 
@@ -217,14 +384,36 @@ def gen_hour_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
         if already_exists:
             continue
 
+        # Members are thresholded and regridded into running sums as soon as
+        # all of their hours have arrived, so only the weighting, calibration
+        # and encoding are left once the last file lands
+        gridmap = data_util.load_gridmap(fix_dir)
+        targets, window = None, None
+        if region is not None:
+            targets, window = data_util.get_region(gridmap, ltg_object, region)
+        accumulators = {}
+        if fhour >= 1:
+            accumulators['1hr'] = data_util.ThunderAccumulator(gridmap, ltg_object, fhour-1,
+                                                               exper=3, period=1, window=window,
+                                                               cache_dir=cache_dir)
+        if fhour >= 4:
+            accumulators['4hr'] = data_util.ThunderAccumulator(gridmap, ltg_object, fhour-4,
+                                                               exper=1, window=window,
+                                                               cache_dir=cache_dir)
+        loaded = {}
+        if fhour < 4:
+            fhours = list(range(fhour - 1, fhour + 1))
+        else:
+            fhours = list(range(fhour - 4, fhour + 1))
+
         while not success:
-            ensemble = []
-            # Try to load the data
-            if fhour < 4:
-                fhours = list(range(fhour - 1, fhour + 1))
-            else:
-                fhours = list(range(fhour - 4, fhour + 1))
-            ensemble = get_members(date, fhours, href_dir, nam_dir, hrrr_dir, params)
+            # Load the hours that have arrived since the last check
+            ensemble = get_members(date, fhours, href_dir, nam_dir, hrrr_dir, params,
+                                   loaded=loaded, window=window)
+            for index, href in loaded.items():
+                for acc in accumulators.values():
+                    if href is not None and acc.ready(href):
+                        acc.add(index, href)
             # Check the number of loaded members
             num_members = len(ensemble)
             i = 0
@@ -237,14 +426,29 @@ def gen_hour_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
             expected = fmembers[fkeys[fkeys <= fhour].max()]
             expected_files = exfiles[exkeys[exkeys <= fhour].max()]
             missing_files = expected_files - total  # MSE
-            wait = 120  # how long to wait in minutes before exiting
             sleep = 60  # how many seconds to wait before checking for new file
             if missing_files > 0:
+                # Past the deadline, make the forecasts from the complete members
+                complete = min(acc.count for acc in accumulators.values())
+                if (not degraded and deadline is not None and delay >= deadline
+                        and complete >= min(min_members, expected)):
+                    print(f'WARNING: Missing {missing_files} files for f{str(fhour).zfill(3)} after the '
+                          f'{deadline} min deadline. Making the forecasts from the members available so far')
+                    print_members(accumulators, loaded, fhour, expected)
+                    write_hour_forecast(accumulators, ensemble, date, fhour, grid_dir, wd, mp, targets)
+                    degraded = True
+                    if not reissue:
+                        break
+                    print(f'Waiting for the missing files to reissue f{str(fhour).zfill(3)}')
                 #  print warning to screen if delay is more than 10 min, which would signify an issue with incoming model data
                 if delay >= 10:
                     print(f'WARNING: Missing {missing_files} files for f{str(fhour).zfill(3)}. Wait {sleep} seconds '
                           f'as it may still be coming in. Time Waiting: {delay} min of {wait} min\n')
                 if delay >= wait:
+                    if degraded:
+                        print(f'WARNING: Missing files for f{str(fhour).zfill(3)} did not arrive within {wait} min. '
+                              'Keeping the forecasts made without them')
+                        break
                     print(f'FATAL ERROR: Not enough HREF members to proceed for f{str(fhour).zfill(3)}. Waited for {wait} min. Exiting...')
                     sys.exit()
                 delay += 1
@@ -252,52 +456,30 @@ def gen_hour_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
             else:
                 success = True
 
+        if not success:
+            print(f'...{date.strftime("%Y%m%d %H")}z f{str(fhour).zfill(2)} complete!...')
+            continue
+
         # Once the ensemble is loaded, continue with making the grib2 files
         if not mp:
             print(f'\nData ready for forecast hour {str(fhour).zfill(3)}')
 
-        # Identify which hour to use for calibration
-        period = date + timedelta(hours=fhour)
-        calib_period = period.hour
-
-        # Make forecasts and apply calibration
-        # 1-hour forecasts
-        if fhour >= 1:
-            if not mp:
-                print('Generating 1-hour forecast for forecast hour '
-                      f'f{str(fhour).zfill(3)}')
-            ftime = date + timedelta(hours=fhour)
-            probs_1hour = data_util.get_thunder_probs(fix_dir, ensemble, ltg_object,
-                                                      fhour-1, exper=3,
-                                                      period=1, wd=wd)
-            probs_1hour = calibrate.apply_calib(fix_dir, probs_1hour, ensemble[0].date.hour,
-                                                calib_period, exper='grid1hr',
-                                                smooth=1, wd=wd)
-            probs_1hour = np.around(probs_1hour * 100, decimals=0)
-            py2grib.py2grib([probs_1hour], date, fhour-1, ftime, 1,
-                            f'{grid_dir}hrefct.t{date.strftime("%H")}z.thunder_1hr.'
-                            f'f{str(fhour).zfill(3)}.grib2')
-            
-        # 4-hour forecasts
-        if fhour >= 4:
-            if not mp:
-                print('Generating 4-hour forecast for forcast hour '
-                      f'f{str(fhour).zfill(3)}')
-            ftime = date + timedelta(hours=fhour)
-            probs_4hour = data_util.get_thunder_probs(fix_dir, ensemble, ltg_object,
-                                                      fhour-4, exper=1, wd=wd)
-            probs_4hour = calibrate.apply_calib(fix_dir, probs_4hour, ensemble[0].date.hour,
-                                                calib_period, exper='grid',
-                                                smooth=1, wd=wd)
-            probs_4hour = np.around(probs_4hour * 100, decimals=0)
-            py2grib.py2grib([probs_4hour], date, fhour-4, ftime, 4,
-                            f'{grid_dir}hrefct.t{date.strftime("%H")}z.thunder_4hr.'
-                            f'f{str(fhour).zfill(3)}.grib2')
+        # Once the file quota is met every loaded member is added, including
+        # members still missing an hour (as the whole ensemble was before)
+        for index, href in loaded.items():
+            for acc in accumulators.values():
+                if href is not None:
+                    acc.add(index, href)
+
+        if degraded:
+            print(f'Reissuing f{str(fhour).zfill(3)} with the late members')
+        print_members(accumulators, loaded, fhour, expected)
+        write_hour_forecast(accumulators, ensemble, date, fhour, grid_dir, wd, mp, targets)
         print(f'...{date.strftime("%Y%m%d %H")}z f{str(fhour).zfill(2)} complete!...')
 
 
 def gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, grid_dir,
-                    params, wd, mp=False):
+                    params, wd, mp=False, region=None, cache_dir=None):
     """Make full-period forecasts for each forecast hour
 
     :param ltg_object: empty lightning object
@@ -310,12 +492,21 @@ def gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
     :param params: List of variables to load
     :param wd: Working directory - Location of the hrefct.vX.Y.Z directory
     :param mp: Flag to indicate if the function is being called via multiprocessing
+    :param region: (Optional) Box (west, south, east, north) from
+        region_util.get_bbox(), see gen_hour_forecast()
+    :param cache_dir: (Optional) Location of the exceedance cache
     """
 
+    grid_dir = os.path.join(region_util.region_dir(grid_dir, region), '')
+    os.makedirs(grid_dir, exist_ok=True)
+    targets, window = None, None
+    if region is not None:
+        targets, window = data_util.get_region(data_util.load_gridmap(fix_dir), ltg_object, region)
+
     # Load the full HREF run
     if not mp:
         print('...Loading HREF ensemble...')
-    ensemble = get_members(date, fhours, href_dir, nam_dir, hrrr_dir, params)
+    ensemble = get_members(date, fhours, href_dir, nam_dir, hrrr_dir, params, window=window)
 
     # Load the 4-hour forecasts
     probs_4hour = []
@@ -333,7 +524,7 @@ def gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
             print(f'WARNING: {fname} is not available')
             continue
         else:
-            probs_4hour.append(gribs.data())
+            probs_4hour.append(np.ma.filled(gribs.data(), 0))
 
     # Load the 1-hour forecasts
     probs_1hour = []
@@ -349,7 +540,7 @@ def gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
             print(f'WARNING: {fname} is not available')
             continue
         else:
-            probs_1hour.append(gribs.data())
+            probs_1hour.append(np.ma.filled(gribs.data(), 0))
 
     # Check the data
     if len(ensemble) == 0:
@@ -384,7 +575,7 @@ def gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
             fcsthour = str(fhour).zfill(3)
             full_period_file = f'{grid_dir}hrefct.t{HH}z.thunder_full.f{fcsthour}.grib2'
             gribs_full = ncepgrib2.Grib2Decode(full_period_file, gribmsg=False)
-            last_fcast = gribs_full.data()
+            last_fcast = np.ma.filled(gribs_full.data(), 0)
             continue  
 
         # Calculate how many hours between current forecast hour and next 12z
@@ -402,9 +593,10 @@ def gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
 
         # Get the full-period forecast
         full_probs = data_util.get_thunder_probs(fix_dir, ensemble, ltg_object, fhour,
-                                                 exper=2, period=remainder, wd=wd)
+                                                 exper=2, period=remainder, wd=wd, window=window,
+                                                 cache_dir=cache_dir)
         full_probs = calibrate.apply_calib(fix_dir, full_probs, date.hour, calib_period,
-                                           exper='fullperiod', smooth=2, wd=wd)
+                                           exper='fullperiod', smooth=2, wd=wd, mask=targets)
         full_probs = np.around(full_probs * 100, decimals=0)
 
         # Get the 4-hour probs max for the period
@@ -437,9 +629,12 @@ def gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, gri
             ftime = (ftime + timedelta(days=1)).replace(hour=12)
 
         # Save the grib2 file
+        if targets is not None:
+            full_probs = np.ma.masked_where(~targets, full_probs)
         py2grib.py2grib([full_probs], date, fhour, ftime, remainder,
                         f'{grid_dir}hrefct.t{date.strftime("%H")}z.thunder_full.f'
                         f'{str(fhour).zfill(3)}.grib2')
+        write_cube(grid_dir, date, 'thunder_full', fhour, full_probs)
 
         # Advance to the next forecast hour
         print(f'...{date.strftime("%Y%m%d %H")}z f{str(fhour).zfill(2)} complete!...')
@@ -473,6 +668,12 @@ if __name__ == '__main__':
     else:
         mp = False
     date = datetime.strptime(args['date'].strip(), '%Y%m%d%H')
+    cache_dir = args['cache_dir'].strip() if args['cache_dir'] is not None else None
+    try:
+        region = region_util.get_bbox(args['region'], args['bbox'])
+    except ValueError as e:
+        print(f'FATAL ERROR: {e}')
+        sys.exit(1)
     start = timeit.default_timer()
     ltg_object = lightning_io.load_future(date)
 
@@ -480,13 +681,17 @@ if __name__ == '__main__':
     print('\nHREF Calibrated Thunder v1.0.0 - Grid Generation Script')
     print(f'Processing {date.strftime("%Y%m%d %H")}z HREF cycle')
     print(f'Initiated {datetime.now().strftime("%Y%m%d %H:%M:%S")}')
+    if region is not None:
+        print(f'Forecasting region {region_util.bbox_tag(region)} into {region_util.region_dir(grid_dir, region)}')
 
     # 1/4hr processing
     if job >=1 and job <=48:
         print(f'\nGenerating 1-hr and 4-hr forecasts for job number {job}:')
         fhours = [job]
         gen_hour_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir,
-                          grid_dir, params, working_dir, False)
+                          grid_dir, params, working_dir, False, deadline=args['deadline'],
+                          min_members=args['min_members'], reissue=args['reissue'],
+                          wait=args['wait'], region=region, cache_dir=cache_dir)
         print('1-hr and 4-hr forecasts complete!')
 
     # Full period processing
@@ -495,31 +700,42 @@ if __name__ == '__main__':
             print('\nGenerating convective day forecasts for f00 - f12:')
             fhours = list(range(0, 13))
             gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, grid_dir,
-                              params, working_dir, False)
+                              params, working_dir, False, region=region,
+                              cache_dir=cache_dir)
             print('Full period forecasts complete!')
         elif job == 50:
             print('\nGenerating convective day forecasts for f12 - f36:')
             fhours = list(range(12, 37))
             gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, grid_dir,
-                              params, working_dir, False)
+                              params, working_dir, False, region=region,
+                              cache_dir=cache_dir)
             print('Full period forecasts complete!')
         elif job == 51:
             print('\nGenerating convective day forecasts for f36 - f48:')
             fhours = list(range(36, 49))
             gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, grid_dir,
-                              params, working_dir, False)
+                              params, working_dir, False, region=region,
+                              cache_dir=cache_dir)
             print('Full period forecasts complete!')
     elif date.hour == 12:
         if job == 49:
             print('\nGenerating convective day forecasts for f00 - f24:')
             fhours = list(range(0, 25))
             gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, grid_dir,
-                              params, working_dir, False)
+                              params, working_dir, False, region=region,
+                              cache_dir=cache_dir)
             print('Full period forecasts complete!')
         if job == 50:
             print('\nGenerating convective day forecasts for f00 - f24:')
             fhours = list(range(24, 49))
             gen_full_forecast(ltg_object, date, fhours, href_dir, nam_dir, hrrr_dir, grid_dir,
-                              params, working_dir, False)
+                              params, working_dir, False, region=region,
+                              cache_dir=cache_dir)
             print('Full period forecasts complete!')
+
+    # Keep the exceedance cache within its budget
+    if cache_dir is not None:
+        removed = exceed_cache.prune(cache_dir, args['cache_budget'] * 2**20)
+        if removed:
+            print(f'Removed {removed} old entries from the exceedance cache')
     print(f'\nTotal genGrids run time: {str(timeit.default_timer() - start)} seconds')
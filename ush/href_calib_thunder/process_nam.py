@@ -0,0 +1,58 @@
+# Program Name: SPC NAM Post Process
+# Affiliation: NOAA/NWS/Storm Prediction Center
+# Abstract: Subsets the operational NAM nest camfld files to the fields used by
+#           HREF Calibrated Thunder (4LFTX, REFD at 263 K and 4000 m, 1-hr APCP)
+#           in one pass per file, with 3-hr bucket precip turned into 1-hr precip
+#
+# Usage:
+#   python process_nam.py -i INPUT_DIR -o OUTPUT_DIR -d YYYYMMDDHH -f FHOUR [-c]
+#   Input Files (operational NAM NEST):
+#       nam.tHHz.conusnest.camfldFF.tm00.grib2
+#   Output Files (subset of needed variables with 1-hr precip, and inventory):
+#       nam.tHHz.conusnest.camfldFF.tm00.grib2
+#       nam.tHHz.conusnest.camfldFF.tm00.grib2.idx
+
+import sys
+import argparse
+from calib_thunder.io import nam_io
+
+
+def get_options():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input_dir', type=str, metavar='', required=True,
+                        help='Location of the NAM nest files (e.g. $COMINnam/nam.$PDY)')
+    parser.add_argument('-o', '--output_dir', type=str, metavar='', required=True,
+                        help='Where to write the processed files (e.g. $COMOUTspc_nam)')
+    parser.add_argument('-d', '--date', type=str, metavar='', required=True,
+                        help='Date of the NAM run (YYYYMMDDHH)')
+    parser.add_argument('-f', '--fhour', type=int, metavar='', required=True,
+                        help='Forecast hour chunk to process (a multiple of 3, e.g. 3, 6, ..., 60)')
+    parser.add_argument('-c', '--coldstart', action='store_true',
+                        help='Reprocess hours that were already processed')
+    return parser.parse_args()
+
+
+def main():
+    args = get_options()
+    hours = nam_io.chunk_hours(args.fhour)
+    print(f'Running on {args.date[:8]} {args.date[8:]}Z f{str(args.fhour).zfill(2)} '
+          f'(hours {hours[0]} - {hours[-1]})')
+
+    if not args.coldstart and all(nam_io.is_processed(args.output_dir, args.date, hour) for hour in hours):
+        print(f'All files already processed for {args.date[:8]} {args.date[8:]}Z f{str(args.fhour).zfill(2)}')
+        return
+
+    written = nam_io.process_chunk(args.input_dir, args.output_dir, args.date, args.fhour,
+                                   coldstart=args.coldstart)
+    missing = [hour for hour in hours if hour not in written and not
+               nam_io.is_processed(args.output_dir, args.date, hour)]
+    if missing:
+        print(f'FATAL ERROR: Unable to process NAM forecast hours {missing}')
+        sys.exit(1)
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,443 @@
+# Program Name: SPC POST archived cycle replay
+# Affiliation: NOAA/NWS/Storm Prediction Center
+# Abstract: End-to-end latency benchmark for the HREF Calibrated Thunder and
+#           HREF/SREF Calibrated Severe drivers. Files of an archived cycle are
+#           dropped into a sandbox COM tree on a recorded or synthetic arrival
+#           schedule (optionally time-compressed), jobs are released like the
+#           managers do, and the time from the last input arrival to the end of
+#           every job is reported.
+#
+# Usage:
+#   python replay_cycle.py -a ARCHIVE -s SANDBOX -d YYYYMMDDHH [-x SPEEDUP]
+#                          [--schedule synthetic|mtime|FILE.json] [-p thunder severe]
+#
+#   ARCHIVE mirrors the COM roots the drivers read:
+#       hiresw/hiresw.YYYYMMDD/hiresw.tHHz.*.fFF.*.grib2
+#       hrrr/hrrr.YYYYMMDD/conus/hrrr.tHHz.wrfsfcfFF.grib2
+#       nam/nam.YYYYMMDD/nam.tHHz.conusnest.camfldFF.tm00.grib2
+#       spc_post/spc_post.YYYYMMDD/spc_nam/nam.tHHz.conusnest.camfldFF.tm00.grib2 (1-hr precip NAM)
+#       spcsref/spcsref.YYYYMMDD/gempak/spcsref_YYYYMMDDHHfFFF
+#   Time-lagged runs and anything not matched above are in place before the
+#   replay starts. The schedule is in seconds after the cycle time; the
+#   replay clock starts at the first scheduled arrival.
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+import datetime
+
+USH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(USH, 'href_calib_severe'))
+from calib_severe.engine import CYCLE_HOURS, run_table, sref_run
+
+# Input streams: path pattern and synthetic arrival (minutes after the run of
+# the first file, minutes per forecast hour)
+STREAMS = {
+    'hiresw': (re.compile(r'^hiresw/hiresw\.(?P<day>\d{8})/hiresw\.t(?P<hh>\d{2})z\..*\.f(?P<fh>\d+)\..*grib2(?P<idx>\.idx)?$'),
+               75, 1.5),
+    'hrrr': (re.compile(r'^hrrr/hrrr\.(?P<day>\d{8})/conus/hrrr\.t(?P<hh>\d{2})z\.wrfsfcf(?P<fh>\d+)\.grib2(?P<idx>\.idx)?$'),
+             50, 1.0),
+    'nam': (re.compile(r'^nam/nam\.(?P<day>\d{8})/nam\.t(?P<hh>\d{2})z\.conusnest\.camfld(?P<fh>\d+)\.tm00\.grib2(?P<idx>\.idx)?$'),
+            80, 1.25),
+    'spc_nam': (re.compile(r'^spc_post/spc_post\.(?P<day>\d{8})/spc_nam/nam\.t(?P<hh>\d{2})z\.conusnest\.camfld(?P<fh>\d+)\.tm00\.grib2(?P<idx>\.idx)?$'),
+                85, 1.25),
+    'sref': (re.compile(r'^spcsref/spcsref\.\d{8}/gempak/spcsref_(?P<run>\d{10})f(?P<fh>\d{3})$'),
+             200, 0.5)
+}
+
+# HREF cycle -> severe runs calibrated from it
+SEVERE_RUNS = {
+    '00': ['00', '03'],
+    '12': ['12', '15']
+}
+
+# Thunder full period jobs and the last forecast hour each one needs
+THUNDER_FULL = {
+    '00': {49: 12, 50: 36, 51: 48},
+    '12': {49: 24, 50: 48}
+}
+
+
+def get_options():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', '--archive', type=str, metavar='ARCHIVE', required=True,
+                        help='Archived cycle (COM roots, see the header of this script)')
+    parser.add_argument('-s', '--sandbox', type=str, metavar='SANDBOX', required=True,
+                        help='Where the COM tree, job logs and report are written')
+    parser.add_argument('-d', '--date', type=str, metavar='YYYYMMDDHH', required=True,
+                        help='HREF cycle to replay (YYYYMMDDHH, 00Z or 12Z)')
+    parser.add_argument('--schedule', type=str, metavar='', default='synthetic',
+                        help='synthetic, mtime (archive file times) or a JSON file of '
+                             '{path: seconds after the cycle} (default: synthetic)')
+    parser.add_argument('--save_schedule', type=str, metavar='', default=None,
+                        help='Write the schedule used to a JSON file')
+    parser.add_argument('-x', '--speedup', type=float, metavar='', default=1.0,
+                        help='Time compression of the arrival schedule (default: 1)')
+    parser.add_argument('-p', '--products', nargs='+', metavar='', default=['thunder', 'severe'],
+                        choices=['thunder', 'severe'], help='Products to run (default: thunder severe)')
+    parser.add_argument('-j', '--max_jobs', type=int, metavar='', default=4,
+                        help='Jobs run at the same time (default: 4)')
+    parser.add_argument('-n', '--nprocs', type=int, metavar='', default=1,
+                        help='Processes per severe job (default: 1)')
+    parser.add_argument('-r', '--report', type=str, metavar='', default=None,
+                        help='Latency report (default: SANDBOX/replay_report.json)')
+    return parser.parse_args()
+
+
+def parse_input(path):
+    """Identify an archived input file
+
+    :param path: Path relative to the archive
+    :return: Dictionary with the stream, run (datetime), forecast hour and idx
+        flag, or None if the file is not a known input
+    """
+
+    for stream, (pattern, first, rate) in STREAMS.items():
+        match = pattern.match(path)
+        if match is None:
+            continue
+        groups = match.groupdict()
+        if 'run' in groups:
+            run = datetime.datetime.strptime(groups['run'], '%Y%m%d%H')
+        else:
+            run = datetime.datetime.strptime(groups['day'] + groups['hh'], '%Y%m%d%H')
+        return {'path': path, 'stream': stream, 'run': run, 'fhour': int(groups['fh']),
+                'idx': groups.get('idx') is not None}
+    return None
+
+
+def synthetic_offset(item, cycle):
+    """Synthetic arrival of an input file
+
+    :param item: Dictionary from parse_input()
+    :param cycle: Datetime object with the replayed cycle
+    :return: Seconds after the cycle time
+    """
+
+    _, first, rate = STREAMS[item['stream']]
+    minutes = (item['run'] - cycle).total_seconds() / 60 + first + item['fhour'] * rate
+    return minutes * 60
+
+
+def build_schedule(archive, cycle, schedule='synthetic'):
+    """Arrival time of every file in the archive
+
+    :param archive: Location of the archived cycle
+    :param cycle: Datetime object with the replayed cycle
+    :param schedule: 'synthetic', 'mtime' or a JSON file of {path: seconds}
+    :return: Dictionary of seconds after the cycle time keyed by relative path.
+        Files with no positive arrival are in place when the replay starts.
+    """
+
+    recorded = None
+    if schedule not in ('synthetic', 'mtime'):
+        with open(schedule) as f:
+            recorded = json.load(f)
+
+    epoch = cycle.replace(tzinfo=datetime.timezone.utc).timestamp()
+    offsets = {}
+    for root, _, files in os.walk(archive):
+        for fname in files:
+            path = os.path.relpath(os.path.join(root, fname), archive)
+            item = parse_input(path)
+            if recorded is not None:
+                offsets[path] = float(recorded.get(path, 0))
+            elif schedule == 'mtime':
+                offsets[path] = os.path.getmtime(os.path.join(archive, path)) - epoch
+            elif item is not None:
+                offsets[path] = synthetic_offset(item, cycle)
+            else:
+                offsets[path] = 0.
+    return offsets
+
+
+def deliver(archive, sandbox, path):
+    """Copy one file into the sandbox so it appears in one step
+
+    :param archive: Location of the archived cycle
+    :param sandbox: Location of the sandbox COM tree
+    :param path: Path relative to the archive
+    """
+
+    dest = os.path.join(sandbox, path)
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = f'{dest}.replay.tmp'
+    shutil.copy2(os.path.join(archive, path), tmp)
+    os.replace(tmp, dest)
+    return
+
+
+def job_env(sandbox, cycle, name, **extra):
+    """Environment of a driver run
+
+    :param sandbox: Location of the sandbox
+    :param cycle: Datetime object with the replayed cycle
+    :param name: Job name (used for DATA and jobid)
+    :param extra: Other variables
+    :return: Dictionary of environment variables
+    """
+
+    com = os.path.join(sandbox, 'com')
+    comout = os.path.join(com, 'spc_post', f'spc_post.{cycle.strftime("%Y%m%d")}')
+    env = dict(os.environ)
+    env.update({
+        'PDY': cycle.strftime('%Y%m%d'),
+        'cyc': cycle.strftime('%H'),
+        'jobid': name,
+        'DATA': os.path.join(sandbox, 'data', name),
+        'COMOUT': comout,
+        'COMOUTspc_post': comout,
+        'COMOUTspc_nam': os.path.join(comout, 'spc_nam'),
+        'COMOUTspc_pickle': os.path.join(comout, 'spc_pickle'),
+        'COMINhiresw': os.path.join(com, 'hiresw'),
+        'COMINhrrr': os.path.join(com, 'hrrr'),
+        'COMINnam': os.path.join(com, 'nam'),
+        'COMINspcsref': os.path.join(com, 'spcsref'),
+        'USHspc_post': USH,
+        'FIXspc_post': os.environ.get('FIXspc_post', os.path.join(os.path.dirname(USH), 'fix')),
+        'COMINhrw_string': os.environ.get('COMINhrw_string', 'fv3')
+    })
+    env.update(extra)
+    return env
+
+
+def needs(inputs, runs):
+    """Scheduled inputs of a job
+
+    :param inputs: List of dictionaries from parse_input()
+    :param runs: List of (streams, run datetime, first hour, last hour)
+    :return: Set of relative paths
+    """
+
+    paths = set()
+    for item in inputs:
+        if item['idx']:
+            continue
+        for streams, run, start, end in runs:
+            if item['stream'] in streams and item['run'] == run and start <= item['fhour'] <= end:
+                paths.add(item['path'])
+    return paths
+
+
+def thunder_jobs(sandbox, cycle, inputs):
+    """Thunder 1hr/4hr and full period jobs of a cycle
+
+    :param sandbox: Location of the sandbox
+    :param cycle: Datetime object with the replayed cycle
+    :param inputs: List of scheduled inputs from parse_input()
+    :return: List of job dictionaries
+    """
+
+    script = os.path.join(USH, 'href_calib_thunder', 'forecast_href_cal_thunder.py')
+    old = cycle - datetime.timedelta(hours=12)
+    old_hrrr = cycle - datetime.timedelta(hours=6)
+    jobs = []
+    for job in range(1, 49):
+        start = job - 1 if job < 4 else job - 4
+        runs = [(('hiresw', 'hrrr', 'spc_nam'), cycle, start, job),
+                (('hiresw', 'spc_nam'), old, start + 12, job + 12),
+                (('hrrr',), old_hrrr, start + 6, job + 6)]
+        name = f'thunder_f{str(job).zfill(2)}'
+        jobs.append({'name': name, 'product': 'thunder', 'cmd': [script, str(job)],
+                     'env': job_env(sandbox, cycle, name), 'inputs': needs(inputs, runs), 'deps': []})
+    for job, end in THUNDER_FULL[cycle.strftime('%H')].items():
+        name = f'thunder_full{job}'
+        jobs.append({'name': name, 'product': 'thunder', 'cmd': [script, str(job)],
+                     'env': job_env(sandbox, cycle, name), 'inputs': set(),
+                     'deps': [f'thunder_f{str(j).zfill(2)}' for j in range(1, end + 1)]})
+    return jobs
+
+
+def severe_jobs(sandbox, cycle, inputs, nprocs=1):
+    """Severe 4hr and full period jobs of the runs calibrated from a cycle
+
+    :param sandbox: Location of the sandbox
+    :param cycle: Datetime object with the replayed cycle
+    :param inputs: List of scheduled inputs from parse_input()
+    :param nprocs: Processes per job
+    :return: List of job dictionaries
+    """
+
+    script = os.path.join(USH, 'href_calib_severe', 'forecast_href_cal_severe.py')
+    date = cycle.strftime('%Y%m%d')
+    jobs = []
+    for run in SEVERE_RUNS[cycle.strftime('%H')]:
+        now = datetime.datetime.strptime(date + run, '%Y%m%d%H')
+        sref = datetime.datetime.strptime(sref_run(run, now)[1], '%Y%m%d%H')
+        names = []
+        for fhour in range(CYCLE_HOURS[run][0], CYCLE_HOURS[run][1]+1):
+            tables = run_table(run, str(fhour).zfill(3))
+            init = datetime.datetime.strptime(date, '%Y%m%d') + datetime.timedelta(hours=tables['hrefRun'])
+            runs = [(('hiresw', 'hrrr', 'nam'), init, tables['hrefStart'], tables['hrefEnd']),
+                    (('hiresw', 'nam'), init - datetime.timedelta(hours=12), tables['hrefStartTL'], tables['hrefEndTL']),
+                    (('hrrr',), init - datetime.timedelta(hours=6), tables['hrefStartTL'] - 6, tables['hrefEndTL'] - 6),
+                    (('sref',), sref, 0, 999)]
+            name = f'severe_{run}z_f{str(fhour).zfill(3)}'
+            names.append(name)
+            jobs.append({'name': name, 'product': 'severe',
+                         'cmd': [script, '-r', run, '-d', date, '-f', str(fhour).zfill(3), '-c'],
+                         'env': job_env(sandbox, cycle, name, NCPUS=str(nprocs)),
+                         'inputs': needs(inputs, runs), 'deps': []})
+        name = f'severe_{run}z_full'
+        jobs.append({'name': name, 'product': 'severe',
+                     'cmd': [script, '-r', run, '-d', date, '-f', 'full', '-c'],
+                     'env': job_env(sandbox, cycle, name, NCPUS=str(nprocs)),
+                     'inputs': needs(inputs, [(('sref',), sref, 0, 999)]), 'deps': names})
+    return jobs
+
+
+def replay(archive, sandbox, offsets, jobs, speedup=1.0, max_jobs=4):
+    """Deliver the archived files on schedule and run the jobs as their inputs arrive
+
+    A job is released once its inputs and the jobs it depends on are done, or
+    once every file has been delivered (missing inputs are then left to the
+    driver).
+
+    :param archive: Location of the archived cycle
+    :param sandbox: Location of the sandbox
+    :param offsets: Dictionary from build_schedule()
+    :param jobs: List of job dictionaries
+    :param speedup: Time compression of the schedule
+    :param max_jobs: Jobs run at the same time
+    :return: List of job dictionaries with replay times (seconds) added
+    """
+
+    com = os.path.join(sandbox, 'com')
+    log_dir = os.path.join(sandbox, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    # everything without a positive arrival is in place before the clock starts
+    for path, offset in offsets.items():
+        if offset <= 0:
+            deliver(archive, com, path)
+    scheduled = sorted((offset, path.endswith('.idx'), path) for path, offset in offsets.items() if offset > 0)
+    first = scheduled[0][0] if scheduled else 0.
+    pending = [((offset - first) / speedup, path) for offset, _, path in scheduled]
+    arrived = {}
+    print(f'Replaying {len(pending)} scheduled files ({len(offsets) - len(pending)} in place) '
+          f'over {pending[-1][0] if pending else 0:.0f} s')
+
+    byname = {job['name']: job for job in jobs}
+    waiting = list(jobs)
+    running = []
+    start = time.time()
+    while waiting or running:
+        now = time.time() - start
+        while pending and pending[0][0] <= now:
+            due, path = pending.pop(0)
+            deliver(archive, com, path)
+            arrived[path] = time.time() - start
+
+        # release jobs in order, like the managers
+        for job in list(waiting):
+            if len(running) >= max_jobs:
+                break
+            ready = all(path in arrived for path in job['inputs']) or not pending
+            deps = [byname[d] for d in job['deps'] if d in byname]
+            if not ready or any('finished' not in d for d in deps):
+                continue
+            job['last_input'] = max([arrived.get(path, 0.) for path in job['inputs']]
+                                    + [d['last_input'] for d in deps] + [0.])
+            job['released'] = time.time() - start
+            os.makedirs(job['env']['DATA'], exist_ok=True)
+            job['log'] = os.path.join(log_dir, job['name'] + '.log')
+            with open(job['log'], 'w') as log:
+                cwd = os.path.dirname(job['cmd'][0])
+                job['proc'] = subprocess.Popen([sys.executable, '-u'] + job['cmd'], env=job['env'], cwd=cwd,
+                                               stdout=log, stderr=subprocess.STDOUT)
+            print(f"{job['released']:9.1f} s  released {job['name']}")
+            waiting.remove(job)
+            running.append(job)
+
+        for job in list(running):
+            rc = job['proc'].poll()
+            if rc is None:
+                continue
+            job['finished'] = time.time() - start
+            job['rc'] = rc
+            job['latency'] = job['finished'] - job['last_input']
+            with open(job['log']) as log:
+                # the severe driver exits cleanly after a FATAL ERROR
+                job['fatal'] = rc != 0 or 'FATAL ERROR' in log.read()
+            del job['proc']
+            running.remove(job)
+            print(f"{job['finished']:9.1f} s  finished {job['name']} (rc {rc}{', FATAL ERROR' if job['fatal'] else ''}, "
+                  f"{job['latency']:.1f} s after its last input)")
+        time.sleep(0.5)
+    return jobs
+
+
+def summarize(jobs):
+    """Latency statistics by product
+
+    :param jobs: List of job dictionaries from replay()
+    :return: Dictionary keyed by product
+    """
+
+    summary = {}
+    for product in sorted(set(job['product'] for job in jobs)):
+        latency = sorted(job['latency'] for job in jobs if job['product'] == product)
+        summary[product] = {
+            'jobs': len(latency),
+            'failed': sum(1 for job in jobs if job['product'] == product and job['fatal']),
+            'mean_latency': sum(latency) / len(latency),
+            'median_latency': latency[len(latency) // 2],
+            'max_latency': latency[-1]
+        }
+    return summary
+
+
+def main():
+    args = get_options()
+    cycle = datetime.datetime.strptime(args.date, '%Y%m%d%H')
+    if cycle.strftime('%H') not in SEVERE_RUNS:
+        print(f'FATAL ERROR: Only 00Z and 12Z HREF cycles can be replayed, got {args.date}')
+        sys.exit(1)
+    archive = os.path.abspath(args.archive)
+    sandbox = os.path.abspath(args.sandbox)
+    report = args.report if args.report is not None else os.path.join(sandbox, 'replay_report.json')
+
+    offsets = build_schedule(archive, cycle, args.schedule)
+    if args.save_schedule is not None:
+        with open(args.save_schedule, 'w') as f:
+            json.dump(offsets, f, indent=1, sort_keys=True)
+    inputs = [item for item in (parse_input(path) for path in offsets if offsets[path] > 0) if item is not None]
+
+    jobs = []
+    if 'thunder' in args.products:
+        jobs += thunder_jobs(sandbox, cycle, inputs)
+    if 'severe' in args.products:
+        jobs += severe_jobs(sandbox, cycle, inputs, args.nprocs)
+    replay(archive, sandbox, offsets, jobs, args.speedup, args.max_jobs)
+
+    summary = summarize(jobs)
+    print(f'\n{"job":<22} {"last input":>11} {"released":>10} {"finished":>10} {"latency":>10}  status')
+    for job in jobs:
+        print(f"{job['name']:<22} {job['last_input']:11.1f} {job['released']:10.1f} "
+              f"{job['finished']:10.1f} {job['latency']:10.1f}  {'FAILED' if job['fatal'] else 'ok'}")
+    for product, stats in summary.items():
+        print(f"{product}: {stats['jobs']} jobs ({stats['failed']} failed), latency mean "
+              f"{stats['mean_latency']:.1f} s, median {stats['median_latency']:.1f} s, max {stats['max_latency']:.1f} s")
+
+    with open(report, 'w') as f:
+        json.dump({
+            'cycle': args.date,
+            'schedule': args.schedule,
+            'speedup': args.speedup,
+            'jobs': [{k: job[k] for k in ('name', 'product', 'last_input', 'released', 'finished', 'latency', 'rc', 'fatal', 'log')}
+                     for job in jobs],
+            'summary': summary
+        }, f, indent=1)
+    print(f'Wrote {report}')
+    return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,412 @@
+# Program Name: SPC POST site time series
+# Affiliation: NOAA/NWS/Storm Prediction Center
+# Abstract: Probability time series at a list of sites (airports, NWS offices)
+#           from the HREF Calibrated Thunder and HREF/SREF Calibrated Severe
+#           products of one cycle. The 212 grid point of each site is found once
+#           and kept in an index file, and only those points are kept from each
+#           product, so a cycle is one (site, product, hour) array.
+#
+# Usage:
+#   python site_series.py -s SITES -d YYYYMMDDHH [-o OUT] [-t THUNDER] [-v SEVERE]
+#                         [-c CAL4] [-p PRODUCT ...] [-x INDEX] [-n NPROCS] [-r RESULT]
+#
+#   SITES is a CSV of name,lat,lon (a header line is skipped). Products are
+#   read from OUT/{thunder,severe} unless THUNDER or SEVERE are given, where
+#   OUT is the spc_post.YYYYMMDD directory of the cycle. Thunder products use
+#   the HREF cycle hour. Severe products are read for both severe runs
+#   calibrated from the cycle (00/03 or 12/15) and labelled by run (e.g.
+#   tor_4hr.t03z). Thunder values are read from the cycle's product cube when
+#   it holds the hour. Severe 4-hour values are read from the calibrated
+#   4-hour store (spc_pickle/cal4) when it holds the hour, since the severe
+#   cube is whole percent and coarser than the grib2. Anything else is read
+#   from the grib2 file. RESULT is a .npz (values, sites, products, hours) or
+#   a .csv with one line per site, product and hour.
+
+import os
+import re
+import sys
+import csv
+import argparse
+import datetime
+from multiprocessing import Pool
+import numpy as np
+from scipy.spatial import cKDTree
+import ncepgrib2
+
+USH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, USH)
+sys.path.insert(0, os.path.join(USH, 'replay'))
+sys.path.insert(0, os.path.join(USH, 'href_calib_severe'))
+from replay_cycle import SEVERE_RUNS
+from calib_severe.io import cal4_store
+from spc_common import product_cube
+
+# Products: (directory key, filename pattern with the run hour and forecast hour)
+PRODUCTS = {
+    'thunder_1hr': ('thunder', r'hrefct\.t(?P<run>\d{2})z\.thunder_1hr\.f(?P<fh>\d{3})\.grib2$'),
+    'thunder_4hr': ('thunder', r'hrefct\.t(?P<run>\d{2})z\.thunder_4hr\.f(?P<fh>\d{3})\.grib2$'),
+    'thunder_full': ('thunder', r'hrefct\.t(?P<run>\d{2})z\.thunder_full\.f(?P<fh>\d{3})\.grib2$'),
+    'tor_4hr': ('severe', r'href_cal_tor\.t(?P<run>\d{2})z\.4hr\.f(?P<fh>\d{3})\.grib2$'),
+    'hail_4hr': ('severe', r'href_cal_hail\.t(?P<run>\d{2})z\.4hr\.f(?P<fh>\d{3})\.grib2$'),
+    'wind_4hr': ('severe', r'href_cal_wind\.t(?P<run>\d{2})z\.4hr\.f(?P<fh>\d{3})\.grib2$'),
+    'tor_24hr': ('severe', r'href_cal_tor\.t(?P<run>\d{2})z\.24hr\.f(?P<fh>\d{3})\.grib2$'),
+    'hail_24hr': ('severe', r'href_cal_hail\.t(?P<run>\d{2})z\.24hr\.f(?P<fh>\d{3})\.grib2$'),
+    'wind_24hr': ('severe', r'href_cal_wind\.t(?P<run>\d{2})z\.24hr\.f(?P<fh>\d{3})\.grib2$')
+}
+
+# Farthest a site can be from its grid point (degrees) before it is treated as
+# outside the grid (the 212 grid spacing is about 0.4 degrees)
+MAX_DISTANCE = 0.5
+
+
+def get_options():
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sites', type=str, metavar='SITES', required=True,
+                        help='CSV of name,lat,lon')
+    parser.add_argument('-d', '--date', type=str, metavar='YYYYMMDDHH', required=True,
+                        help='HREF cycle (YYYYMMDDHH, 00Z or 12Z)')
+    parser.add_argument('-o', '--out', type=str, metavar='', default=os.environ.get('COMOUTspc_post', ''),
+                        help='spc_post.YYYYMMDD directory of the cycle (default: $COMOUTspc_post)')
+    parser.add_argument('-t', '--thunder', type=str, metavar='', default=None,
+                        help='Location of the thunder grib2 files (default: OUT/thunder)')
+    parser.add_argument('-v', '--severe', type=str, metavar='', default=None,
+                        help='Location of the severe grib2 files (default: OUT/severe)')
+    parser.add_argument('-c', '--cal4', type=str, metavar='', default=None,
+                        help='Calibrated 4-hour severe store (default: OUT/spc_pickle/cal4)')
+    parser.add_argument('--uncapped', dest='cap', action='store_false', default=True,
+                        help='Read the uncapped severe grids from the store (default: the capped '
+                             'grids the operational jobs make)')
+    parser.add_argument('-p', '--products', nargs='+', metavar='', default=list(PRODUCTS),
+                        choices=list(PRODUCTS), help='Products to read (default: all)')
+    parser.add_argument('-x', '--index', type=str, metavar='', default=None,
+                        help='Site index file, written if missing and reused otherwise')
+    parser.add_argument('-n', '--nprocs', type=int, metavar='', default=1,
+                        help='Processes used to read the grib2 files (default: 1)')
+    parser.add_argument('-r', '--result', type=str, metavar='', default='site_series.npz',
+                        help='Output .npz or .csv (default: site_series.npz)')
+    return parser.parse_args()
+
+
+def load_sites(fname):
+    """Read a site list
+
+    :param fname: CSV of name,lat,lon (a header line is skipped)
+    :return: Tuple of (names, lats, lons) with a list and two 1D arrays
+    """
+
+    names, lats, lons = [], [], []
+    with open(fname) as f:
+        for row in csv.reader(f):
+            if len(row) < 3 or row[0].startswith('#'):
+                continue
+            try:
+                lat, lon = float(row[1]), float(row[2])
+            except ValueError:
+                continue  # header
+            names.append(row[0].strip())
+            lats.append(lat)
+            lons.append(lon)
+    return names, np.array(lats), np.array(lons)
+
+
+def build_index(names, lats, lons, grid_lats, grid_lons):
+    """Grid point of each site
+
+    :param names: List of site names
+    :param lats: 1D array of site latitudes
+    :param lons: 1D array of site longitudes
+    :param grid_lats: 2D array of grid latitudes
+    :param grid_lons: 2D array of grid longitudes (0 - 360 or -180 - 180)
+    :return: Dictionary with the names, lats, lons, flat grid index of each site
+        (-1 off the grid) and the grid shape
+    """
+
+    to180 = lambda lon: (np.asarray(lon) + 180.) % 360. - 180.
+    tree = cKDTree(np.dstack([grid_lats.ravel(), to180(grid_lons).ravel()])[0])
+    distance, points = tree.query(np.dstack([lats, to180(lons)])[0])
+    points = np.where(distance <= MAX_DISTANCE, points, -1)
+    return {'names': np.array(names), 'lats': np.asarray(lats), 'lons': np.asarray(lons),
+            'points': points.astype(np.int64), 'shape': np.array(grid_lats.shape)}
+
+
+def save_index(fname, index):
+    """Write a site index
+
+    :param fname: Location of the index file (.npz)
+    :param index: Dictionary from build_index()
+    """
+
+    tmp = f'{fname}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **index)
+    os.replace(tmp, fname)
+    return
+
+
+def load_index(fname):
+    """Read a site index
+
+    :param fname: Location of the index file (.npz)
+    :return: Dictionary from build_index(), or None if the file can't be read
+    """
+
+    try:
+        with np.load(fname) as x:
+            return {key: x[key] for key in x.files}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def read_grib(fname):
+    """Decode a single-message product file
+
+    :param fname: Location of the grib2 file
+    :return: 2D array with masked points (outside a region) as NaN
+    """
+
+    grb = ncepgrib2.Grib2Decode(fname, gribmsg=False)
+    grb = grb[0] if type(grb) is list else grb
+    return np.ma.filled(np.ma.asarray(grb.data(), dtype=np.float64), np.nan)
+
+
+def grid_latlons(fname):
+    """Lats and lons of the grid of a product file
+
+    :param fname: Location of the grib2 file
+    :return: Tuple of 2D lat and lon arrays
+    """
+
+    grb = ncepgrib2.Grib2Decode(fname, gribmsg=False)
+    grb = grb[0] if type(grb) is list else grb
+    return grb.grid()
+
+
+def find_products(dirs, cycle, products=list(PRODUCTS)):
+    """Product files of a cycle
+
+    :param dirs: Dictionary of locations with keys thunder and severe
+    :param cycle: Datetime object with the HREF cycle
+    :param products: List of products (keys of PRODUCTS)
+    :return: Dictionary of {product: {forecast hour: location}}, with severe
+        products labelled by run (e.g. tor_4hr.t03z)
+    """
+
+    runs = {'thunder': [cycle.strftime('%H')], 'severe': SEVERE_RUNS[cycle.strftime('%H')]}
+    listings = {}
+    found = {}
+    for product in products:
+        key, pattern = PRODUCTS[product]
+        if key not in listings:
+            try:
+                listings[key] = sorted(os.listdir(dirs[key]))
+            except OSError:
+                print(f'WARNING: Unable to list {dirs[key]}')
+                listings[key] = []
+        for run in runs[key]:
+            label = product if key == 'thunder' else f'{product}.t{run}z'
+            found[label] = {}
+            for fname in listings[key]:
+                match = re.match(pattern, fname)
+                if match is not None and match.group('run') == run:
+                    found[label][int(match.group('fh'))] = os.path.join(dirs[key], fname)
+    return found
+
+
+def store_hour(cal4_dir, cycle, fname, cap=True):
+    """Calibrated 4-hour store file holding the grids of a severe grib2 file
+
+    :param cal4_dir: Location of the store
+    :param cycle: Datetime object with the HREF cycle
+    :param fname: Location of an href_cal_*.4hr grib2 file
+    :param cap: True for the grids computed from capped tables
+    :return: Tuple of (store file, hazard), or None if the file is not a
+        4-hour severe product
+    """
+
+    match = re.match(r'href_cal_(?P<haz>\w+?)\.t(?P<run>\d{2})z\.4hr\.f(?P<fh>\d{3})\.grib2$',
+                     os.path.basename(fname))
+    if match is None:
+        return None
+
+    # The 00Z and 12Z runs name their files by HREF hour, 3 hours before the SREF hour
+    run = match.group('run')
+    fh = int(match.group('fh')) + (3 if run in ('00', '12') else 0)
+    store_file = cal4_store.cal4_fname(cal4_dir, cycle.strftime('%Y%m%d') + run, str(fh).zfill(3), cap)
+    return store_file, match.group('haz')
+
+
+def cube_values(fname, points):
+    """Site values of every hour in a product cube
+
+    :param fname: Cube filename (.dat)
+    :param points: 1D array of flat grid indices (-1 off the grid)
+    :return: Dictionary of 1D arrays keyed by (product, forecast hour), empty
+        if the cube does not exist
+    """
+
+    data, manifest = product_cube.open_cube(fname)
+    if data is None:
+        return {}
+    values = {}
+    flat = data.reshape(data.shape[:2] + (-1,))
+    for p, product in enumerate(manifest['products']):
+        for fh in manifest['hours'][product]:
+            site = flat[p, fh][np.clip(points, 0, None)].astype(np.float64)
+            site[(points < 0) | (site == manifest['missing'])] = np.nan
+            values[(product, fh)] = site
+    return values
+
+
+def read_task(task):
+    """Pool.map() wrapper that reads the site values of one product file
+
+    :param task: Tuple of (grib2 location, store location or None, hazard, flat grid index)
+    :return: 1D array of site values (NaN off the grid or if the file can't be read)
+    """
+
+    fname, store_file, haz, points = task
+    values = None
+    if store_file is not None:
+        grids = cal4_store.load(store_file, [haz])
+        if grids is not None:
+            # same precision as the grib2 packing (decimal scale factor 1)
+            values = np.round(grids[haz].astype(np.float64), 1)
+    if values is None:
+        try:
+            values = read_grib(fname)
+        except (OSError, ValueError):
+            print(f'WARNING: Unable to read {fname}')
+            return np.full(points.shape, np.nan)
+    values = values.ravel()
+    return np.where(points >= 0, values[np.clip(points, 0, None)], np.nan)
+
+
+def extract(index, files, cal4_dir=None, cycle=None, cap=True, nprocs=1, cube=None):
+    """Site values of every product and forecast hour
+
+    :param index: Dictionary from build_index()
+    :param files: Dictionary from find_products()
+    :param cal4_dir: (Optional) Calibrated 4-hour store to read the severe
+        4-hour values from
+    :param cycle: Datetime object with the HREF cycle (needed with cal4_dir)
+    :param cap: True for the grids computed from capped tables
+    :param nprocs: Number of processes to read the files with
+    :param cube: (Optional) Product cube to read the hours it holds from
+        instead of the grib2 files
+    :return: Tuple of (values, products, hours) with a 3D array (site,
+        product, hour) of probabilities (%), NaN where there is no value
+    """
+
+    products = list(files)
+    hours = sorted(set(fh for product in products for fh in files[product]))
+    values = np.full((len(index['points']), len(products), len(hours)), np.nan)
+    cubed = cube_values(cube, index['points']) if cube is not None else {}
+    tasks = []
+    slots = []
+    for p, product in enumerate(products):
+        for fh, fname in sorted(files[product].items()):
+            if (product, fh) in cubed:
+                values[:, p, hours.index(fh)] = cubed[(product, fh)]
+                continue
+            store = store_hour(cal4_dir, cycle, fname, cap) if cal4_dir is not None else None
+            tasks.append((fname, None, None, index['points']) if store is None
+                         else (fname, store[0], store[1], index['points']))
+            slots.append((p, hours.index(fh)))
+
+    if nprocs > 1 and len(tasks) > 1:
+        with Pool(min(nprocs, len(tasks))) as pool:
+            results = pool.map(read_task, tasks)
+    else:
+        results = [read_task(task) for task in tasks]
+    for (p, h), result in zip(slots, results):
+        values[:, p, h] = result
+    return values, products, hours
+
+
+def get_index(args, files):
+    """Site index from the index file, or built from the sites and a product grid
+
+    :param args: Parsed command line arguments
+    :param files: Dictionary from find_products()
+    :return: Dictionary from build_index(), or None if there is no product to
+        take the grid from
+    """
+
+    names, lats, lons = load_sites(args.sites)
+    if args.index is not None and os.path.exists(args.index):
+        index = load_index(args.index)
+        if (index is not None and list(index['names']) == names
+                and np.array_equal(index['lats'], lats) and np.array_equal(index['lons'], lons)):
+            return index
+        print(f'WARNING: {args.index} does not match {args.sites}, rebuilding it')
+
+    grid_file = next((fname for product in files for fname in files[product].values()), None)
+    if grid_file is None:
+        return None
+    index = build_index(names, lats, lons, *grid_latlons(grid_file))
+    if args.index is not None:
+        save_index(args.index, index)
+    return index
+
+
+def write_result(fname, index, values, products, hours):
+    """Write the site values
+
+    :param fname: Output location (.npz or .csv)
+    :param index: Dictionary from build_index()
+    :param values: 3D array from extract()
+    :param products: List of products
+    :param hours: List of forecast hours
+    """
+
+    if fname.endswith('.csv'):
+        with open(fname, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['site', 'lat', 'lon', 'product', 'fhour', 'value'])
+            for s, name in enumerate(index['names']):
+                for p, product in enumerate(products):
+                    for h, fh in enumerate(hours):
+                        if not np.isnan(values[s, p, h]):
+                            writer.writerow([name, index['lats'][s], index['lons'][s], product, fh,
+                                             f'{values[s, p, h]:g}'])
+    else:
+        np.savez_compressed(fname, values=values, sites=index['names'], lats=index['lats'],
+                            lons=index['lons'], products=np.array(products), hours=np.array(hours))
+    return
+
+
+def main():
+    args = get_options()
+    cycle = datetime.datetime.strptime(args.date, '%Y%m%d%H')
+    if cycle.strftime('%H') not in SEVERE_RUNS:
+        print('FATAL ERROR: Only the 00Z and 12Z HREF cycles have products')
+        sys.exit(1)
+    out = args.out
+    dirs = {
+        'thunder': args.thunder if args.thunder is not None else os.path.join(out, 'thunder'),
+        'severe': args.severe if args.severe is not None else os.path.join(out, 'severe')
+    }
+    cal4_dir = args.cal4 if args.cal4 is not None else os.path.join(out, 'spc_pickle', 'cal4')
+
+    files = find_products(dirs, cycle, args.products)
+    index = get_index(args, files)
+    if index is None:
+        print(f'FATAL ERROR: No {" ".join(args.products)} files found for {cycle.strftime("%Y%m%d %H")}z')
+        sys.exit(1)
+    off_grid = [name for name, point in zip(index['names'], index['points']) if point < 0]
+    if off_grid:
+        print(f'WARNING: {len(off_grid)} sites are off the grid: {", ".join(off_grid)}')
+
+    cube = os.path.join(dirs['thunder'], f'hrefct.t{cycle.strftime("%H")}z.thunder_cube.dat')
+    values, products, hours = extract(index, files, cal4_dir=cal4_dir, cycle=cycle, cap=args.cap,
+                                      nprocs=args.nprocs, cube=cube)
+    write_result(args.result, index, values, products, hours)
+    print(f'{len(index["names"])} sites x {len(products)} products x {len(hours)} hours '
+          f'from {sum(len(f) for f in files.values())} files written to {args.result}')
+    return
+
+
+if __name__ == '__main__':
+    main()
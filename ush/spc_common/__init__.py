@@ -0,0 +1,4 @@
+"""
+Modules shared by HREF Calibrated Thunder, HREF/SREF Calibrated Severe and the
+tools next to them (tiled processing, regional subsets, product cubes)
+"""
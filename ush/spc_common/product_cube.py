@@ -0,0 +1,179 @@
+import os
+import json
+import fcntl
+import datetime
+from contextlib import contextmanager
+import numpy as np
+
+"""
+Per-cycle product cube written next to the grib2 files
+
+Every product of a cycle is kept in one uint8 (product, hour, ny, nx) array
+(.dat) of whole-percent probabilities, so readers can slice by time or space
+from a memmap without decoding grib2. Each (product, hour) grid is one
+contiguous chunk. A JSON manifest (.json) describes the layout and lists the
+hours written so far. Jobs fill their own hours in place as they finish;
+hours not written yet, and points masked in the grib2 (outside a region),
+hold MISSING.
+"""
+
+# Forecast hours (0 - 48) held by a cube
+NHOURS = 49
+
+# Value of hours not written yet and of masked points
+MISSING = 255
+
+FORMAT = 'spc_post product cube'
+VERSION = 1
+
+
+def manifest_fname(fname):
+    """Get the filename of the manifest of a cube
+
+    :param fname: Cube filename (.dat)
+    :return: String with the full path of the manifest
+    """
+
+    return fname[:-len('.dat')] + '.json'
+
+
+@contextmanager
+def locked(fname):
+    """Hold an exclusive lock for updating a cube
+
+    The data file itself is locked (and created empty if needed), so no lock
+    files are left next to the products.
+
+    :param fname: Cube file to lock
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(fname)), exist_ok=True)
+    with open(fname, 'ab') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_manifest(fname):
+    """Read the manifest of a cube
+
+    :param fname: Cube filename (.dat)
+    :return: Dictionary, or None if the cube does not exist
+    """
+
+    try:
+        with open(manifest_fname(fname)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(fname, manifest):
+    """Write the manifest of a cube atomically
+
+    :param fname: Cube filename (.dat)
+    :param manifest: Dictionary from new_manifest()
+    """
+
+    manifest['updated'] = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    tmp = f'{manifest_fname(fname)}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_fname(fname))
+    return
+
+
+def new_manifest(fname, products, shape, cycle, nhours=NHOURS):
+    """Describe a new cube
+
+    :param fname: Cube filename (.dat)
+    :param products: List of product names in cube order
+    :param shape: Shape of the grid (ny, nx)
+    :param cycle: Datetime object with the cycle
+    :param nhours: Number of forecast hours held by the cube
+    :return: Dictionary
+    """
+
+    return {
+        'format': FORMAT,
+        'version': VERSION,
+        'data': os.path.basename(fname),
+        'cycle': cycle.strftime('%Y%m%d%H'),
+        'grid': 'NCEP 212',
+        'dtype': 'uint8',
+        'order': 'C',
+        'dims': ['product', 'hour', 'y', 'x'],
+        'shape': [len(products), nhours] + list(shape),
+        'chunks': [1, 1] + list(shape),
+        'units': '%',
+        'missing': MISSING,
+        'products': list(products),
+        'hours': {product: [] for product in products}
+    }
+
+
+def to_uint8(grid):
+    """Whole-percent probabilities of a grid
+
+    :param grid: 2D array (or masked array) of probabilities (%)
+    :return: 2D uint8 array with masked and NaN points as MISSING
+    """
+
+    grid = np.ma.masked_invalid(np.ma.asarray(grid, dtype=np.float64))
+    values = np.clip(np.around(np.ma.getdata(grid)), 0, 100)
+    values[np.ma.getmaskarray(grid)] = MISSING
+    return values.astype(np.uint8)
+
+
+def write(fname, product, fhour, grid, products, cycle):
+    """Write one hour of one product into the cube in place
+
+    The cube is created on the first write. The grid is flushed before the
+    manifest lists the hour, so readers never see a partially written hour.
+
+    :param fname: Cube filename (.dat)
+    :param product: Product name (one of products)
+    :param fhour: Forecast hour
+    :param grid: 2D array of probabilities (%)
+    :param products: List of every product of the cube, in cube order
+    :param cycle: Datetime object with the cycle
+    """
+
+    with locked(fname):
+        manifest = read_manifest(fname)
+        if (manifest is None or manifest['products'] != list(products)
+                or manifest['cycle'] != cycle.strftime('%Y%m%d%H')
+                or os.path.getsize(fname) != int(np.prod(manifest['shape']))):
+            manifest = new_manifest(fname, products, grid.shape, cycle)
+            data = np.memmap(fname, dtype=np.uint8, mode='w+', shape=tuple(manifest['shape']))
+            data[:] = MISSING
+        else:
+            data = np.memmap(fname, dtype=np.uint8, mode='r+', shape=tuple(manifest['shape']))
+        data[manifest['products'].index(product), fhour] = to_uint8(grid)
+        data.flush()
+        del data
+
+        if fhour not in manifest['hours'][product]:
+            manifest['hours'][product] = sorted(manifest['hours'][product] + [fhour])
+        save_manifest(fname, manifest)
+    return
+
+
+def open_cube(fname):
+    """Map a cube read-only without reading it
+
+    :param fname: Cube filename (.dat)
+    :return: Tuple of the (product, hour, ny, nx) memmap and the manifest, or
+        None, None if the cube does not exist
+    """
+
+    manifest = read_manifest(fname)
+    if manifest is None:
+        return None, None
+    try:
+        data = np.memmap(fname, dtype=np.uint8, mode='r', shape=tuple(manifest['shape']))
+    except (OSError, ValueError):
+        return None, None
+    return data, manifest
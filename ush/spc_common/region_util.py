@@ -0,0 +1,115 @@
+import os
+import numpy as np
+
+"""
+Regional subsets for case studies and quick re-runs
+
+A region is a lat/lon box (west, south, east, north) given directly or by
+name. Only the SREF 40 km cells inside the box are forecast; the 3 km fields
+are cropped to the part of the grid that can reach those cells.
+"""
+
+# Named regions: (west, south, east, north) in degrees
+REGIONS = {
+    'northeast': (-80.5, 39.5, -66.5, 47.5),
+    'mid_atlantic': (-82.5, 36.0, -73.5, 42.5),
+    'southeast': (-92.0, 29.5, -75.0, 37.0),
+    'florida': (-88.0, 24.5, -79.5, 31.5),
+    'ohio_valley': (-91.5, 36.0, -80.0, 42.0),
+    'great_lakes': (-93.0, 41.0, -75.5, 49.0),
+    'midwest': (-97.5, 36.0, -84.0, 49.0),
+    'northern_plains': (-105.0, 42.5, -95.5, 49.0),
+    'central_plains': (-104.5, 35.5, -94.0, 43.5),
+    'southern_plains': (-104.0, 30.0, -93.5, 37.5),
+    'texas': (-106.7, 25.8, -93.5, 36.5),
+    'rockies': (-114.0, 35.0, -102.0, 49.0),
+    'southwest': (-120.0, 31.3, -103.0, 37.5),
+    'california': (-124.5, 32.5, -114.0, 42.0),
+    'northwest': (-125.0, 42.0, -111.0, 49.0)
+}
+
+# Margin (degrees) added to the box when cropping 3 km fields, so the 3 km
+# points nearest to the edge cells are kept
+MARGIN = 0.25
+
+
+def get_bbox(region=None, bbox=None):
+    """Lat/lon box of a region
+
+    :param region: (Optional) Name of a region in REGIONS
+    :param bbox: (Optional) String 'west,south,east,north' (degrees), used if
+        no region is given
+    :return: Tuple (west, south, east, north), or None for the whole domain
+    """
+
+    if region:
+        if region not in REGIONS:
+            raise ValueError(f'Unknown region {region}, choose from {", ".join(sorted(REGIONS))}')
+        return REGIONS[region]
+    if not bbox:
+        return None
+    west, south, east, north = [float(v) for v in bbox.split(',')]
+    if south >= north:
+        raise ValueError(f'Bad bbox {bbox}, expected west,south,east,north')
+    return west, south, east, north
+
+
+def bbox_tag(bbox):
+    """Short name of a box for cache and store filenames
+
+    :param bbox: Tuple from get_bbox()
+    :return: String such as 104.0W30.0N93.5W37.5N
+    """
+
+    west, south, east, north = bbox
+    lon = lambda v: f'{abs(v):.1f}{"W" if v < 0 else "E"}'
+    lat = lambda v: f'{abs(v):.1f}{"S" if v < 0 else "N"}'
+    return f'{lon(west)}{lat(south)}{lon(east)}{lat(north)}'
+
+
+def region_dir(base, bbox):
+    """Directory holding the output of a region run
+
+    Region runs keep their grids, stores and caches under region_<box> so
+    they never overwrite the full-domain products of the cycle.
+
+    :param base: Directory of the full-domain output
+    :param bbox: Tuple from get_bbox(), or None for the full domain
+    :return: String with the directory (base itself for the full domain)
+    """
+
+    if bbox is None:
+        return base
+    return os.path.join(base, 'region_' + bbox_tag(bbox))
+
+
+def in_bbox(lats, lons, bbox, margin=0.):
+    """Points of a grid inside a box
+
+    :param lats: 2D array of latitudes
+    :param lons: 2D array of longitudes (0 - 360 or -180 - 180)
+    :param bbox: Tuple from get_bbox()
+    :param margin: Degrees added on every side
+    :return: 2D boolean array
+    """
+
+    west, south, east, north = bbox
+    lons = (np.asarray(lons) - (west - margin)) % 360
+    return ((lats >= south - margin) & (lats <= north + margin)
+            & (lons <= (east - west + 2 * margin) % 360))
+
+
+def get_window(points, halo=0):
+    """Smallest rows/columns block holding a set of points, plus a halo
+
+    :param points: 2D boolean array
+    :param halo: Grid points added on every side (clipped at the edges)
+    :return: Tuple of (row slice, column slice)
+    """
+
+    rows = np.flatnonzero(points.any(axis=1))
+    cols = np.flatnonzero(points.any(axis=0))
+    if rows.size == 0:
+        return slice(0, 0), slice(0, 0)
+    return (slice(max(rows[0] - halo, 0), min(rows[-1] + 1 + halo, points.shape[0])),
+            slice(max(cols[0] - halo, 0), min(cols[-1] + 1 + halo, points.shape[1])))
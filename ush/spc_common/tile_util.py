@@ -0,0 +1,95 @@
+import numpy as np
+
+"""
+Tiled processing of 3 km fields
+
+A field is split into row/column tiles. Each tile is extended by a halo at
+least as wide as the reach of the operator (structure element or kernel
+radius), the operator runs on the extended tile, and only the tile itself is
+copied back. Halos are clipped at the edges of the domain, so the domain
+edges are handled exactly as on the whole field and the stitched result is
+identical to the whole-domain computation.
+"""
+
+
+def get_tiles(shape, tile, halo=0):
+    """Split a grid into tiles with halos
+
+    :param shape: Shape of the grid (rows, columns)
+    :param tile: Tile size, an int for square tiles or (rows, columns)
+    :param halo: Halo width in grid points
+    :return: List of (inner, outer, local) tuples of slice pairs: the tile in
+        the grid, the tile plus halo in the grid and the tile within the tile
+        plus halo
+    """
+
+    if np.isscalar(tile):
+        tile = (tile, tile)
+    tiles = []
+    for y0 in range(0, shape[0], tile[0]):
+        y1 = min(y0 + tile[0], shape[0])
+        oy0, oy1 = max(y0 - halo, 0), min(y1 + halo, shape[0])
+        for x0 in range(0, shape[1], tile[1]):
+            x1 = min(x0 + tile[1], shape[1])
+            ox0, ox1 = max(x0 - halo, 0), min(x1 + halo, shape[1])
+            tiles.append(((slice(y0, y1), slice(x0, x1)),
+                          (slice(oy0, oy1), slice(ox0, ox1)),
+                          (slice(y0 - oy0, y1 - oy0), slice(x0 - ox0, x1 - ox0))))
+    return tiles
+
+
+def apply_task(task):
+    """Pool.map() wrapper that runs an operator on one tile"""
+
+    func, arrays, args = task
+    return func(*arrays, *args)
+
+
+def map_tiles(func, arrays, tile, halo=0, args=(), pool=None):
+    """Run a local operator tile by tile and stitch the results
+
+    :param func: Operator taking the tiles of arrays (plus args) and returning
+        an array with the shape of the tile plus halo. Must be a module-level
+        function when a pool is used.
+    :param arrays: List of 2D arrays with the same shape
+    :param tile: Tile size (see get_tiles())
+    :param halo: Halo width in grid points, at least the reach of func
+    :param args: Other arguments of func
+    :param pool: (Optional) multiprocessing Pool to run the tiles in
+    :return: Array with the shape of arrays[0]
+    """
+
+    tiles = get_tiles(arrays[0].shape, tile, halo)
+    tasks = [(func, [a[outer] for a in arrays], args) for _, outer, _ in tiles]
+    results = pool.map(apply_task, tasks) if pool is not None else map(apply_task, tasks)
+
+    out = None
+    for (inner, _, local), result in zip(tiles, results):
+        if out is None:
+            out = np.empty(arrays[0].shape, dtype=result.dtype)
+        out[inner] = result[local]
+    return out
+
+
+def reduce_tiles(func, arrays, tile, reduce, args=(), pool=None):
+    """Run an operator tile by tile (no halo) and combine the results
+
+    :param func: Operator taking the tiles of arrays (plus args), e.g. a
+        scatter to a coarser grid. Must be a module-level function when a pool
+        is used.
+    :param arrays: List of 2D arrays with the same shape
+    :param tile: Tile size (see get_tiles())
+    :param reduce: Binary function combining two results (e.g. np.logical_or)
+    :param args: Other arguments of func
+    :param pool: (Optional) multiprocessing Pool to run the tiles in
+    :return: Combined result
+    """
+
+    tiles = get_tiles(arrays[0].shape, tile)
+    tasks = [(func, [a[inner] for a in arrays], args) for inner, _, _ in tiles]
+    results = pool.map(apply_task, tasks) if pool is not None else map(apply_task, tasks)
+
+    out = None
+    for result in results:
+        out = result if out is None else reduce(out, result)
+    return out